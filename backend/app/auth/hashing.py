@@ -0,0 +1,117 @@
+"""
+Password hashing on a dedicated, bounded thread pool.
+
+bcrypt is slow on purpose: every hash or verification takes a few hundred
+milliseconds of CPU. Run directly in request handlers, a burst of logins
+takes one threadpool thread and one CPU core per request and slows down
+everything else the worker serves. PasswordHasher runs it on
+PASSWORD_HASH_WORKERS threads (bcrypt releases the GIL, so threads hash in
+parallel without blocking the event loop) and lets at most
+PASSWORD_HASH_MAX_QUEUE more calls wait for a thread. Past that, calls fail
+at once with PasswordHasherBusy, answered with 503 and Retry-After, instead
+of queueing behind the burst.
+
+hash and verify block the calling thread until the pool is done, which is
+fine in sync endpoints (they run on Starlette's threadpool). Coroutines
+await hash_async and verify_async instead, so the event loop keeps serving
+other requests meanwhile.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from passlib.context import CryptContext
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+
+class PasswordHasher:
+    def __init__(self):
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.pending = 0  # Running or waiting for a thread
+        self.max_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash"
+                )
+            return self._executor
+
+    def _submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Submit `fn(*args)` to the pool, or raise PasswordHasherBusy when it is full."""
+        with self._lock:
+            if self.pending >= settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_QUEUE:
+                self.rejected += 1
+                logger.warning(f"Password hashing saturated ({self.pending} pending), rejecting request.")
+                raise PasswordHasherBusy()
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+        submitted_at = time.perf_counter()
+
+        def timed() -> Any:
+            started_at = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                # Counted here rather than by the caller, which may stop waiting (cancelled coroutine)
+                with self._lock:
+                    self.wait_seconds += started_at - submitted_at
+                    self.hash_seconds += time.perf_counter() - started_at
+                    self.pending -= 1
+                    self.completed += 1
+
+        return self.executor.submit(timed)
+
+    def hash(self, password: str) -> str:
+        return self._submit(pwd_context.hash, password).result()
+
+    def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return self._submit(pwd_context.verify, plain_password, hashed_password).result()
+
+    async def hash_async(self, password: str) -> str:
+        return await asyncio.wrap_future(self._submit(pwd_context.hash, password))
+
+    async def verify_async(self, plain_password: str, hashed_password: str) -> bool:
+        return await asyncio.wrap_future(self._submit(pwd_context.verify, plain_password, hashed_password))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": settings.PASSWORD_HASH_WORKERS,
+                "max_queue": settings.PASSWORD_HASH_MAX_QUEUE,
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "wait_seconds": self.wait_seconds,
+                "hash_seconds": self.hash_seconds,
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_hasher = PasswordHasher()
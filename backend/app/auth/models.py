@@ -1,6 +1,6 @@
 # app/models/user.py
 from sqlalchemy import (
-    Column, Integer, String, DateTime, Boolean
+    Column, Integer, String, DateTime, Boolean, ForeignKey
 )
 from sqlalchemy.orm import relationship
 
@@ -19,7 +19,7 @@ class User(Base, TimeStampMixin):
     avatar_url = Column(String(512), nullable=True)
     yandex_oauth_access_token = Column(String, nullable=True)
     yandex_oauth_refresh_token = Column(String, nullable=True)
-    yandex_oauth_token_expires_at = Column(DateTime, nullable=True)
+    yandex_oauth_token_expires_at = Column(DateTime, nullable=True, index=True) # Proactive token refresh
     yandex_id = Column(String, nullable=True, unique=True, index=True) # Add Yandex ID
     is_superuser = Column(Boolean, nullable=False, default=False)
     is_active = Column(Boolean, nullable=False, default=True) # Optional: If user blocking is needed
@@ -29,4 +29,20 @@ class User(Base, TimeStampMixin):
     devices = relationship("Device", back_populates="owner")
 
     def __repr__(self):
-        return f"<User(id={self.id}, email='{self.email}', name='{self.name}')>"
\ No newline at end of file
+        return f"<User(id={self.id}, email='{self.email}', name='{self.name}')>"
+
+
+class OAuthAuthorizationCode(Base):
+    """
+    Authorization codes issued by /auth/authorize when OAUTH_CODE_BACKEND is
+    "database", see app/auth/oauth_codes.py. Only a digest of the code is stored.
+    """
+    __tablename__ = 'oauth_authorization_codes'
+
+    code_hash = Column(String(64), primary_key=True) # SHA-256 hex digest of the code
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True) # UTC
+
+
+# Register the models User.devices refers to, whichever module imports User first
+from app.devices import models as device_models  # noqa: E402,F401
@@ -0,0 +1,140 @@
+"""
+OAuth authorization codes issued by /auth/authorize and redeemed by /auth/token.
+
+A code is valid for OAUTH_CODE_TTL_SECONDS and can be redeemed once: taking
+it from the store and removing it is a single atomic step, so two
+concurrent exchanges of the same code can't both succeed.
+
+Codes live in process memory by default, which only works with a single
+worker since /auth/token must reach the process that issued the code. With
+OAUTH_CODE_BACKEND set to "database" they are kept in the
+oauth_authorization_codes table and shared by all workers. Expired codes are
+swept at most every OAUTH_CODE_SWEEP_INTERVAL_SECONDS when new codes are
+issued, so abandoned ones don't pile up.
+"""
+import hashlib
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Protocol, Tuple
+
+from sqlalchemy import delete, insert
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+from .models import OAuthAuthorizationCode
+
+
+class AuthorizationCodeBackend(Protocol):
+    def put(self, code: str, user_id: int, ttl_seconds: float) -> None:
+        ...
+
+    def pop(self, code: str) -> Optional[int]:
+        """Remove `code`; return its user id unless it was missing or expired."""
+        ...
+
+    def sweep(self) -> int:
+        """Remove expired codes; return how many."""
+        ...
+
+
+class InMemoryAuthorizationCodeBackend:
+    """Per-process codes; only usable with a single worker."""
+
+    def __init__(self):
+        self._codes: Dict[str, Tuple[int, float]] = {}  # code -> (user_id, expires_at)
+        self._lock = threading.Lock()
+
+    def put(self, code: str, user_id: int, ttl_seconds: float) -> None:
+        with self._lock:
+            self._codes[code] = (user_id, time.monotonic() + ttl_seconds)
+
+    def pop(self, code: str) -> Optional[int]:
+        with self._lock:
+            entry = self._codes.pop(code, None)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return entry[0]
+
+    def sweep(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [code for code, (_, expires_at) in self._codes.items() if expires_at <= now]
+            for code in expired:
+                del self._codes[code]
+        return len(expired)
+
+
+class DatabaseAuthorizationCodeBackend:
+    """Codes in the oauth_authorization_codes table, shared by all workers."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+
+    @staticmethod
+    def _digest(code: str) -> str:
+        return hashlib.sha256(code.encode()).hexdigest()
+
+    def put(self, code: str, user_id: int, ttl_seconds: float) -> None:
+        with self.engine.begin() as connection:
+            connection.execute(insert(OAuthAuthorizationCode).values(
+                code_hash=self._digest(code),
+                user_id=user_id,
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl_seconds),
+            ))
+
+    def pop(self, code: str) -> Optional[int]:
+        # DELETE ... RETURNING: only one of concurrent exchanges gets the row
+        with self.engine.begin() as connection:
+            row = connection.execute(
+                delete(OAuthAuthorizationCode)
+                .where(OAuthAuthorizationCode.code_hash == self._digest(code))
+                .returning(OAuthAuthorizationCode.user_id, OAuthAuthorizationCode.expires_at)
+            ).first()
+        if row is None or row.expires_at <= datetime.utcnow():
+            return None
+        return row.user_id
+
+    def sweep(self) -> int:
+        with self.engine.begin() as connection:
+            return connection.execute(
+                delete(OAuthAuthorizationCode).where(OAuthAuthorizationCode.expires_at <= datetime.utcnow())
+            ).rowcount
+
+
+class AuthorizationCodeStore:
+    def __init__(self, backend: Optional[AuthorizationCodeBackend] = None):
+        self._backend = backend
+        self._next_sweep = 0.0
+
+    @property
+    def backend(self) -> AuthorizationCodeBackend:
+        if self._backend is None:
+            if settings.OAUTH_CODE_BACKEND == "database":
+                from ..database.core import engine
+                self._backend = DatabaseAuthorizationCodeBackend(engine)
+            else:
+                self._backend = InMemoryAuthorizationCodeBackend()
+        return self._backend
+
+    def issue(self, user_id: int) -> str:
+        """A new single-use code for `user_id`."""
+        self._sweep_expired()
+        code = secrets.token_urlsafe(32)
+        self.backend.put(code, user_id, settings.OAUTH_CODE_TTL_SECONDS)
+        return code
+
+    def redeem(self, code: str) -> Optional[int]:
+        """The user id of `code`, or None when it is unknown, expired or already redeemed."""
+        return self.backend.pop(code)
+
+    def _sweep_expired(self) -> None:
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + settings.OAUTH_CODE_SWEEP_INTERVAL_SECONDS
+        self.backend.sweep()
+
+
+authorization_code_store = AuthorizationCodeStore()
@@ -0,0 +1,82 @@
+"""
+Short-lived cache of authenticated users (principals).
+
+get_current_user resolves the user id of a valid access token through this
+cache, so authenticated requests only read the users table on a miss.
+Entries hold the column values of a user for PRINCIPAL_CACHE_TTL_SECONDS;
+at most PRINCIPAL_CACHE_MAX_SIZE users are kept, least recently used first
+out. Every hit returns a new User built from those values that isn't
+attached to any session: it can be read, but endpoints that change the
+user depend on get_current_db_user instead.
+
+Entries are dropped whenever a User row is updated or deleted through the
+ORM (profile, password, Yandex tokens, superuser flag), again once the
+change is committed. Other workers see the change when their entry expires.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, object_session
+
+from ..config import settings
+from .models import User
+
+USER_COLUMNS = tuple(attribute.key for attribute in inspect(User).column_attrs)
+
+
+class PrincipalCache:
+    def __init__(self):
+        self._entries: "OrderedDict[int, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int) -> Optional[User]:
+        """A detached copy of the cached user, or None when missing or expired."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or time.monotonic() - entry[0] > settings.PRINCIPAL_CACHE_TTL_SECONDS:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            values = entry[1]
+        return User(**values)
+
+    def put(self, user: User) -> None:
+        values = {column: getattr(user, column) for column in USER_COLUMNS}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic(), values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > settings.PRINCIPAL_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+principal_cache = PrincipalCache()
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target: User) -> None:
+    principal_cache.invalidate(target.id)
+    # A concurrent request may cache the old row until the change is committed
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault("changed_user_ids", set()).add(target.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed_users(session: Session) -> None:
+    for user_id in session.info.pop("changed_user_ids", ()):
+        principal_cache.invalidate(user_id)
@@ -4,29 +4,26 @@ from sqlalchemy.orm import Session # Changed from sqlalchemy.ext.asyncio import
 from typing import Annotated, List # Add List
 from fastapi.responses import RedirectResponse
 from fastapi.security import OAuth2PasswordRequestForm
-import uuid
-from threading import Lock
 
 from ..database.core import get_db
+from ..database.replicas import get_read_db
 
 from . import schemas
 from .service import auth_service # Ensure auth_service is imported correctly
 from . import security
-from ..dependencies import get_current_active_user
+from ..dependencies import get_current_active_user, get_current_db_user
 from .models import User
+from .hashing import password_hasher
+from .oauth_codes import authorization_code_store
 from .. import schemas as common_schemas
 from ..devices import schemas as device_schemas
-from ..devices.service import device_service as global_device_service
+from ..devices.yandex_sync import yandex_device_sync
 
 router = APIRouter(
     prefix="/auth",
     tags=["Authentication & Profile"]
 )
 
-# --- In-memory code store for demo OAuth flow ---
-oauth_code_store = {}
-oauth_code_store_lock = Lock()
-
 @router.post("/register", response_model=schemas.UserRead, status_code=status.HTTP_201_CREATED)
 def register_user( # Changed async async def to async def
     user_in: schemas.UserCreate,
@@ -102,6 +99,8 @@ def refresh_access_token( # Changed async async def to async def
 # --- Profile Endpoints ---
 
 CurrentUser = Annotated[User, Depends(get_current_active_user)]
+# Attached to the request's session; for endpoints that change the user
+CurrentDbUser = Annotated[User, Depends(get_current_db_user)]
 
 @router.get("/profile", response_model=schemas.UserRead)
 def read_users_me(current_user: CurrentUser): # Changed async async def to async def
@@ -113,7 +112,7 @@ def read_users_me(current_user: CurrentUser): # Changed async async def to async
 @router.patch("/profile", response_model=schemas.UserRead)
 def update_users_me( # Changed async async def to async def
     user_in: schemas.UserUpdate,
-    current_user: CurrentUser,
+    current_user: CurrentDbUser,
     db: Session = Depends(get_db), # Changed AsyncSession to Session
 ):
     """
@@ -125,7 +124,7 @@ def update_users_me( # Changed async async def to async def
 @router.put("/profile/password", response_model=common_schemas.Message)
 def update_users_password( # Changed async async def to async def
     password_in: schemas.UserPasswordUpdate,
-    current_user: CurrentUser,
+    current_user: CurrentDbUser,
     db: Session = Depends(get_db), # Changed AsyncSession to Session
 ):
     """
@@ -153,7 +152,7 @@ async def handle_yandex_callback(
             detail="Missing Yandex OAuth code."
         )
     try:
-        user = auth_service.process_yandex_oauth_callback(db=db, code=code)
+        user = await auth_service.process_yandex_oauth_callback(db=db, code=code)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -181,13 +180,16 @@ async def handle_yandex_callback(
     )
 
 # --- Yandex IoT Endpoints ---
-@router.post("/profile/yandex-iot/sync-devices", response_model=List[device_schemas.DeviceRead], status_code=status.HTTP_200_OK)
-def sync_yandex_iot_devices_endpoint(
-    current_user: CurrentUser,
+@router.post("/profile/yandex-iot/sync-devices", response_model=device_schemas.YandexDeviceSyncSummary, status_code=status.HTTP_200_OK)
+async def sync_yandex_iot_devices_endpoint(
+    current_user: CurrentDbUser,
     db: Session = Depends(get_db),
 ):
     """
     Fetch devices from user's Yandex IoT account and sync them as devices.
+
+    Only the changes since the last sync are applied; returns the ids of the
+    created, updated and deleted devices.
     """
     if not current_user.yandex_oauth_access_token:
         raise HTTPException(
@@ -196,12 +198,7 @@ def sync_yandex_iot_devices_endpoint(
         )
     
     try:
-        synced_devices = auth_service.sync_user_yandex_iot_devices(
-            db=db, 
-            user=current_user, 
-            device_service_instance=global_device_service
-        )
-        return synced_devices
+        return await yandex_device_sync.sync_user(db=db, user=current_user)
     except HTTPException as e:
         raise e
     except Exception as e:
@@ -231,10 +228,8 @@ def oauth_authorize_endpoint(
     # TODO: Validate client_id, redirect_uri, and implement user consent/authentication
 
     # Simulate successful authorization and generate a unique code
-    code = str(uuid.uuid4())
     # For demo: associate code with user_id=1
-    with oauth_code_store_lock:
-        oauth_code_store[code] = {"user_id": 1}
+    code = authorization_code_store.issue(user_id=1)
 
     from urllib.parse import urlencode
     params = {"code": code}
@@ -274,19 +269,16 @@ async def oauth_token_endpoint(
     # For now, we trust the code as it's single-use and short-lived.
     
     # Validate code
-    print(f"Checking code in store. Current codes: {list(oauth_code_store.keys())}")
-    with oauth_code_store_lock:
-        code_data = oauth_code_store.pop(code, None)
-    
-    if not code_data:
+    user_id = authorization_code_store.redeem(code)
+
+    if user_id is None:
         print(f"ERROR: Code '{code}' not found in store or already used")
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid or expired authorization code"
         )
     
-    print(f"Code validated, associated with user_id: {code_data['user_id']}")
-    user_id = code_data["user_id"]
+    print(f"Code validated, associated with user_id: {user_id}")
     user = auth_service.get_user_by_id(db=db, user_id=user_id)
     if not user:
         print(f"ERROR: User with id {user_id} not found in database")
@@ -320,7 +312,7 @@ CurrentSuperUser = Annotated[User, Depends(get_current_superuser)]
 @router.get("/users", response_model=schemas.UsersListResponse)
 def list_all_users(
     current_superuser: CurrentSuperUser,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     skip: int = Query(0, ge=0, description="Number of users to skip"),
     limit: int = Query(100, ge=1, le=1000, description="Maximum number of users to return"),
 ):
@@ -336,3 +328,11 @@ def list_all_users(
         skip=skip,
         limit=limit
     )
+
+
+@router.get("/password-hasher", response_model=schemas.PasswordHasherStats)
+def get_password_hasher_stats(current_superuser: CurrentSuperUser):
+    """
+    Password hashing pool counters of this worker. Requires superuser permissions.
+    """
+    return password_hasher.stats()
@@ -68,4 +68,14 @@ class UsersListResponse(BaseModel):
     users: List[UserRead]
     total: int
     skip: int
-    limit: int
\ No newline at end of file
+    limit: int
+
+class PasswordHasherStats(BaseModel):
+    workers: int
+    max_queue: int
+    pending: int
+    max_pending: int
+    completed: int
+    rejected: int  # Answered with 503 because the pool was full
+    wait_seconds: float  # Total time spent waiting for a pool thread
+    hash_seconds: float
@@ -1,15 +1,10 @@
 from datetime import datetime, timedelta, timezone
 from typing import Optional, Union, Any
 
-from jose import jwt, JWTError
-from passlib.context import CryptContext
-
 from app.config import settings
+from app.auth.hashing import password_hasher
+from app.auth.tokens import ALGORITHM, token_verifier
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-ALGORITHM = "HS256"
-SECRET_KEY = "your-secret-key"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
@@ -26,8 +21,8 @@ def create_access_token(subject: Union[str, Any], expires_delta: Optional[timede
     # Create payload with subject (user ID), type, and expiration
     to_encode = {"sub": str(subject), "exp": expire, "type": "access"}
     
-    # Sign the token
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Sign the token with the current key of the keyset
+    encoded_jwt = token_verifier.sign(to_encode)
     return encoded_jwt
 
 def create_refresh_token(subject: Union[str, Any], expires_delta: Optional[timedelta] = None) -> str:
@@ -43,19 +38,21 @@ def create_refresh_token(subject: Union[str, Any], expires_delta: Optional[timed
     # Create payload with subject (user ID), type, and expiration
     to_encode = {"sub": str(subject), "exp": expire, "type": "refresh"}
     
-    # Sign the token
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # Sign the token with the current key of the keyset
+    encoded_jwt = token_verifier.sign(to_encode)
     return encoded_jwt
 
+# Both run on the bounded hashing pool and raise PasswordHasherBusy when it is full
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_hasher.verify(plain_password, hashed_password)
 
 def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+    return password_hasher.hash(password)
+
+# For coroutines: waits for the pool without blocking the event loop
+async def get_password_hash_async(password: str) -> str:
+    return await password_hasher.hash_async(password)
 
+# Claims of a valid, unexpired token or None; cached per token, see tokens.py
 def decode_token(token: str) -> Optional[dict]:
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
-        return None
\ No newline at end of file
+    return token_verifier.decode(token)
\ No newline at end of file
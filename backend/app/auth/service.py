@@ -9,8 +9,8 @@ from datetime import datetime, timedelta # Add datetime, timedelta
 from . import models, schemas, security # Assuming security.py has get_password_hash
 from .models import User # Add User model import
 from ..core.config import settings # Import settings
-from ..devices import service as device_service_module # For type hinting and access to ItemService
-from ..devices import schemas as device_schemas # For creating item schemas
+from ..http import http_client # Shared connection pool for Yandex APIs
+from .yandex_tokens import yandex_token_refresher
 
 class AuthService:
 
@@ -26,7 +26,8 @@ class AuthService:
         result = db.execute(select(User).filter(User.id == user_id))
         return result.scalar_one_or_none()
 
-    def create_user(self, db: Session, user_in: schemas.UserCreate) -> User:
+    def create_user(self, db: Session, user_in: schemas.UserCreate, password_hash: Optional[str] = None) -> User:
+        """Create a user; `password_hash` is the hash of user_in.password when the caller already has it."""
         # Check if email exists
         existing_user = self.get_user_by_email(db, email=user_in.email)
         if existing_user:
@@ -42,7 +43,7 @@ class AuthService:
                 detail="Nickname already taken.",
             )
 
-        hashed_password = security.get_password_hash(user_in.password)
+        hashed_password = password_hash or security.get_password_hash(user_in.password)
         db_user = User(
             email=user_in.email,
             name=user_in.name,
@@ -112,49 +113,12 @@ class AuthService:
     YANDEX_USERINFO_URL = "https://login.yandex.ru/info?format=json"
     # YANDEX_IOT_API_BASE_URL will be accessed via settings.YANDEX_IOT_API_BASE_URL
 
-    def _refresh_yandex_oauth_token(self, db: Session, user: models.User) -> str:
+    async def _refresh_yandex_oauth_token(self, db: Session, user: models.User) -> str:
         """Refreshes the Yandex OAuth access token using the refresh token."""
-        if not user.yandex_oauth_refresh_token:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No Yandex refresh token available for user.")
+        # Single-flight per user, see yandex_tokens.py
+        return await yandex_token_refresher.refresh(db, user)
 
-        token_payload = {
-            "grant_type": "refresh_token",
-            "refresh_token": user.yandex_oauth_refresh_token,
-            "client_id": settings.YANDEX_CLIENT_ID,
-            "client_secret": settings.YANDEX_CLIENT_SECRET,
-        }
-        try:
-            with httpx.Client() as client:
-                token_response = client.post(self.YANDEX_TOKEN_URL, data=token_payload)
-                token_response.raise_for_status()
-                new_yandex_tokens = token_response.json()
-        except httpx.HTTPStatusError as e:
-            # If refresh fails (e.g. invalid refresh token), clear tokens to force re-auth
-            user.yandex_oauth_access_token = None
-            user.yandex_oauth_refresh_token = None
-            user.yandex_oauth_token_expires_at = None
-            db.commit()
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail=f"Failed to refresh Yandex token, re-authentication required: {e.response.text}"
-            )
-        except Exception as e:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error during Yandex token refresh: {str(e)}"
-            )
-
-        user.yandex_oauth_access_token = new_yandex_tokens["access_token"]
-        # Yandex might issue a new refresh token, update if provided
-        if "refresh_token" in new_yandex_tokens:
-            user.yandex_oauth_refresh_token = new_yandex_tokens["refresh_token"]
-        user.yandex_oauth_token_expires_at = datetime.utcnow() + timedelta(seconds=new_yandex_tokens["expires_in"])
-        
-        db.commit()
-        db.refresh(user)
-        return user.yandex_oauth_access_token
-
-    def _fetch_yandex_iot_user_info(self, db: Session, user: models.User) -> Dict[str, Any]:
+    async def _fetch_yandex_iot_user_info(self, db: Session, user: models.User) -> Dict[str, Any]:
         """Fetches user info (including devices) from Yandex IoT API."""
         if not user.yandex_oauth_access_token:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Yandex access token not available.")
@@ -162,22 +126,21 @@ class AuthService:
         access_token = user.yandex_oauth_access_token
         if user.yandex_oauth_token_expires_at and user.yandex_oauth_token_expires_at <= datetime.utcnow():
             print("Yandex OAuth token expired, attempting refresh.")
-            access_token = self._refresh_yandex_oauth_token(db, user)
+            access_token = await self._refresh_yandex_oauth_token(db, user)
         
         headers = {"Authorization": f"Bearer {access_token}"}
         url = f"{settings.YANDEX_IOT_API_BASE_URL}/v1.0/user/info"
         
         try:
-            with httpx.Client() as client:
-                response = client.get(url, headers=headers)
-                if response.status_code == 401: # Token might have been revoked or expired just now
-                    print("Yandex IoT API returned 401, attempting token refresh and retry.")
-                    access_token = self._refresh_yandex_oauth_token(db, user)
-                    headers = {"Authorization": f"Bearer {access_token}"}
-                    response = client.get(url, headers=headers) # Retry with new token
-                
-                response.raise_for_status()
-                return response.json()
+            response = await http_client.request("GET", url, headers=headers)
+            if response.status_code == 401: # Token might have been revoked or expired just now
+                print("Yandex IoT API returned 401, attempting token refresh and retry.")
+                access_token = await self._refresh_yandex_oauth_token(db, user)
+                headers = {"Authorization": f"Bearer {access_token}"}
+                response = await http_client.request("GET", url, headers=headers) # Retry with new token
+
+            response.raise_for_status()
+            return response.json()
         except httpx.HTTPStatusError as e:
             raise HTTPException(
                 status_code=e.response.status_code,
@@ -189,45 +152,7 @@ class AuthService:
                 detail=f"Error during Yandex IoT user info fetch: {str(e)}"
             )
 
-    def sync_user_yandex_iot_devices(
-        self, db: Session, user: models.User, device_service_instance: device_service_module.DeviceService
-    ) -> List[device_schemas.DeviceRead]:
-        """Fetches Yandex IoT devices for the user and syncs them as devices."""
-        iot_user_info = self._fetch_yandex_iot_user_info(db, user)
-        
-        yandex_devices = iot_user_info.get("devices", [])
-        synced_devices_pydantic = []
-
-        for device in yandex_devices:
-            external_id = device.get("id")
-            if not external_id:
-                continue # Skip devices without an ID
-
-            name = device.get("name", "Unnamed Yandex Device")
-            description_parts = []
-            if device.get("room"):
-                description_parts.append(f"Room: {device.get('room')}")
-            if device.get("type"):
-                description_parts.append(f"Type: {device.get('type')}")
-            description = ", ".join(description_parts) or "Yandex IoT Device"
-
-            device_create_schema = device_schemas.DeviceCreate(
-                name=name,
-                serial_number=external_id  # Use external_id as serial_number
-            )
-            
-            # create_device will check for existence and return existing or new
-            device_model = device_service_instance.create_device(
-                db=db, device_in=device_create_schema, owner_id=user.id 
-            )
-            db.refresh(device_model, attribute_names=["owner"])
-            synced_devices_pydantic.append(
-                device_schemas.DeviceRead.model_validate(device_model, from_attributes=True)
-            )
-        
-        return synced_devices_pydantic
-
-    def process_yandex_oauth_callback(self, db: Session, code: str) -> models.User:
+    async def process_yandex_oauth_callback(self, db: Session, code: str) -> models.User:
         # 1. Exchange authorization code for Yandex access token
         token_payload = {
             "grant_type": "authorization_code",
@@ -238,10 +163,9 @@ class AuthService:
         }
         try:
             # Corrected to use self.YANDEX_TOKEN_URL
-            with httpx.Client() as client:
-                token_response = client.post(self.YANDEX_TOKEN_URL, data=token_payload)
-                token_response.raise_for_status() # Raise an exception for HTTP errors
-                yandex_tokens = token_response.json()
+            token_response = await http_client.request("POST", self.YANDEX_TOKEN_URL, data=token_payload)
+            token_response.raise_for_status() # Raise an exception for HTTP errors
+            yandex_tokens = token_response.json()
         except httpx.HTTPStatusError as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -267,11 +191,10 @@ class AuthService:
         headers = {"Authorization": f"OAuth {yandex_access_token}"}
         try:
             # Corrected to use self.YANDEX_USERINFO_URL
-            with httpx.Client() as client:
-                userinfo_response = client.get(self.YANDEX_USERINFO_URL, headers=headers)
-                userinfo_response.raise_for_status()
-                yandex_user_info = userinfo_response.json()
-                print(yandex_user_info)
+            userinfo_response = await http_client.request("GET", self.YANDEX_USERINFO_URL, headers=headers)
+            userinfo_response.raise_for_status()
+            yandex_user_info = userinfo_response.json()
+            print(yandex_user_info)
         except httpx.HTTPStatusError as e:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -336,8 +259,9 @@ class AuthService:
         random_password = secrets.token_urlsafe(16)
         user_in_create = schemas.UserCreate(email=email, name=name, password=random_password)
         
-        # Assuming 'create_user' hashes the password and saves the user.
-        new_user = self.create_user(db, user_in=user_in_create) # Corrected: self.
+        # Hashed here so the bcrypt round doesn't block the event loop
+        password_hash = await security.get_password_hash_async(random_password)
+        new_user = self.create_user(db, user_in=user_in_create, password_hash=password_hash)
 
         # Link Yandex ID and store tokens for the new user
         if hasattr(new_user, 'yandex_id'):
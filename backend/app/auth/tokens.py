@@ -0,0 +1,113 @@
+"""
+JWT signing keys and verification of access and refresh tokens.
+
+Tokens are signed with the key JWT_SIGNING_KEY_ID of JWT_KEYS and carry its
+id in their "kid" header; verification picks the key named by that header,
+so keys can be rotated by adding a new one, signing with it, and dropping
+the old one once the tokens it signed have expired. Tokens without a kid
+(issued before key ids were introduced) are verified with the "default"
+key. The keys are constructed once, not on every verification.
+
+Every client sends the same token with each request until it expires.
+TokenVerifier keeps the claims of verified tokens in an LRU keyed by a
+digest of the token, until the token's own expiry, so repeat requests skip
+signature verification and claim parsing: the cost is one hash and a dict
+lookup. Rejected tokens are never cached. At most JWT_CACHE_MAX_SIZE tokens
+are kept per worker.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from jose import JWTError, jwk, jwt
+from jose.backends.base import Key
+
+from ..config import settings
+
+ALGORITHM = "HS256"
+DEFAULT_KEY_ID = "default"
+# Signing key used when JWT_KEYS is empty
+DEFAULT_SECRET_KEY = "your-secret-key"
+
+
+class Keyset:
+    def __init__(self, secrets: Dict[str, str], signing_kid: str):
+        if signing_kid not in secrets:
+            raise ValueError(f"JWT signing key {signing_kid!r} is not in the keyset")
+        self.keys: Dict[str, Key] = {kid: jwk.construct(secret, ALGORITHM) for kid, secret in secrets.items()}
+        self.signing_kid = signing_kid
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        return jwt.encode(claims, self.keys[self.signing_kid], algorithm=ALGORITHM, headers={"kid": self.signing_kid})
+
+    def verify(self, token: str) -> Optional[Dict[str, Any]]:
+        """The claims of `token`, or None when it is malformed, expired or not signed by a known key."""
+        try:
+            key = self.keys.get(jwt.get_unverified_header(token).get("kid", DEFAULT_KEY_ID))
+            if key is None:
+                return None
+            return jwt.decode(token, key, algorithms=[ALGORITHM])
+        except JWTError:
+            return None
+
+
+class TokenVerifier:
+    def __init__(self):
+        self._keyset: Optional[Keyset] = None
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()  # digest -> (exp, claims)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def keyset(self) -> Keyset:
+        if self._keyset is None:
+            self._keyset = Keyset(settings.JWT_KEYS or {DEFAULT_KEY_ID: DEFAULT_SECRET_KEY}, settings.JWT_SIGNING_KEY_ID)
+        return self._keyset
+
+    def load_keys(self, secrets: Dict[str, str], signing_kid: str) -> None:
+        """Replace the keyset; tokens verified with the previous keys are verified again."""
+        keyset = Keyset(secrets, signing_kid)
+        with self._lock:
+            self._keyset = keyset
+            self._entries.clear()
+
+    def sign(self, claims: Dict[str, Any]) -> str:
+        return self.keyset.sign(claims)
+
+    def decode(self, token: str) -> Optional[Dict[str, Any]]:
+        """
+        The claims of a valid, unexpired token, or None.
+
+        Claims are shared between callers of the same token: don't modify them.
+        """
+        digest = hashlib.sha256(token.encode()).digest()
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[digest]
+            self.misses += 1
+
+        claims = self.keyset.verify(token)
+        exp = claims.get("exp") if claims is not None else None
+        if not isinstance(exp, (int, float)):
+            return claims
+        with self._lock:
+            self._entries[digest] = (exp, claims)
+            while len(self._entries) > settings.JWT_CACHE_MAX_SIZE:
+                self._entries.popitem(last=False)
+        return claims
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+token_verifier = TokenVerifier()
@@ -0,0 +1,208 @@
+"""
+Yandex OAuth token refresh, one at a time per user.
+
+Requests for a user whose access token has expired all need a new one at
+the same moment. YandexTokenRefresher keeps at most one refresh in flight
+per user; everyone else arriving meanwhile awaits the same result instead
+of calling the token endpoint again, which would also rotate the refresh
+token under the others. Across workers, the refresh holds the user row
+(FOR UPDATE SKIP LOCKED on PostgreSQL); a worker finding it locked waits
+for the other one's token instead of refreshing too.
+
+A background loop refreshes tokens expiring within
+YANDEX_TOKEN_REFRESH_AHEAD_SECONDS, at most YANDEX_TOKEN_REFRESH_CONCURRENCY
+at a time, so request paths normally find a valid token and never wait on
+the token endpoint.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+import httpx
+from fastapi import HTTPException, status
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..core.config import settings as oauth_settings  # Same client credentials as AuthService
+from ..http import http_client
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+YANDEX_TOKEN_URL = "https://oauth.yandex.ru/token"
+# How often a worker re-reads a user row another worker is refreshing
+LOCKED_POLL_SECONDS = 0.2
+
+
+class YandexTokenRefresher:
+    def __init__(self):
+        # user id -> refresh in flight; only touched from the event loop
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self, db: Session, user: User) -> str:
+        """
+        A new access token for `user`, joining the refresh already in flight if any.
+
+        `user` is reloaded from `db` afterwards, so it carries the new tokens.
+        """
+        token = await self._refresh_once(user.id, user.yandex_oauth_access_token)
+        db.refresh(user)
+        return token
+
+    def _refresh_once(self, user_id: int, stale_token: Optional[str]) -> "asyncio.Future[str]":
+        task = self._inflight.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._refresh(user_id, stale_token))
+            self._inflight[user_id] = task
+            task.add_done_callback(lambda done: self._finished(user_id, done))
+        # A caller going away must not cancel the refresh the others wait for
+        return asyncio.shield(task)
+
+    def _finished(self, user_id: int, task: asyncio.Task) -> None:
+        self._inflight.pop(user_id, None)
+        if not task.cancelled():
+            task.exception()  # Retrieved here in case all callers went away
+
+    async def _refresh(self, user_id: int, stale_token: Optional[str]) -> str:
+        # Imported here: database.core imports the auth service, which uses this module
+        from ..database.core import SessionFactory
+
+        with SessionFactory() as db:
+            user = db.execute(
+                select(User).where(User.id == user_id).with_for_update(skip_locked=True)
+            ).scalar_one_or_none()
+            if user is None:
+                return await self._wait_for_refresh(db, user_id, stale_token)
+            if user.yandex_oauth_access_token != stale_token and not self._expiring(user.yandex_oauth_token_expires_at):
+                # Refreshed by another worker since the caller read the user
+                return user.yandex_oauth_access_token
+            if not user.yandex_oauth_refresh_token:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No Yandex refresh token available for user.")
+
+            token_payload = {
+                "grant_type": "refresh_token",
+                "refresh_token": user.yandex_oauth_refresh_token,
+                "client_id": oauth_settings.YANDEX_CLIENT_ID,
+                "client_secret": oauth_settings.YANDEX_CLIENT_SECRET,
+            }
+            try:
+                token_response = await http_client.request("POST", YANDEX_TOKEN_URL, data=token_payload)
+                token_response.raise_for_status()
+                new_yandex_tokens = token_response.json()
+            except httpx.HTTPStatusError as e:
+                if not self._refresh_token_rejected(e.response):
+                    # Rate limited or Yandex unavailable: keep the tokens and try again later
+                    logger.warning(f"Yandex token refresh of user {user_id} failed with {e.response.status_code}.")
+                    raise HTTPException(
+                        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                        detail=f"Yandex token refresh failed ({e.response.status_code}), try again later."
+                    )
+                # The refresh token is invalid or revoked: clear tokens to force re-auth
+                user.yandex_oauth_access_token = None
+                user.yandex_oauth_refresh_token = None
+                user.yandex_oauth_token_expires_at = None
+                db.commit()
+                raise HTTPException(
+                    status_code=status.HTTP_401_UNAUTHORIZED,
+                    detail=f"Failed to refresh Yandex token, re-authentication required: {e.response.text}"
+                )
+            except Exception as e:
+                raise HTTPException(
+                    status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail=f"Error during Yandex token refresh: {str(e)}"
+                )
+
+            user.yandex_oauth_access_token = new_yandex_tokens["access_token"]
+            # Yandex might issue a new refresh token, update if provided
+            if "refresh_token" in new_yandex_tokens:
+                user.yandex_oauth_refresh_token = new_yandex_tokens["refresh_token"]
+            user.yandex_oauth_token_expires_at = datetime.utcnow() + timedelta(seconds=new_yandex_tokens["expires_in"])
+            access_token = user.yandex_oauth_access_token
+            db.commit()
+        logger.info(f"Refreshed Yandex token of user {user_id}.")
+        return access_token
+
+    async def _wait_for_refresh(self, db: Session, user_id: int, stale_token: Optional[str]) -> str:
+        """Wait for another worker holding the user row to commit its new token."""
+        deadline = asyncio.get_running_loop().time() + settings.HTTP_CLIENT_TIMEOUT_SECONDS
+        while asyncio.get_running_loop().time() < deadline:
+            await asyncio.sleep(LOCKED_POLL_SECONDS)
+            db.rollback()  # Start a new transaction to see the other worker's commit
+            row = db.execute(
+                select(User.yandex_oauth_access_token, User.yandex_oauth_refresh_token).where(User.id == user_id)
+            ).one_or_none()
+            if row is None or row.yandex_oauth_refresh_token is None:
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Yandex re-authentication required.")
+            if row.yandex_oauth_access_token != stale_token:
+                return row.yandex_oauth_access_token
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Yandex token refresh in progress, try again.")
+
+    @staticmethod
+    def _refresh_token_rejected(response: httpx.Response) -> bool:
+        """Whether the token endpoint refused the refresh token itself, as opposed to failing transiently."""
+        if response.status_code == status.HTTP_401_UNAUTHORIZED:
+            return True
+        if response.status_code != status.HTTP_400_BAD_REQUEST:
+            return False
+        try:
+            body = response.json()
+        except ValueError:
+            return False
+        return isinstance(body, dict) and body.get("error") == "invalid_grant"
+
+    @staticmethod
+    def _expiring(expires_at: Optional[datetime]) -> bool:
+        return expires_at is None or expires_at <= datetime.utcnow() + timedelta(seconds=settings.YANDEX_TOKEN_REFRESH_AHEAD_SECONDS)
+
+    # --- Background refresh ---
+
+    def start(self) -> None:
+        """Start refreshing tokens ahead of expiry; called from app.main.lifespan."""
+        if not settings.YANDEX_TOKEN_REFRESH_ENABLED:
+            logger.info("Proactive Yandex token refresh disabled.")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.refresh_expiring()
+            except Exception as e:
+                logger.error(f"Proactive Yandex token refresh failed: {e}")
+            await asyncio.sleep(settings.YANDEX_TOKEN_REFRESH_INTERVAL_SECONDS)
+
+    async def refresh_expiring(self) -> int:
+        """Refresh the tokens expiring within YANDEX_TOKEN_REFRESH_AHEAD_SECONDS; returns how many were due."""
+        from ..database.core import SessionFactory  # See _refresh
+
+        expiring_before = datetime.utcnow() + timedelta(seconds=settings.YANDEX_TOKEN_REFRESH_AHEAD_SECONDS)
+        with SessionFactory() as db:
+            due = db.execute(
+                select(User.id, User.yandex_oauth_access_token)
+                .where(User.yandex_oauth_refresh_token.is_not(None), User.yandex_oauth_token_expires_at < expiring_before)
+                .order_by(User.yandex_oauth_token_expires_at)
+                .limit(settings.YANDEX_TOKEN_REFRESH_BATCH_SIZE)
+            ).all()
+
+        semaphore = asyncio.Semaphore(settings.YANDEX_TOKEN_REFRESH_CONCURRENCY)
+
+        async def refresh_user(user_id: int, access_token: Optional[str]) -> None:
+            async with semaphore:
+                try:
+                    await self._refresh_once(user_id, access_token)
+                except HTTPException as e:
+                    logger.warning(f"Could not refresh Yandex token of user {user_id}: {e.detail}")
+
+        await asyncio.gather(*(refresh_user(row.id, row.yandex_oauth_access_token) for row in due))
+        return len(due)
+
+
+yandex_token_refresher = YandexTokenRefresher()
@@ -0,0 +1,106 @@
+"""
+Rule conditions: small Python expressions over the fields of a device message.
+
+    battery_level < 15
+    message == "motor_stuck"
+    status == "offline" or (battery_level is not None and battery_level < 5)
+
+Expressions are parsed once, checked against a whitelist of syntax (names,
+constants, comparisons, boolean and arithmetic operators; no calls,
+attributes or subscripts) and compiled to a code object that is evaluated
+against the message fields without builtins. Names missing from the message
+evaluate to None.
+
+Arithmetic only applies to numbers: `message * 100000000` or `[0] * 100000 * 100000`
+would otherwise allocate without bound on the MQTT thread. Literal strings
+and lists are rejected as operands when the condition is compiled; operands
+coming from message fields are checked at evaluation, where a non-number
+makes the condition False like any other type mismatch.
+"""
+import ast
+import operator
+from functools import lru_cache
+from numbers import Number
+from types import CodeType
+from typing import Any, Callable, Dict
+
+MAX_CONDITION_LENGTH = 500
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Mod,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+    ast.Name, ast.Load, ast.Constant, ast.List, ast.Tuple,
+)
+
+ARITHMETIC: Dict[str, Callable[[Any, Any], Any]] = {
+    "Add": operator.add, "Sub": operator.sub, "Mult": operator.mul, "Div": operator.truediv, "Mod": operator.mod,
+}
+# Name the compiled conditions call arithmetic through; user names can't start with "_"
+ARITHMETIC_FUNCTION = "_arithmetic"
+
+
+def _arithmetic(op: str, left: Any, right: Any) -> Any:
+    if not isinstance(left, Number) or not isinstance(right, Number):
+        raise TypeError(f"{op} of {type(left).__name__} and {type(right).__name__}")
+    return ARITHMETIC[op](left, right)
+
+
+class NumericArithmetic(ast.NodeTransformer):
+    """Rewrite `a <op> b` to `_arithmetic("<op>", a, b)`."""
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        self.generic_visit(node)
+        return ast.copy_location(ast.Call(
+            func=ast.Name(id=ARITHMETIC_FUNCTION, ctx=ast.Load()),
+            args=[ast.Constant(type(node.op).__name__), node.left, node.right],
+            keywords=[],
+        ), node)
+
+
+class MessageFields(dict):
+    """Fields of a message; unknown names are None instead of a NameError."""
+
+    def __missing__(self, key: str) -> Any:
+        return None
+
+
+def _is_sequence_literal(node: ast.AST) -> bool:
+    return isinstance(node, (ast.List, ast.Tuple)) or (
+        isinstance(node, ast.Constant) and isinstance(node.value, (str, bytes))
+    )
+
+
+@lru_cache(maxsize=1024)
+def compile_condition(expression: str) -> CodeType:
+    """Compile a condition; raises ValueError for invalid or disallowed syntax."""
+    if len(expression) > MAX_CONDITION_LENGTH:
+        raise ValueError(f"Condition is longer than {MAX_CONDITION_LENGTH} characters")
+    try:
+        tree = ast.parse(expression, mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"Invalid condition: {e.msg}")
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f"Unsupported syntax in condition: {type(node).__name__}")
+        if isinstance(node, ast.Name) and node.id.startswith("_"):
+            raise ValueError(f"Unsupported name in condition: {node.id}")
+        if isinstance(node, ast.BinOp) and (_is_sequence_literal(node.left) or _is_sequence_literal(node.right)):
+            raise ValueError("Arithmetic in conditions only applies to numbers")
+    tree = ast.fix_missing_locations(NumericArithmetic().visit(tree))
+    return compile(tree, "<condition>", "eval")
+
+
+def evaluate_condition(code: CodeType, fields: Dict[str, Any]) -> bool:
+    """
+    Evaluate a compiled condition; comparisons of mismatched types (e.g. None < 15) are False.
+
+    Other errors are raised, for the caller to report.
+    """
+    # Conditions can't name fields starting with "_", so dropping them frees the name for _arithmetic
+    names = MessageFields({key: value for key, value in fields.items() if not key.startswith("_")})
+    names[ARITHMETIC_FUNCTION] = _arithmetic
+    try:
+        return bool(eval(code, {"__builtins__": {}}, names))
+    except (TypeError, ZeroDivisionError):
+        return False
@@ -0,0 +1,26 @@
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, JSON, String
+from sqlalchemy.dialects.postgresql import JSONB
+
+from ..models import Base, TimeStampMixin
+
+
+# Reactions to device messages, evaluated on MQTT ingest, see app/automation/service.py
+class AutomationRule(Base, TimeStampMixin):
+    __tablename__ = "automation_rules"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    # None: every device of the user
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=True, index=True)
+    name = Column(String(100), nullable=False)
+    topic = Column(String(20), nullable=False)  # "info", "warning", "error" or "command" (command responses)
+    condition = Column(String(500), nullable=False)  # e.g. "battery_level < 15", see app/automation/conditions.py
+    # [{"type": "event" | "notify" | "command", ...}], see AutomationAction
+    actions = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    cooldown_seconds = Column(Integer, nullable=False, default=60)  # Per device, between two firings
+    enabled = Column(Boolean, nullable=False, default=True)
+
+    __table_args__ = (
+        # Rules are loaded per user
+        Index('ix_automation_rules_user_id_topic', user_id, topic),
+    )
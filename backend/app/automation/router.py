@@ -0,0 +1,108 @@
+from fastapi import APIRouter, Depends, HTTPException, status
+from sqlalchemy.orm import Session
+
+from ..auth.models import User
+from ..database.core import get_db
+from ..database.replicas import get_read_db
+from ..dependencies import get_current_active_user, get_current_admin_user
+from . import schemas
+from .service import rule_engine
+
+router = APIRouter(
+    prefix="/automation",
+    tags=["Automation"]
+)
+
+
+@router.get("/rules", response_model=schemas.AutomationRuleListResponse)
+async def list_rules(
+    db: Session = Depends(get_read_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get the current user's automation rules.
+    """
+    rules = rule_engine.list_rules(db=db, user_id=current_user.id)
+    return schemas.AutomationRuleListResponse(rules=rules, total=len(rules))
+
+
+@router.post("/rules", response_model=schemas.AutomationRuleRead, status_code=status.HTTP_201_CREATED)
+async def create_rule(
+    rule_in: schemas.AutomationRuleCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Create a rule reacting to device messages, e.g. a warning when the battery runs low:
+
+    ```json
+    {
+        "name": "Low battery",
+        "topic": "info",
+        "condition": "battery_level < 15",
+        "actions": [
+            {"type": "event", "event_type": "warning", "message": "Battery at $battery_level%"},
+            {"type": "notify", "message": "Battery at $battery_level%"}
+        ]
+    }
+    ```
+
+    or closing a device reporting a stuck motor:
+
+    ```json
+    {
+        "name": "Motor stuck",
+        "topic": "error",
+        "condition": "message == 'motor_stuck'",
+        "actions": [
+            {"type": "command", "capabilities": [{"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": false}}]}
+        ]
+    }
+    ```
+    """
+    try:
+        return rule_engine.create_rule(db=db, user_id=current_user.id, rule_in=rule_in)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/stats", response_model=schemas.AutomationStats)
+async def get_stats(current_user: User = Depends(get_current_admin_user)):
+    """
+    Rule evaluation counters of this worker. (Admin only)
+    """
+    return rule_engine.stats()
+
+
+@router.put("/rules/{rule_id}", response_model=schemas.AutomationRuleRead)
+async def update_rule(
+    rule_id: int,
+    rule_in: schemas.AutomationRuleUpdate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Replace an automation rule.
+    """
+    rule = rule_engine.get_rule(db=db, rule_id=rule_id)
+    if not rule or rule.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rule not found")
+    try:
+        return rule_engine.update_rule(db=db, rule=rule, rule_in=rule_in)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.delete("/rules/{rule_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_rule(
+    rule_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Delete an automation rule.
+    """
+    rule = rule_engine.get_rule(db=db, rule_id=rule_id)
+    if not rule or rule.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Rule not found")
+    rule_engine.delete_rule(db=db, rule=rule)
@@ -0,0 +1,82 @@
+from datetime import datetime
+from typing import Dict, List, Literal, Optional
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+from ..devices.schemas import DeviceCapabilityAction
+from .conditions import compile_condition
+
+RuleTopic = Literal["info", "warning", "error", "command"]
+
+
+class AutomationAction(BaseModel):
+    """
+    One reaction of a rule:
+
+    - event: record a device event (`event_type`, `message`)
+    - notify: push `message` to the user's live connections
+    - command: apply `capabilities` to the device (or to `device_id`)
+
+    `message` may reference message fields as $name, e.g. "Battery at $battery_level%".
+    """
+    type: Literal["event", "notify", "command"]
+    event_type: Literal["warning", "error"] = "warning"
+    message: Optional[str] = Field(None, max_length=500)
+    capabilities: Optional[List[DeviceCapabilityAction]] = None
+    device_id: Optional[int] = None
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.type in ("event", "notify") and not self.message:
+            raise ValueError(f"{self.type} actions need a message")
+        if self.type == "command" and not self.capabilities:
+            raise ValueError("command actions need capabilities")
+        return self
+
+
+class AutomationRuleBase(BaseModel):
+    name: str = Field(..., min_length=1, max_length=100)
+    device_id: Optional[int] = None
+    topic: RuleTopic
+    condition: str = Field(..., min_length=1, max_length=500)
+    actions: List[AutomationAction] = Field(..., min_length=1, max_length=10)
+    cooldown_seconds: int = Field(60, ge=0, le=7 * 24 * 3600)
+    enabled: bool = True
+
+    @field_validator("condition")
+    @classmethod
+    def check_condition(cls, condition: str) -> str:
+        compile_condition(condition)
+        return condition
+
+
+class AutomationRuleCreate(AutomationRuleBase):
+    pass
+
+
+class AutomationRuleUpdate(AutomationRuleBase):
+    pass
+
+
+class AutomationRuleRead(AutomationRuleBase):
+    id: int
+    created_at: datetime
+    updated_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class AutomationRuleListResponse(BaseModel):
+    rules: List[AutomationRuleRead]
+    total: int
+
+
+class AutomationStats(BaseModel):
+    messages: int  # Messages evaluated against at least one rule
+    evaluations: int  # Conditions evaluated
+    matches: int
+    fired: int  # Matches outside the cooldown, whose actions ran
+    errors: int
+    evaluation_seconds: float
+    loaded_users: int
+    fired_by_rule: Dict[int, int]
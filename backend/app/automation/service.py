@@ -0,0 +1,248 @@
+"""
+Automation rules evaluated on MQTT ingest.
+
+After a device message has been stored, MQTTClient.on_message passes it to
+RuleEngine.process. A user's enabled rules are loaded with one query,
+their conditions compiled once and indexed by (topic, device id), with None
+standing for rules that cover all of the user's devices, so a message only
+evaluates the rules of its own topic and device. Rule sets are cached per
+user for AUTOMATION_RULE_CACHE_TTL_SECONDS and dropped when the user changes
+rules through this worker.
+
+A rule fires at most once per device every cooldown_seconds, which also
+keeps command rules from re-triggering on their own command responses.
+Counters are per process.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from string import Template
+from types import CodeType
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..devices.models import Device, DeviceEvent
+from ..devices.realtime import device_event_hub, event_message
+from . import schemas
+from .conditions import compile_condition, evaluate_condition
+from .models import AutomationRule
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CompiledRule:
+    id: int
+    name: str
+    device_id: Optional[int]
+    condition: CodeType
+    actions: List[dict]
+    cooldown_seconds: int
+
+
+@dataclass
+class UserRules:
+    # (topic, device_id or None) -> rules
+    index: Dict[Tuple[str, Optional[int]], List[CompiledRule]]
+    loaded_at: float
+
+
+class RuleEngine:
+    def __init__(self):
+        self._users: Dict[int, UserRules] = {}
+        self._last_fired: Dict[Tuple[int, int], float] = {}  # (rule id, device id) -> monotonic time
+        # Rules are evaluated in the MQTT thread and changed from request handlers
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.evaluations = 0
+        self.matches = 0
+        self.fired = 0
+        self.errors = 0
+        self.evaluation_ns = 0
+        self.fired_by_rule: Dict[int, int] = {}
+
+    # --- Rules ---
+
+    def list_rules(self, db: Session, user_id: int) -> List[AutomationRule]:
+        return db.execute(
+            select(AutomationRule).where(AutomationRule.user_id == user_id).order_by(AutomationRule.id)
+        ).scalars().all()
+
+    def get_rule(self, db: Session, rule_id: int) -> Optional[AutomationRule]:
+        return db.get(AutomationRule, rule_id)
+
+    def create_rule(self, db: Session, user_id: int, rule_in: schemas.AutomationRuleCreate) -> AutomationRule:
+        """Raises ValueError for devices the user doesn't own or too many rules."""
+        self._check_devices(db, user_id, rule_in)
+        count = db.scalar(select(func.count(AutomationRule.id)).where(AutomationRule.user_id == user_id))
+        if count >= settings.AUTOMATION_MAX_RULES_PER_USER:
+            raise ValueError(f"User already has {count} automation rules")
+
+        rule = AutomationRule(user_id=user_id, **rule_in.model_dump(mode="json"))
+        db.add(rule)
+        db.commit()
+        db.refresh(rule)
+        self.invalidate(user_id)
+        return rule
+
+    def update_rule(self, db: Session, rule: AutomationRule, rule_in: schemas.AutomationRuleUpdate) -> AutomationRule:
+        self._check_devices(db, rule.user_id, rule_in)
+        for field, value in rule_in.model_dump(mode="json").items():
+            setattr(rule, field, value)
+        db.commit()
+        db.refresh(rule)
+        self.invalidate(rule.user_id)
+        return rule
+
+    def delete_rule(self, db: Session, rule: AutomationRule) -> None:
+        user_id = rule.user_id
+        db.delete(rule)
+        db.commit()
+        self.invalidate(user_id)
+
+    @staticmethod
+    def _check_devices(db: Session, user_id: int, rule_in: schemas.AutomationRuleBase) -> None:
+        device_ids = {action.device_id for action in rule_in.actions if action.device_id is not None}
+        if rule_in.device_id is not None:
+            device_ids.add(rule_in.device_id)
+        if not device_ids:
+            return
+        owned = set(db.execute(
+            select(Device.id).where(Device.id.in_(device_ids), Device.user_id == user_id)
+        ).scalars())
+        if owned != device_ids:
+            raise ValueError(f"Device {min(device_ids - owned)} not found")
+
+    # --- Ingest ---
+
+    def load(self, db: Session, user_id: int) -> UserRules:
+        index: Dict[Tuple[str, Optional[int]], List[CompiledRule]] = {}
+        for rule in db.execute(
+            select(AutomationRule).where(AutomationRule.user_id == user_id, AutomationRule.enabled == True)  # noqa: E712
+        ).scalars():
+            try:
+                condition = compile_condition(rule.condition)
+            except ValueError as e:
+                logger.error(f"Skipping automation rule {rule.id}: {e}")
+                continue
+            index.setdefault((rule.topic, rule.device_id), []).append(CompiledRule(
+                id=rule.id,
+                name=rule.name,
+                device_id=rule.device_id,
+                condition=condition,
+                actions=rule.actions,
+                cooldown_seconds=rule.cooldown_seconds,
+            ))
+        user_rules = UserRules(index=index, loaded_at=time.monotonic())
+        with self._lock:
+            self._users[user_id] = user_rules
+        return user_rules
+
+    def rules_for(self, db: Session, user_id: int, topic: str, device_id: int) -> List[CompiledRule]:
+        """Rules of `user_id` matching a message of `topic` from `device_id`."""
+        with self._lock:
+            user_rules = self._users.get(user_id)
+        if user_rules is None or time.monotonic() - user_rules.loaded_at > settings.AUTOMATION_RULE_CACHE_TTL_SECONDS:
+            user_rules = self.load(db, user_id)
+        return user_rules.index.get((topic, device_id), []) + user_rules.index.get((topic, None), [])
+
+    def invalidate(self, user_id: int) -> None:
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def process(self, db: Session, user_id: int, device_id: int, topic: str, payload: Dict[str, Any]) -> int:
+        """Evaluate the matching rules for a stored message and run the actions of those that fire."""
+        if not settings.AUTOMATION_ENABLED:
+            return 0
+        rules = self.rules_for(db, user_id, topic, device_id)
+        if not rules:
+            return 0
+
+        fields = {key: value for key, value in payload.items() if value is None or isinstance(value, (str, int, float, bool))}
+        fields["device_id"] = device_id
+        started = time.perf_counter_ns()
+        matched = [rule for rule in rules if self._matches(rule, device_id, fields)]
+        elapsed = time.perf_counter_ns() - started
+
+        now = time.monotonic()
+        firing = []
+        with self._lock:
+            self.messages += 1
+            self.evaluations += len(rules)
+            self.matches += len(matched)
+            self.evaluation_ns += elapsed
+            for rule in matched:
+                last_fired = self._last_fired.get((rule.id, device_id))
+                if last_fired is not None and now - last_fired < rule.cooldown_seconds:
+                    continue
+                self._last_fired[(rule.id, device_id)] = now
+                self.fired += 1
+                self.fired_by_rule[rule.id] = self.fired_by_rule.get(rule.id, 0) + 1
+                firing.append(rule)
+
+        for rule in firing:
+            try:
+                self._run_actions(db, rule, user_id, device_id, fields)
+            except Exception as e:
+                db.rollback()
+                with self._lock:
+                    self.errors += 1
+                logger.error(f"Automation rule {rule.id} failed for device {device_id}: {e}")
+        return len(firing)
+
+    def _matches(self, rule: CompiledRule, device_id: int, fields: Dict[str, Any]) -> bool:
+        try:
+            return evaluate_condition(rule.condition, fields)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            logger.error(f"Condition of automation rule {rule.id} failed for device {device_id}: {e!r}")
+            return False
+
+    def _run_actions(self, db: Session, rule: CompiledRule, user_id: int, device_id: int, fields: Dict[str, Any]) -> None:
+        # Imported here: the command service publishes through mqtt_client, which runs the rules
+        from ..devices.commands import device_command_service
+
+        for action in rule.actions:
+            message = Template(action["message"]).safe_substitute(fields) if action.get("message") else None
+            if action["type"] == "event":
+                event = DeviceEvent(device_id=device_id, event_type=action["event_type"], message=message)
+                db.add(event)
+                db.commit()
+                device_event_hub.publish(user_id, event_message(event))
+            elif action["type"] == "notify":
+                device_event_hub.publish(user_id, {
+                    "type": "rule",
+                    "rule_id": rule.id,
+                    "rule": rule.name,
+                    "device_id": device_id,
+                    "message": message,
+                })
+            elif action["type"] == "command":
+                target = action.get("device_id") or device_id
+                device_command_service.execute_actions(
+                    db=db,
+                    user_id=user_id,
+                    requested=[(str(target), [(capability["type"], capability["state"]) for capability in action["capabilities"]])],
+                )
+        logger.info(f"Automation rule {rule.id} fired for device {device_id}.")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "messages": self.messages,
+                "evaluations": self.evaluations,
+                "matches": self.matches,
+                "fired": self.fired,
+                "errors": self.errors,
+                "evaluation_seconds": self.evaluation_ns / 1e9,
+                "loaded_users": len(self._users),
+                "fired_by_rule": dict(self.fired_by_rule),
+            }
+
+
+rule_engine = RuleEngine()
@@ -1,6 +1,6 @@
 import secrets
 import warnings
-from typing import Annotated, Any, Literal
+from typing import Annotated, Any, Dict, Literal
 
 from pydantic import (
     AnyUrl,
@@ -35,8 +35,18 @@ class Settings(BaseSettings):
     SECRET_KEY: str = secrets.token_urlsafe(32)
 
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 8
+    # JWT signing keys by key id (app/auth/tokens.py): tokens are signed with
+    # JWT_SIGNING_KEY_ID and verified with the key named in their "kid" header.
+    # Empty: a single "default" key with the built-in secret
+    JWT_KEYS: Dict[str, str] = {}
+    JWT_SIGNING_KEY_ID: str = "default"
+    # Verified tokens cached per worker until they expire
+    JWT_CACHE_MAX_SIZE: int = 10000
     FRONTEND_HOST: str = "http://localhost:5173"
     ENVIRONMENT: Literal["local", "staging", "production"] = "local"
+    # Report per-request SQL statement count and time in X-DB-* response headers
+    # (always on for local environment)
+    SQL_DEBUG_HEADERS: bool = False
 
     BACKEND_CORS_ORIGINS: Annotated[
         list[AnyUrl] | str, BeforeValidator(parse_cors)
@@ -74,6 +84,16 @@ class Settings(BaseSettings):
     FIRST_SUPERUSER_USERNAME: EmailStr
     FIRST_SUPERUSER_PASSWORD: str
 
+    # Shared outgoing HTTP client (app/http.py)
+    HTTP_CLIENT_HTTP2: bool = True  # Needs the h2 package (httpx[http2])
+    HTTP_CLIENT_TIMEOUT_SECONDS: float = 10.0
+    HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    HTTP_CLIENT_MAX_CONNECTIONS: int = 100
+    HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    HTTP_CLIENT_MAX_RETRIES: int = 2
+    HTTP_CLIENT_RETRY_BASE_SECONDS: float = 0.5
+
     # Yandex OAuth Configuration
     YANDEX_CLIENT_ID: str = "YOUR_YANDEX_CLIENT_ID"
     YANDEX_CLIENT_SECRET: str = "YOUR_YANDEX_CLIENT_SECRET"
@@ -81,10 +101,110 @@ class Settings(BaseSettings):
     # and the one used by your frontend to initiate OAuth flow.
     YANDEX_REDIRECT_URI: str = "http://localhost:3000/auth/yandex/callback"
 
+    # Yandex Smart Home skill state notifications (app/devices/notifications.py)
+    # Disabled unless both the skill id and its OAuth token are set
+    YANDEX_SKILL_ID: str = ""
+    YANDEX_SKILL_OAUTH_TOKEN: str = ""
+    YANDEX_DIALOGS_API_BASE_URL: str = "https://dialogs.yandex.net"
+    YANDEX_NOTIFICATION_WINDOW_SECONDS: float = 1.0
+    YANDEX_NOTIFICATION_MAX_RETRIES: int = 3
+    YANDEX_NOTIFICATION_RETRY_BASE_SECONDS: float = 0.5
+
+    # Yandex OAuth tokens expiring within the window are refreshed in the background
+    # (app/auth/yandex_tokens.py)
+    YANDEX_TOKEN_REFRESH_ENABLED: bool = True
+    YANDEX_TOKEN_REFRESH_AHEAD_SECONDS: int = 600
+    YANDEX_TOKEN_REFRESH_INTERVAL_SECONDS: int = 60
+    YANDEX_TOKEN_REFRESH_BATCH_SIZE: int = 100
+    YANDEX_TOKEN_REFRESH_CONCURRENCY: int = 4
+
+    # Periodic sync of devices from linked Yandex IoT accounts (app/devices/yandex_sync.py)
+    YANDEX_SYNC_ENABLED: bool = True
+    YANDEX_SYNC_INTERVAL_SECONDS: int = 900
+    YANDEX_SYNC_CONCURRENCY: int = 4
+
     MQTT_USERNAME: str = "mosquitto_user"
     MQTT_PASSWORD: str = "mosquitto_password"
     MQTT_BROKER_HOST: str = "mosquitto"
     MQTT_BROKER_PORT: int = 1883
+    MQTT_MAX_INFLIGHT_MESSAGES: int = 100
+
+    # Command scheduler (app/devices/scheduler.py). Run times within the window are kept
+    # in memory; the window is reloaded from the database every SCHEDULER_POLL_SECONDS
+    SCHEDULER_ENABLED: bool = True
+    SCHEDULER_WINDOW_SECONDS: int = 300
+    SCHEDULER_POLL_SECONDS: int = 60
+    SCHEDULER_MAX_LOADED: int = 10000
+    SCHEDULER_BATCH_SIZE: int = 500
+    SCHEDULER_CLAIM_TIMEOUT_SECONDS: int = 300
+    SCHEDULER_MAX_LATENESS_SECONDS: int = 3600
+    SCHEDULER_MAX_PER_DEVICE: int = 100
+
+    # Automation rules evaluated on MQTT ingest (app/automation/service.py)
+    AUTOMATION_ENABLED: bool = True
+    AUTOMATION_RULE_CACHE_TTL_SECONDS: int = 60
+    AUTOMATION_MAX_RULES_PER_USER: int = 100
+
+    # Upper bound on the devices a single room/type group action can target
+    GROUP_ACTION_MAX_DEVICES: int = 500
+
+    # bcrypt pool (app/auth/hashing.py): calls past workers + queue get 503
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 16
+    PASSWORD_HASH_RETRY_AFTER_SECONDS: int = 1
+
+    # Authenticated users cached by get_current_user (app/auth/principals.py)
+    PRINCIPAL_CACHE_TTL_SECONDS: int = 30
+    PRINCIPAL_CACHE_MAX_SIZE: int = 10000
+
+    # Token-bucket rate limits (app/ratelimit/service.py); rates are tokens per second.
+    # "database" shares buckets between workers through the rate_limit_buckets table
+    RATE_LIMIT_ENABLED: bool = True
+    RATE_LIMIT_BACKEND: Literal["memory", "database"] = "memory"
+    RATE_LIMIT_USER_RATE: float = 5.0
+    RATE_LIMIT_USER_BURST: float = 20.0
+    RATE_LIMIT_DEVICE_RATE: float = 1.0
+    RATE_LIMIT_DEVICE_BURST: float = 5.0
+
+    # OAuth authorization codes of /auth/authorize (app/auth/oauth_codes.py). Use the
+    # "database" backend when running more than one worker
+    OAUTH_CODE_BACKEND: Literal["memory", "database"] = "memory"
+    OAUTH_CODE_TTL_SECONDS: int = 600
+    OAUTH_CODE_SWEEP_INTERVAL_SECONDS: int = 60
+
+    # Load shedding (app/ratelimit/middleware.py): regular and low priority requests
+    # are only admitted below their share of the concurrency limit
+    LOAD_SHEDDING_MAX_CONCURRENCY: int = 200
+    LOAD_SHEDDING_NORMAL_SHARE: float = 0.8
+    LOAD_SHEDDING_LOW_SHARE: float = 0.5
+    LOAD_SHEDDING_RETRY_AFTER_SECONDS: int = 1
+
+    # Read replicas (app/database/replicas.py) for read-only endpoints, as a comma-separated
+    # or JSON list of URLs; empty: everything is read from the primary
+    DATABASE_READ_REPLICA_URLS: Annotated[list[str] | str, BeforeValidator(parse_cors)] = []
+    DATABASE_REPLICA_HEALTH_CHECK_SECONDS: int = 10
+    DATABASE_REPLICA_MAX_LAG_SECONDS: float = 5.0
+    # Reads of a client go to the primary for this long after it changed something
+    DATABASE_READ_YOUR_WRITES_SECONDS: float = 5.0
+    DATABASE_READ_YOUR_WRITES_MAX_PINS: int = 100000
+
+    # Device history (device_events, device_commands) partitioning and retention
+    DEVICE_HISTORY_RETENTION_DAYS: int = 180
+    DEVICE_HISTORY_PARTITIONS_AHEAD: int = 3
+    DEVICE_HISTORY_MAINTENANCE_INTERVAL_SECONDS: int = 3600
+    DEVICE_HISTORY_PURGE_BATCH_SIZE: int = 5000
+
+    # Live device updates over WebSocket/SSE (app/devices/realtime.py)
+    REALTIME_QUEUE_SIZE: int = 100  # Pending messages per connection
+    REALTIME_MAX_DROPPED_MESSAGES: int = 500  # Disconnect consumers falling further behind
+    REALTIME_KEEPALIVE_SECONDS: int = 15
+
+    # Device state query (app/devices/state_cache.py)
+    DEVICE_STATE_CACHE_TTL_SECONDS: int = 60
+    # A device whose last `info` message is older than this is reported unreachable
+    DEVICE_PRESENCE_TIMEOUT_SECONDS: int = 300
+    # Commands for offline devices wait this long for the device to come back
+    DEVICE_COMMAND_QUEUE_TTL_SECONDS: int = 24 * 60 * 60
 
     def _check_default_secret(self, var_name: str, value: str | None) -> None:
         if value == "changethis":
@@ -1,12 +1,16 @@
 import logging
+import os
 import dotenv
 
-from sqlalchemy import create_engine, text
+from alembic import command
+from alembic.config import Config as AlembicConfig
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Generator
 
 from ..models import Base
 from ..config import settings
+from .instrumentation import install_query_instrumentation
 from ..auth.service import AuthService
 from ..auth import schemas
 
@@ -17,6 +21,7 @@ DATABASE_URL = str(settings.SQLALCHEMY_DATABASE_URI)
 
 # Create sync engine instance
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, echo=False)
+install_query_instrumentation(engine)
 
 # Create sessionmaker
 SessionFactory = sessionmaker(
@@ -37,10 +42,33 @@ def get_db() -> Generator[Session, None, None]:
     finally:
         session.close()
 
-# Init database schema via Base.metadata.create_all
+# Alembic migrations live next to this module
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "migrations")
+
+# Revision matching the schema the old Base.metadata.create_all bootstrap produced
+BASELINE_REVISION = "0001"
+
+def get_alembic_config() -> AlembicConfig:
+    alembic_cfg = AlembicConfig()
+    alembic_cfg.set_main_option("script_location", MIGRATIONS_DIR)
+    return alembic_cfg
+
+# Upgrade database schema to the latest migration
+def run_migrations() -> None:
+    alembic_cfg = get_alembic_config()
+    with engine.begin() as connection:
+        alembic_cfg.attributes["connection"] = connection
+        tables = set(inspect(connection).get_table_names())
+        if "users" in tables and "alembic_version" not in tables:
+            # Schema was created by create_all before migrations existed
+            logger.info(f"Stamping existing schema at baseline revision {BASELINE_REVISION}.")
+            command.stamp(alembic_cfg, BASELINE_REVISION)
+        command.upgrade(alembic_cfg, "head")
+
+# Init database schema via Alembic migrations
 def init_db() -> None:
     try:
-        Base.metadata.create_all(bind=engine)
+        run_migrations()
         logger.info("Database initialized successfully.")
         
         # Create the first superuser if it doesn't exist
@@ -89,6 +117,8 @@ def drop_db(cascade: bool = True) -> None:
             logger.info("Database schema dropped and recreated with CASCADE.")
         else:
             Base.metadata.drop_all(bind=engine)
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS alembic_version"))
             logger.info("Database dropped successfully.")
     except Exception as e:
         logger.info(f"Error dropping database: {e}")
@@ -0,0 +1,116 @@
+"""
+Per-request SQL statement counting.
+
+Every statement executed on an instrumented engine is attributed to the
+QueryStats of the current request (held in a context variable, so it
+follows the request into threadpool dependencies and endpoints). In debug
+mode QueryStatsMiddleware reports the totals in the X-DB-Statements and
+X-DB-Time-Ms response headers.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+STATEMENTS_HEADER = "X-DB-Statements"
+TIME_HEADER = "X-DB-Time-Ms"
+
+
+@dataclass
+class QueryStats:
+    statements: int = 0
+    duration: float = 0.0  # seconds
+
+    @property
+    def duration_ms(self) -> float:
+        return round(self.duration * 1000, 2)
+
+
+_current_stats: ContextVar[Optional[QueryStats]] = ContextVar("sql_query_stats", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started_at = conn.info["query_started_at"].pop()
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.duration += time.perf_counter() - started_at
+
+
+def install_query_instrumentation(engine: Engine) -> None:
+    """Attribute statements executed on `engine` to the current QueryStats."""
+    if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Collect statement counts for the enclosed block."""
+    stats = QueryStats()
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@contextmanager
+def statement_budget(max_statements: int) -> Iterator[QueryStats]:
+    """
+    Fail with AssertionError when the enclosed block runs more than `max_statements`.
+
+        with statement_budget(2):
+            device_service.list_devices(db)
+    """
+    with track_queries() as stats:
+        yield stats
+    assert stats.statements <= max_statements, (
+        f"Expected at most {max_statements} SQL statements, {stats.statements} were executed"
+    )
+
+
+def assert_statement_budget(response, max_statements: int) -> None:
+    """
+    Check an endpoint's statement count from its debug headers.
+
+        response = client.get("/api/v1.0/devices/")
+        assert_statement_budget(response, 2)
+    """
+    assert STATEMENTS_HEADER in response.headers, f"{STATEMENTS_HEADER} header missing; is SQL_DEBUG_HEADERS enabled?"
+    statements = int(response.headers[STATEMENTS_HEADER])
+    assert statements <= max_statements, (
+        f"{response.request.method} {response.request.url.path}: expected at most "
+        f"{max_statements} SQL statements, {statements} were executed"
+    )
+
+
+class QueryStatsMiddleware:
+    """ASGI middleware tracking SQL statements per HTTP request and reporting them in headers."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+            async def send_with_stats(message):
+                if message["type"] == "http.response.start":
+                    headers = list(message.get("headers", []))
+                    headers.append((STATEMENTS_HEADER.lower().encode(), str(stats.statements).encode()))
+                    headers.append((TIME_HEADER.lower().encode(), str(stats.duration_ms).encode()))
+                    message = {**message, "headers": headers}
+                await send(message)
+
+            await self.app(scope, receive, send_with_stats)
@@ -0,0 +1,133 @@
+"""Initial schema
+
+Mirrors the tables previously created by Base.metadata.create_all. Existing
+databases created that way are stamped at this revision by init_db.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('email', sa.String(length=255), nullable=False),
+        sa.Column('password_hash', sa.String(length=255), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('avatar_url', sa.String(length=512), nullable=True),
+        sa.Column('yandex_oauth_access_token', sa.String(), nullable=True),
+        sa.Column('yandex_oauth_refresh_token', sa.String(), nullable=True),
+        sa.Column('yandex_oauth_token_expires_at', sa.DateTime(), nullable=True),
+        sa.Column('yandex_id', sa.String(), nullable=True),
+        sa.Column('is_superuser', sa.Boolean(), nullable=False),
+        sa.Column('is_active', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_users_email', 'users', ['email'], unique=True)
+    op.create_index('ix_users_name', 'users', ['name'], unique=True)
+    op.create_index('ix_users_yandex_id', 'users', ['yandex_id'], unique=True)
+
+    # serial_numbers and devices reference each other; the serial_numbers.device_id
+    # foreign key is added once both tables exist.
+    op.create_table(
+        'serial_numbers',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.String(length=15), nullable=False),
+        sa.Column('is_free', sa.Boolean(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('device_id', sa.Integer(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE', onupdate='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_serial_numbers_id', 'serial_numbers', ['id'], unique=False)
+    op.create_index('ix_serial_numbers_value', 'serial_numbers', ['value'], unique=True)
+
+    op.create_table(
+        'devices',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('serial_number_id', sa.Integer(), nullable=False),
+        sa.Column('status', sa.String(length=50), nullable=False),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(length=50), nullable=False),
+        sa.Column('room', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['serial_number_id'], ['serial_numbers.id'], ondelete='CASCADE', onupdate='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE', onupdate='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_devices_id', 'devices', ['id'], unique=False)
+
+    with op.batch_alter_table('serial_numbers') as batch_op:
+        batch_op.create_foreign_key(
+            'serial_numbers_device_id_fkey', 'devices', ['device_id'], ['id'],
+            ondelete='CASCADE', onupdate='CASCADE',
+        )
+
+    op.create_table(
+        'device_statuses',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=True),
+        sa.Column('is_online', sa.Boolean(), nullable=True),
+        sa.Column('battery_level', sa.Integer(), nullable=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'device_commands',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=True),
+        sa.Column('command_type', sa.String(), nullable=True),
+        sa.Column('status', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('completed_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_table(
+        'device_events',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=True),
+        sa.Column('event_type', sa.String(), nullable=True),
+        sa.Column('message', sa.String(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id']),
+        sa.PrimaryKeyConstraint('id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('device_events')
+    op.drop_table('device_commands')
+    op.drop_table('device_statuses')
+    with op.batch_alter_table('serial_numbers') as batch_op:
+        batch_op.drop_constraint('serial_numbers_device_id_fkey', type_='foreignkey')
+    op.drop_index('ix_devices_id', table_name='devices')
+    op.drop_table('devices')
+    op.drop_index('ix_serial_numbers_value', table_name='serial_numbers')
+    op.drop_index('ix_serial_numbers_id', table_name='serial_numbers')
+    op.drop_table('serial_numbers')
+    op.drop_index('ix_users_yandex_id', table_name='users')
+    op.drop_index('ix_users_name', table_name='users')
+    op.drop_index('ix_users_email', table_name='users')
+    op.drop_table('users')
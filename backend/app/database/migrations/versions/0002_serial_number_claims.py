@@ -0,0 +1,32 @@
+"""Serial number claiming: factory line reservations and free-pool index
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 09:15:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('serial_numbers', sa.Column('factory_line', sa.String(length=50), nullable=True))
+    op.create_index(
+        'ix_serial_numbers_is_free_value', 'serial_numbers', ['is_free', 'value'], unique=False,
+        postgresql_where=sa.text('factory_line IS NULL'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_serial_numbers_is_free_value', table_name='serial_numbers')
+    with op.batch_alter_table('serial_numbers') as batch_op:
+        batch_op.drop_column('factory_line')
@@ -0,0 +1,38 @@
+"""Hot-path indexes for device lookups and history pages
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0003'
+down_revision: Union[str, None] = '0002'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_devices_user_id', 'devices', ['user_id'], unique=False)
+    op.create_index('ix_device_statuses_device_id', 'device_statuses', ['device_id'], unique=False)
+    op.create_index(
+        'ix_device_events_device_id_created_at', 'device_events',
+        ['device_id', sa.text('created_at DESC')], unique=False,
+    )
+    op.create_index(
+        'ix_device_commands_device_id_created_at', 'device_commands',
+        ['device_id', sa.text('created_at DESC')], unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_device_commands_device_id_created_at', table_name='device_commands')
+    op.drop_index('ix_device_events_device_id_created_at', table_name='device_events')
+    op.drop_index('ix_device_statuses_device_id', table_name='device_statuses')
+    op.drop_index('ix_devices_user_id', table_name='devices')
@@ -0,0 +1,115 @@
+"""Partition device_events and device_commands by month
+
+On PostgreSQL both tables are rebuilt as declaratively range partitioned
+tables on created_at, with a DEFAULT partition catching rows outside the
+pre-created months. Existing rows are copied over. Other dialects keep plain
+tables and only get created_at made non-nullable.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from datetime import date, datetime
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+COLUMNS = {
+    'device_events': "device_id integer REFERENCES devices (id), event_type varchar, message varchar",
+    'device_commands': "device_id integer REFERENCES devices (id), command_type varchar, status varchar, completed_at timestamp",
+}
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _partition_table(table: str) -> None:
+    legacy = f"{table}_legacy"
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+    op.execute(f"DROP INDEX ix_{table}_device_id_created_at")
+
+    # The partition key has to be part of the primary key
+    op.execute(
+        f"CREATE TABLE {table} ("
+        f" id integer NOT NULL DEFAULT nextval('{table}_id_seq'), {COLUMNS[table]},"
+        f" created_at timestamp NOT NULL DEFAULT timezone('utc', now()),"
+        f" PRIMARY KEY (id, created_at)"
+        f") PARTITION BY RANGE (created_at)"
+    )
+    op.execute(f"ALTER TABLE {legacy} ALTER COLUMN id DROP DEFAULT")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+
+    oldest = op.get_bind().execute(sa.text(f"SELECT min(created_at) FROM {legacy}")).scalar()
+    today = datetime.utcnow().date()
+    month = date((oldest or datetime.utcnow()).year, (oldest or datetime.utcnow()).month, 1)
+    last = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+    while month <= last:
+        op.execute(
+            f"CREATE TABLE {table}_p{month:%Y_%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+        )
+        month = _add_months(month, 1)
+
+    columns = "id, " + ", ".join(c.split()[0] for c in COLUMNS[table].split(", "))
+    op.execute(
+        f"INSERT INTO {table} ({columns}, created_at)"
+        f" SELECT {columns}, coalesce(created_at, timezone('utc', now())) FROM {legacy}"
+    )
+    op.execute(f"DROP TABLE {legacy}")
+    op.execute(f"CREATE INDEX ix_{table}_device_id_created_at ON {table} (device_id, created_at DESC)")
+
+
+def _unpartition_table(table: str) -> None:
+    partitioned = f"{table}_partitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {partitioned}")
+    op.execute(f"ALTER INDEX ix_{table}_device_id_created_at RENAME TO ix_{partitioned}_device_id_created_at")
+    op.execute(f"ALTER TABLE {partitioned} RENAME CONSTRAINT {table}_pkey TO {partitioned}_pkey")
+    op.execute(
+        f"CREATE TABLE {table} ("
+        f" id integer NOT NULL DEFAULT nextval('{table}_id_seq') PRIMARY KEY, {COLUMNS[table]},"
+        f" created_at timestamp"
+        f")"
+    )
+    op.execute(f"ALTER TABLE {partitioned} ALTER COLUMN id DROP DEFAULT")
+    op.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    op.execute(f"INSERT INTO {table} SELECT * FROM {partitioned}")
+    op.execute(f"DROP TABLE {partitioned}")
+    op.execute(f"CREATE INDEX ix_{table}_device_id_created_at ON {table} (device_id, created_at DESC)")
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in COLUMNS:
+            _partition_table(table)
+        return
+
+    for table in COLUMNS:
+        op.execute(f"UPDATE {table} SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        for table in COLUMNS:
+            _unpartition_table(table)
+        return
+
+    for table in COLUMNS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('created_at', existing_type=sa.DateTime(), nullable=True)
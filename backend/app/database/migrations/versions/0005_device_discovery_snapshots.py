@@ -0,0 +1,35 @@
+"""Pre-serialized discovery payload per user
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 23:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Snapshots are built lazily on the first discovery request of each user
+    op.create_table(
+        'device_discovery_snapshots',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('devices', sa.LargeBinary(), nullable=False),
+        sa.Column('device_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('device_discovery_snapshots')
@@ -0,0 +1,46 @@
+"""Per-capability device state
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 23:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'device_capability_states',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=False),
+        sa.Column('type', sa.String(length=100), nullable=False),
+        sa.Column('instance', sa.String(length=50), nullable=False),
+        sa.Column('value', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('device_id', 'type', 'instance', name='uq_device_capability_states_device_type_instance'),
+    )
+    # Existing on/off state becomes the first capability state of every device
+    value = "CASE WHEN status = 'on' THEN 'true' ELSE 'false' END"
+    if op.get_bind().dialect.name == 'postgresql':
+        value = f"CAST({value} AS jsonb)"
+    op.execute(
+        "INSERT INTO device_capability_states (device_id, type, instance, value, updated_at) "
+        f"SELECT id, 'devices.capabilities.on_off', 'on', {value}, CURRENT_TIMESTAMP FROM devices"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('device_capability_states')
@@ -0,0 +1,61 @@
+"""Device shadow: desired and reported capability state
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 00:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+JSON_TYPE = sa.JSON().with_variant(postgresql.JSONB(), 'postgresql')
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('device_capability_states') as batch_op:
+        batch_op.alter_column('value', new_column_name='desired')
+        batch_op.add_column(sa.Column('reported', JSON_TYPE, nullable=True))
+        batch_op.add_column(sa.Column('reported_at', sa.DateTime(), nullable=True))
+    # Device.status was the only state known so far: take it as reported
+    op.execute("UPDATE device_capability_states SET reported = desired")
+
+    op.create_table(
+        'device_shadows',
+        sa.Column('device_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('reported_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('device_id'),
+    )
+
+    # Added on the parent, so it applies to every partition on PostgreSQL
+    op.add_column('device_commands', sa.Column('capability', sa.String(length=100), nullable=True))
+    op.add_column('device_commands', sa.Column('instance', sa.String(length=50), nullable=True))
+    op.add_column('device_commands', sa.Column('value', JSON_TYPE, nullable=True))
+    op.add_column('device_commands', sa.Column('shadow_version', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('device_commands') as batch_op:
+        batch_op.drop_column('shadow_version')
+        batch_op.drop_column('value')
+        batch_op.drop_column('instance')
+        batch_op.drop_column('capability')
+
+    op.drop_table('device_shadows')
+
+    with op.batch_alter_table('device_capability_states') as batch_op:
+        batch_op.drop_column('reported_at')
+        batch_op.drop_column('reported')
+        batch_op.alter_column('desired', new_column_name='value')
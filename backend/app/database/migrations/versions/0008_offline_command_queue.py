@@ -0,0 +1,32 @@
+"""Offline command queue
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 00:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('device_commands', sa.Column('expires_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_device_commands_queued', 'device_commands', ['device_id'], unique=False,
+        postgresql_where=sa.text("status = 'queued'"), sqlite_where=sa.text("status = 'queued'"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_device_commands_queued', table_name='device_commands')
+    with op.batch_alter_table('device_commands') as batch_op:
+        batch_op.drop_column('expires_at')
@@ -0,0 +1,35 @@
+"""Shared rate limit token buckets
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 01:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0009'
+down_revision: Union[str, None] = '0008'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Written on every rate-limited request: skip the WAL on PostgreSQL
+    prefixes = ['UNLOGGED'] if op.get_bind().dialect.name == 'postgresql' else []
+    op.create_table(
+        'rate_limit_buckets',
+        sa.Column('key', sa.String(length=100), nullable=False),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('key'),
+        prefixes=prefixes,
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('rate_limit_buckets')
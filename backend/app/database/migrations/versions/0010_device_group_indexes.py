@@ -0,0 +1,27 @@
+"""Device group indexes
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 01:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0010'
+down_revision: Union[str, None] = '0009'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_devices_user_id_room', 'devices', ['user_id', 'room'], unique=False)
+    op.create_index('ix_devices_user_id_type', 'devices', ['user_id', 'type'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_devices_user_id_type', table_name='devices')
+    op.drop_index('ix_devices_user_id_room', table_name='devices')
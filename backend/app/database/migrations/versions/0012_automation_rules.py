@@ -0,0 +1,47 @@
+"""Automation rules
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 02:30:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0012'
+down_revision: Union[str, None] = '0011'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'automation_rules',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('device_id', sa.Integer(), nullable=True),
+        sa.Column('name', sa.String(length=100), nullable=False),
+        sa.Column('topic', sa.String(length=20), nullable=False),
+        sa.Column('condition', sa.String(length=500), nullable=False),
+        sa.Column('actions', sa.JSON().with_variant(postgresql.JSONB(), 'postgresql'), nullable=False),
+        sa.Column('cooldown_seconds', sa.Integer(), nullable=False),
+        sa.Column('enabled', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['device_id'], ['devices.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_automation_rules_device_id', 'automation_rules', ['device_id'], unique=False)
+    op.create_index('ix_automation_rules_user_id_topic', 'automation_rules', ['user_id', 'topic'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_automation_rules_user_id_topic', table_name='automation_rules')
+    op.drop_index('ix_automation_rules_device_id', table_name='automation_rules')
+    op.drop_table('automation_rules')
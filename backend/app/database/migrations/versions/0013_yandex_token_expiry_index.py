@@ -0,0 +1,25 @@
+"""Yandex token expiry index
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2026-10-19 03:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0013'
+down_revision: Union[str, None] = '0012'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_users_yandex_oauth_token_expires_at', 'users', ['yandex_oauth_token_expires_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_users_yandex_oauth_token_expires_at', table_name='users')
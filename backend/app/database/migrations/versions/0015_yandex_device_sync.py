@@ -0,0 +1,58 @@
+"""Devices synced from Yandex IoT
+
+Also deletes a device's statuses, commands and events together with the
+device: synced devices gone from the Yandex account are deleted in bulk,
+which, unlike the ORM, doesn't know about the history tables.
+
+Revision ID: 0015
+Revises: 0014
+Create Date: 2026-10-19 04:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0015'
+down_revision: Union[str, None] = '0014'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+HISTORY_TABLES = ('device_statuses', 'device_commands', 'device_events')
+# Names the unnamed foreign keys of SQLite tables, so batch mode can replace them
+NAMING_CONVENTION = {'fk': '%(table_name)s_%(column_0_name)s_fkey'}
+
+
+def _set_history_ondelete(ondelete: Union[str, None]) -> None:
+    for table in HISTORY_TABLES:
+        name = f'{table}_device_id_fkey'
+        if op.get_bind().dialect.name == 'postgresql':
+            op.drop_constraint(name, table, type_='foreignkey')
+            op.create_foreign_key(name, table, 'devices', ['device_id'], ['id'], ondelete=ondelete)
+            continue
+        with op.batch_alter_table(table, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.drop_constraint(name, type_='foreignkey')
+            batch_op.create_foreign_key(name, 'devices', ['device_id'], ['id'], ondelete=ondelete)
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('devices') as batch_op:
+        batch_op.add_column(sa.Column('external_id', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.alter_column('serial_number_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.create_unique_constraint('uq_devices_user_id_external_id', ['user_id', 'external_id'])
+    _set_history_ondelete('CASCADE')
+
+
+def downgrade() -> None:
+    # Synced devices have no serial number to fall back on
+    op.execute("DELETE FROM devices WHERE serial_number_id IS NULL")
+    _set_history_ondelete(None)
+    with op.batch_alter_table('devices') as batch_op:
+        batch_op.drop_constraint('uq_devices_user_id_external_id', type_='unique')
+        batch_op.alter_column('serial_number_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.drop_column('content_hash')
+        batch_op.drop_column('external_id')
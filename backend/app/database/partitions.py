@@ -0,0 +1,160 @@
+"""
+Monthly partitions and retention for the device history tables.
+
+On PostgreSQL device_events and device_commands are range partitioned on
+created_at (see migration 0004). Partitions are created a few months ahead
+and whole partitions are dropped once they fall out of the retention window,
+so old history never needs a DELETE and VACUUM. Other dialects keep plain
+tables and purge expired rows in small batches instead.
+
+Rows outside the created months land in the DEFAULT partition. Expired ones
+are purged from it in batches like on other dialects. When a month is
+created while the DEFAULT partition holds rows for it, the DEFAULT partition
+is detached, the month created, its rows moved over and the DEFAULT
+partition attached again, all in one transaction; PostgreSQL refuses to
+create the month otherwise. Creating months, dropping expired ones and
+purging run in separate transactions, so a failure in one doesn't hold up
+the others.
+"""
+import asyncio
+import logging
+import re
+from datetime import date, datetime, timedelta
+from typing import List, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+PARTITIONED_TABLES = ("device_events", "device_commands")
+
+PARTITION_NAME_PATTERN = re.compile(r"_p(\d{4})_(\d{2})$")
+
+
+def month_start(value: datetime) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y_%m}"
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def create_month_partition(connection: Connection, table: str, month: date) -> None:
+    """Create the partition holding `month` if it doesn't exist yet, moving its rows out of the DEFAULT partition."""
+    name = partition_name(table, month)
+    if connection.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None:
+        return
+    default = default_partition_name(table)
+    bounds = {"start": month, "end": add_months(month, 1)}
+    in_month = "created_at >= :start AND created_at < :end"
+    create = text(
+        f"CREATE TABLE {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{bounds['end'].isoformat()}')"
+    )
+    if not connection.execute(text(f"SELECT EXISTS (SELECT 1 FROM {default} WHERE {in_month})"), bounds).scalar():
+        connection.execute(create)
+        return
+
+    connection.execute(text(f"ALTER TABLE {table} DETACH PARTITION {default}"))
+    connection.execute(create)
+    moved = connection.execute(text(f"INSERT INTO {table} SELECT * FROM {default} WHERE {in_month}"), bounds).rowcount
+    connection.execute(text(f"DELETE FROM {default} WHERE {in_month}"), bounds)
+    connection.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT"))
+    logger.info(f"Moved {moved} rows of {table} from {default} to {name}.")
+
+
+def list_partitions(connection: Connection, table: str) -> List[Tuple[str, date]]:
+    """Return (name, month) for every monthly partition of `table`."""
+    names = connection.execute(text(
+        "SELECT child.relname FROM pg_inherits"
+        " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+        " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+        " WHERE parent.relname = :table"
+    ), {"table": table}).scalars().all()
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME_PATTERN.search(name)
+        if match:  # Skips the DEFAULT partition
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda p: p[1])
+
+
+def ensure_partitions(connection: Connection, table: str, now: datetime, months_ahead: int) -> None:
+    """Make sure partitions exist for the current month and `months_ahead` months after it."""
+    current = month_start(now)
+    for offset in range(months_ahead + 1):
+        create_month_partition(connection, table, add_months(current, offset))
+
+
+def drop_expired_partitions(connection: Connection, table: str, cutoff: datetime) -> List[str]:
+    """Drop partitions whose whole range lies before `cutoff`."""
+    dropped = []
+    for name, month in list_partitions(connection, table):
+        if add_months(month, 1) <= cutoff.date():
+            connection.execute(text(f"DROP TABLE {name}"))
+            dropped.append(name)
+    return dropped
+
+
+def purge_expired_rows(connection: Connection, table: str, cutoff: datetime, batch_size: int) -> int:
+    """Fallback for unpartitioned tables: delete expired rows in batches of `batch_size`."""
+    purged = 0
+    while True:
+        result = connection.execute(text(
+            f"DELETE FROM {table} WHERE id IN ("
+            f" SELECT id FROM {table} WHERE created_at < :cutoff LIMIT :batch_size)"
+        ), {"cutoff": cutoff, "batch_size": batch_size})
+        connection.commit()
+        purged += result.rowcount
+        if result.rowcount < batch_size:
+            return purged
+
+
+def run_history_maintenance(engine: Engine, now: datetime = None) -> None:
+    """Create upcoming partitions and enforce the history retention policy."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=settings.DEVICE_HISTORY_RETENTION_DAYS)
+
+    with engine.connect() as connection:
+        for table in PARTITIONED_TABLES:
+            if engine.dialect.name != "postgresql":
+                purged = purge_expired_rows(connection, table, cutoff, settings.DEVICE_HISTORY_PURGE_BATCH_SIZE)
+                if purged:
+                    logger.info(f"Purged {purged} expired rows from {table}.")
+                continue
+
+            try:
+                with connection.begin():
+                    ensure_partitions(connection, table, now, settings.DEVICE_HISTORY_PARTITIONS_AHEAD)
+            except Exception as e:
+                logger.error(f"Creating partitions of {table} failed: {e}")
+            with connection.begin():
+                dropped = drop_expired_partitions(connection, table, cutoff)
+            if dropped:
+                logger.info(f"Dropped expired partitions of {table}: {', '.join(dropped)}")
+            default = default_partition_name(table)
+            purged = purge_expired_rows(connection, default, cutoff, settings.DEVICE_HISTORY_PURGE_BATCH_SIZE)
+            if purged:
+                logger.info(f"Purged {purged} expired rows from {default}.")
+
+
+async def history_maintenance_loop(engine: Engine) -> None:
+    """Run run_history_maintenance periodically; started from app.main.lifespan."""
+    while True:
+        try:
+            await asyncio.to_thread(run_history_maintenance, engine)
+        except Exception as e:
+            logger.error(f"Device history maintenance failed: {e}")
+        await asyncio.sleep(settings.DEVICE_HISTORY_MAINTENANCE_INTERVAL_SECONDS)
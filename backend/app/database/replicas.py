@@ -0,0 +1,195 @@
+"""
+Read replicas for read-only endpoints.
+
+Endpoints that only read (device lists, events, commands, user lists) take
+their session from get_read_db instead of get_db. With
+DATABASE_READ_REPLICA_URLS set, those sessions are opened on the replicas,
+round-robin; without it, or when no replica is healthy, on the primary, so
+read scaling is a matter of configuration.
+
+A replica is left out while it is unreachable or lags behind the primary
+by more than DATABASE_REPLICA_MAX_LAG_SECONDS. Replicas are checked every
+DATABASE_REPLICA_HEALTH_CHECK_SECONDS, and a replica whose connection
+breaks during a request is left out until its next successful check.
+
+Read-your-writes: after a successful POST/PUT/PATCH/DELETE, the client's
+reads go to the primary for DATABASE_READ_YOUR_WRITES_SECONDS, so it sees
+its own change even if the replicas haven't replayed it yet. Clients are
+told apart by their Authorization header (or address); the pin is kept in
+the worker and in a cookie, which other workers honour too.
+"""
+import asyncio
+import hashlib
+import itertools
+import logging
+import threading
+import time
+from typing import Dict, Generator, List, Optional
+
+from fastapi import Request
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from ..config import settings
+from .core import SessionFactory
+from .instrumentation import install_query_instrumentation
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "read_primary"
+UNSAFE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+# Seconds the replica is behind the primary; 0 when it has replayed everything it received
+LAG_QUERY = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+def client_key(headers: Dict[str, str], client_host: Optional[str]) -> str:
+    authorization = headers.get("authorization")
+    if authorization:
+        return hashlib.sha256(authorization.encode()).hexdigest()
+    return client_host or ""
+
+
+class Replica:
+    def __init__(self, url: str):
+        self.engine: Engine = create_engine(url, pool_pre_ping=True, echo=False)
+        install_query_instrumentation(self.engine)
+        event.listen(self.engine, "handle_error", self._handle_error)
+        self.sessions = sessionmaker(bind=self.engine, autocommit=False, autoflush=False, class_=Session)
+        self.name = self.engine.url.render_as_string(hide_password=True)
+        self.healthy = True  # Until a check says otherwise
+        self.lag: Optional[float] = None
+
+    def _handle_error(self, context) -> None:
+        if context.is_disconnect and self.healthy:
+            self.healthy = False
+            logger.warning(f"Read replica {self.name} lost its connection, reading from other databases.")
+
+    def check(self) -> bool:
+        try:
+            with self.engine.connect() as connection:
+                if self.engine.dialect.name == "postgresql":
+                    self.lag = float(connection.execute(LAG_QUERY).scalar())
+                else:
+                    connection.execute(text("SELECT 1"))
+                    self.lag = 0.0
+            healthy = self.lag <= settings.DATABASE_REPLICA_MAX_LAG_SECONDS
+        except Exception as e:
+            logger.debug(f"Read replica {self.name} check failed: {e}")
+            healthy = False
+        if healthy != self.healthy:
+            logger.warning(f"Read replica {self.name} is {'healthy' if healthy else 'unhealthy'} (lag {self.lag}).")
+        self.healthy = healthy
+        return healthy
+
+
+class ReplicaRouter:
+    def __init__(self, urls: Optional[List[str]] = None):
+        self._urls = urls
+        self._replicas: Optional[List[Replica]] = None
+        self._next = itertools.count()
+        self._pins: Dict[str, float] = {}  # client key -> monotonic time the pin ends
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def replicas(self) -> List[Replica]:
+        if self._replicas is None:
+            urls = settings.DATABASE_READ_REPLICA_URLS if self._urls is None else self._urls
+            self._replicas = [Replica(url) for url in urls]
+        return self._replicas
+
+    def pick(self) -> Optional[Replica]:
+        """The next healthy replica, round-robin; None when there is none."""
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        return healthy[next(self._next) % len(healthy)]
+
+    def pin(self, client: str) -> None:
+        """Send `client`'s reads to the primary for DATABASE_READ_YOUR_WRITES_SECONDS."""
+        now = time.monotonic()
+        with self._lock:
+            self._pins[client] = now + settings.DATABASE_READ_YOUR_WRITES_SECONDS
+            if len(self._pins) > settings.DATABASE_READ_YOUR_WRITES_MAX_PINS:
+                self._pins = {key: until for key, until in self._pins.items() if until > now}
+
+    def pinned(self, client: str) -> bool:
+        with self._lock:
+            until = self._pins.get(client)
+        return until is not None and until > time.monotonic()
+
+    def session(self, client: Optional[str] = None) -> Session:
+        """A session for reads: on a replica unless `client` is pinned or none is healthy."""
+        replica = None if client is not None and self.pinned(client) else self.pick()
+        return replica.sessions() if replica is not None else SessionFactory()
+
+    def check_all(self) -> None:
+        for replica in self.replicas:
+            replica.check()
+
+    # --- Health checks ---
+
+    def start(self) -> None:
+        """Start checking replicas; called from app.main.lifespan."""
+        if self.replicas:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for replica in self._replicas or ():
+            replica.engine.dispose()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.to_thread(self.check_all)
+            except Exception as e:
+                logger.error(f"Read replica health check failed: {e}")
+            await asyncio.sleep(settings.DATABASE_REPLICA_HEALTH_CHECK_SECONDS)
+
+
+replica_router = ReplicaRouter()
+
+
+# Dependency to get a DB session for read-only endpoints
+def get_read_db(request: Request) -> Generator[Session, None, None]:
+    client = None
+    if replica_router.replicas and PIN_COOKIE not in request.cookies:
+        client = client_key(request.headers, request.client.host if request.client else None)
+    session = replica_router.session(client) if client is not None else SessionFactory()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+class ReadYourWritesMiddleware:
+    """ASGI middleware pinning a client's reads to the primary after it changed something."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in UNSAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope["headers"]}
+                client = scope.get("client")
+                replica_router.pin(client_key(headers, client[0] if client else None))
+                cookie = f"{PIN_COOKIE}=1; Max-Age={int(settings.DATABASE_READ_YOUR_WRITES_SECONDS) or 1}; Path=/; HttpOnly; SameSite=Lax"
+                message = {**message, "headers": [*message.get("headers", []), (b"set-cookie", cookie.encode())]}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
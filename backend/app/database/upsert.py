@@ -0,0 +1,16 @@
+"""
+INSERT ... ON CONFLICT for the dialect a session is bound to.
+
+The app runs on PostgreSQL; tests run on SQLite. The insert() of both
+dialects supports on_conflict_do_nothing and on_conflict_do_update with the
+same arguments.
+"""
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+
+def dialect_insert(db: Session, table):
+    """insert(table) with ON CONFLICT support for the dialect of `db`."""
+    if db.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
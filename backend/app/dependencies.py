@@ -1,5 +1,5 @@
 # app/dependencies.py
-from datetime import datetime, timezone
+from datetime import datetime
 from typing import Optional
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -10,9 +10,10 @@ from jose import JWTError
 # import User model
 from app.auth.models import User
 
-from .database.core import get_db
+from .database.core import get_db, SessionFactory
 from .auth.security import decode_token
 from .auth.service import auth_service
+from .auth.principals import principal_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1.0/auth/login")
 oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="/api/v1.0/auth/login", auto_error=False) # For optional authentication
@@ -46,20 +47,32 @@ async def get_current_user(
         if user_id_str is None:
             raise credentials_exception
             
-        # Validate token hasn't expired
-        token_exp = payload.get("exp")
-        if token_exp is None or datetime.fromtimestamp(token_exp, tz=timezone.utc) < datetime.now(timezone.utc):
+        # decode_token only returns unexpired tokens; require an expiry at all
+        if payload.get("exp") is None:
             raise credentials_exception
             
         user_id = int(user_id_str)
     except (JWTError, ValueError):
         raise credentials_exception
         
-    user =   auth_service.get_user_by_id(db=db, user_id=user_id)
+    user = resolve_user(db=db, user_id=user_id)
     if user is None:
         raise credentials_exception
     return user
 
+def resolve_user(db: Session, user_id: int) -> Optional[User]:
+    """
+    The user of a verified token, from the principal cache when possible.
+
+    Cached users aren't attached to `db`; see get_current_db_user.
+    """
+    user = principal_cache.get(user_id)
+    if user is None:
+        user = auth_service.get_user_by_id(db=db, user_id=user_id)
+        if user is not None:
+            principal_cache.put(user)
+    return user
+
 async def get_optional_current_active_user(
     token: Optional[str] = Depends(oauth2_scheme_optional), # Use the optional scheme
     db: Session = Depends(get_db)
@@ -80,16 +93,15 @@ async def get_optional_current_active_user(
         if user_id_str is None:
             return None # No user ID in token
 
-        # Validate token hasn't expired
-        token_exp: Optional[int] = payload.get("exp")
-        if token_exp is None or datetime.fromtimestamp(token_exp, tz=timezone.utc) < datetime.now(timezone.utc):
-            return None # Token expired
+        # decode_token only returns unexpired tokens; require an expiry at all
+        if payload.get("exp") is None:
+            return None # Token without expiry
 
         user_id = int(user_id_str)
     except (JWTError, ValueError):
         return None # Token decoding or parsing error
 
-    user =   auth_service.get_user_by_id(db=db, user_id=user_id)
+    user = resolve_user(db=db, user_id=user_id)
     if user is None:
         return None # User not found
 
@@ -99,6 +111,21 @@ async def get_optional_current_active_user(
 
     return user
 
+async def authenticate_token(token: Optional[str]) -> Optional[User]:
+    """
+    Resolve an access token to its user, or None when it isn't valid.
+
+    For long-lived connections (WebSocket, SSE): the session is only held for
+    the lookup instead of for the lifetime of the connection.
+    """
+    if not token:
+        return None
+    with SessionFactory() as db:
+        try:
+            return await get_current_user(token=token, db=db)
+        except HTTPException:
+            return None
+
 async def get_current_active_user(
     current_user = Depends(get_current_user),
 ):
@@ -106,6 +133,24 @@ async def get_current_active_user(
     #     raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_db_user(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+) -> User:
+    """
+    The current user attached to the request's session, for endpoints that change it.
+
+    get_current_user may return a cached copy that isn't tracked by any session.
+    """
+    user = db.get(User, current_user.id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
 async def get_current_admin_user(
     current_user: User = Depends(get_current_active_user)
 ) -> User:
@@ -0,0 +1,144 @@
+"""
+Registry of the Yandex Smart Home capabilities devices can be controlled with.
+
+Each capability validates and normalizes the values sent in actions and
+describes how a change is published to the device. State is stored per
+(device, type, instance) in DeviceCapabilityState; diff_states compares the
+requested state of a batch of devices with the stored one so that only
+actual changes are published.
+
+New capability types are added with register_capability.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+ON_OFF = "devices.capabilities.on_off"
+RANGE = "devices.capabilities.range"
+MODE = "devices.capabilities.mode"
+TOGGLE = "devices.capabilities.toggle"
+
+# (device_id, capability type, instance)
+StateKey = Tuple[int, str, str]
+
+
+class InvalidCapabilityValue(ValueError):
+    """Raised for an unknown instance or a value the capability doesn't accept."""
+
+
+@dataclass(frozen=True)
+class Capability(ABC):
+    type: str
+    instances: Tuple[str, ...]
+
+    def validate(self, instance: str, value: Any) -> Any:
+        """Return `value` normalized for storage, or raise InvalidCapabilityValue."""
+        if instance not in self.instances:
+            raise InvalidCapabilityValue(f"Unsupported instance {instance!r} for {self.type}")
+        return self.normalize(instance, value)
+
+    @abstractmethod
+    def normalize(self, instance: str, value: Any) -> Any:
+        """Return a valid `value` of `instance` as stored, or raise InvalidCapabilityValue."""
+
+    def command(self, instance: str, value: Any) -> Dict[str, Any]:
+        """MQTT command body (without command_id) that applies the value on the device."""
+        return {"command": "set", "capability": self.type, "instance": instance, "value": value}
+
+    def command_type(self, instance: str, value: Any) -> str:
+        """Value of DeviceCommand.command_type recorded for the change."""
+        return f"{self.type.rsplit('.', 1)[-1]}.{instance}"
+
+
+@dataclass(frozen=True)
+class BooleanCapability(Capability):
+    def normalize(self, instance: str, value: Any) -> bool:
+        if not isinstance(value, bool):
+            raise InvalidCapabilityValue(f"{self.type} {instance} expects a boolean, got {value!r}")
+        return value
+
+
+@dataclass(frozen=True)
+class OnOffCapability(BooleanCapability):
+    type: str = ON_OFF
+    instances: Tuple[str, ...] = ("on",)
+
+    # Devices in the field understand the original open/close commands
+    def command(self, instance: str, value: bool) -> Dict[str, Any]:
+        return {"command": self.command_type(instance, value)}
+
+    def command_type(self, instance: str, value: bool) -> str:
+        return "open" if value else "close"
+
+
+@dataclass(frozen=True)
+class ToggleCapability(BooleanCapability):
+    type: str = TOGGLE
+    instances: Tuple[str, ...] = (
+        "backlight", "controls_locked", "ionization", "keep_warm", "mute", "oscillation", "pause",
+    )
+
+
+@dataclass(frozen=True)
+class RangeCapability(Capability):
+    type: str = RANGE
+    instances: Tuple[str, ...] = ("brightness", "channel", "humidity", "open", "temperature", "volume")
+    # instance -> (min, max); instances without bounds accept any number
+    bounds: Dict[str, Tuple[float, float]] = field(default_factory=lambda: {
+        "brightness": (0, 100),
+        "humidity": (0, 100),
+        "open": (0, 100),
+        "volume": (0, 100),
+    })
+
+    def normalize(self, instance: str, value: Any) -> float:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise InvalidCapabilityValue(f"{self.type} {instance} expects a number, got {value!r}")
+        low, high = self.bounds.get(instance, (float("-inf"), float("inf")))
+        if not low <= value <= high:
+            raise InvalidCapabilityValue(f"{self.type} {instance} must be between {low} and {high}, got {value}")
+        return value
+
+
+@dataclass(frozen=True)
+class ModeCapability(Capability):
+    type: str = MODE
+    instances: Tuple[str, ...] = ("fan_speed", "heat", "program", "swing", "thermostat", "work_speed")
+    modes: Tuple[str, ...] = (
+        "auto", "eco", "quiet", "low", "medium", "high", "turbo", "min", "max", "normal", "fast", "slow",
+        "cool", "dry", "fan_only", "heat", "horizontal", "vertical", "stationary",
+    )
+
+    def normalize(self, instance: str, value: Any) -> str:
+        if value not in self.modes:
+            raise InvalidCapabilityValue(f"Unsupported mode {value!r} for {self.type} {instance}")
+        return value
+
+
+CAPABILITIES: Dict[str, Capability] = {}
+
+
+def register_capability(capability: Capability) -> None:
+    CAPABILITIES[capability.type] = capability
+
+
+def get_capability(capability_type: str) -> Optional[Capability]:
+    return CAPABILITIES.get(capability_type)
+
+
+for _capability in (OnOffCapability(), RangeCapability(), ModeCapability(), ToggleCapability()):
+    register_capability(_capability)
+
+
+def diff_states(desired: Dict[StateKey, Any], current: Dict[StateKey, Any]) -> Dict[StateKey, Any]:
+    """Return the entries of `desired` that differ from (or are missing in) `current`."""
+    missing = object()
+    return {key: value for key, value in desired.items() if current.get(key, missing) != value}
+
+
+def group_by_device(states: Iterable[Tuple[StateKey, Any]]) -> Dict[int, List[Tuple[str, str, Any]]]:
+    """{device_id: [(type, instance, value), ...]} from (key, value) pairs."""
+    grouped: Dict[int, List[Tuple[str, str, Any]]] = {}
+    for (device_id, capability_type, instance), value in states:
+        grouped.setdefault(device_id, []).append((capability_type, instance, value))
+    return grouped
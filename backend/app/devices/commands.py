@@ -0,0 +1,519 @@
+"""
+Action pipeline and device shadow.
+
+Every capability of a device has a desired value (last requested) and a
+reported value (last confirmed by the device), stored in
+DeviceCapabilityState; DeviceShadow holds a version bumped on every desired
+change. Device.status mirrors the reported on_off state.
+
+DeviceCommandService validates the requested capability values against the
+registry (app/devices/capabilities.py), diffs them with the desired state of
+all requested devices at once and only records and publishes the
+capabilities whose value actually changes. Repeating the current state
+(e.g. a Yandex scene turning on a device that is already on) is answered
+with DONE without reaching device_commands or the MQTT broker.
+
+Devices confirm changes through command responses or by reporting their
+capabilities in `info` messages. When a device comes back online, the
+capabilities whose desired and reported values still differ are published
+again (reconcile).
+
+Commands for offline devices are queued in device_commands (status
+"queued") for DEVICE_COMMAND_QUEUE_TTL_SECONDS. Only the latest value per
+capability is kept; older ones are marked "superseded". The queue is
+published on the device's next heartbeat (drain_queue).
+"""
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import null, select, tuple_, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database.upsert import dialect_insert
+from ..mqtt import mqtt_client
+from . import models as device_models
+from .capabilities import ON_OFF, InvalidCapabilityValue, StateKey, diff_states, get_capability, group_by_device
+from .realtime import device_event_hub
+from .service import parse_device_id
+from .state_cache import device_state_cache
+
+logger = logging.getLogger(__name__)
+
+# (capability type, state) as sent by Yandex, e.g. ("devices.capabilities.on_off", {"instance": "on", "value": True})
+RequestedCapability = Tuple[str, Dict[str, Any]]
+
+# (capability type, instance, value)
+CapabilityValue = Tuple[str, str, Any]
+
+
+def action_result(status: str = "DONE", error_code: str = None, error_message: str = None) -> dict:
+    result = {"status": status}
+    if error_code:
+        result["error_code"] = error_code
+        result["error_message"] = error_message
+    return result
+
+
+def action_failed(result: dict) -> bool:
+    """Whether a DeviceActionDevice-shaped result has a device or capability error."""
+    return "action_result" in result or any(
+        capability["state"]["action_result"]["status"] == "ERROR" for capability in result["capabilities"]
+    )
+
+
+def capability_values(values: Iterable[CapabilityValue]) -> List[dict]:
+    return [{"type": capability_type, "instance": instance, "value": value} for capability_type, instance, value in values]
+
+
+class DeviceCommandService:
+    def load_states(self, db: Session, device_ids: Sequence[int]) -> Dict[StateKey, device_models.DeviceCapabilityState]:
+        """Stored capability states of `device_ids`, loaded with a single query."""
+        if not device_ids:
+            return {}
+        rows = db.execute(
+            select(device_models.DeviceCapabilityState)
+            .where(device_models.DeviceCapabilityState.device_id.in_(device_ids))
+        ).scalars()
+        return {(row.device_id, row.type, row.instance): row for row in rows}
+
+    @staticmethod
+    def _insert_states(db: Session, rows: List[dict], update_columns: Sequence[str]) -> None:
+        """
+        Insert capability states missing when they were loaded, in one statement.
+
+        A row inserted meanwhile by another transaction gets `update_columns`
+        from `rows` instead of failing on the (device, type, instance) constraint.
+        """
+        if not rows:
+            return
+        statement = dialect_insert(db, device_models.DeviceCapabilityState).values(rows)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=["device_id", "type", "instance"],
+            set_={
+                **{column: statement.excluded[column] for column in update_columns},
+                "updated_at": datetime.utcnow(),
+            },
+        ))
+
+    def lock_shadows(self, db: Session, device_ids: Sequence[int]) -> Dict[int, device_models.DeviceShadow]:
+        """
+        Shadows of `device_ids`, created when missing and locked until the transaction ends.
+
+        FOR UPDATE can't lock a shadow that doesn't exist yet, so missing ones are
+        inserted with ON CONFLICT DO NOTHING (another transaction may insert the
+        same one meanwhile) and then selected and locked like the others.
+        """
+        shadows = self._select_shadows(db, device_ids)
+        missing = [device_id for device_id in device_ids if device_id not in shadows]
+        if missing:
+            db.execute(
+                dialect_insert(db, device_models.DeviceShadow)
+                .values([{"device_id": device_id, "version": 0} for device_id in missing])
+                .on_conflict_do_nothing(index_elements=["device_id"])
+            )
+            shadows.update(self._select_shadows(db, missing))
+        return shadows
+
+    @staticmethod
+    def _select_shadows(db: Session, device_ids: Sequence[int]) -> Dict[int, device_models.DeviceShadow]:
+        return {
+            shadow.device_id: shadow
+            for shadow in db.execute(
+                select(device_models.DeviceShadow)
+                .where(device_models.DeviceShadow.device_id.in_(device_ids))
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            ).scalars()
+        }
+
+    def execute_actions(
+        self,
+        db: Session,
+        user_id: int,
+        requested: Sequence[Tuple[str, Sequence[RequestedCapability]]],
+        allowed: Callable[[int], bool] = lambda device_id: True,
+    ) -> List[dict]:
+        """
+        Apply the requested capability states to the user's devices.
+
+        `requested` is a list of (device id, [(capability type, state), ...]).
+        Devices for which `allowed(device.id)` returns False (rate limited) are
+        answered with DEVICE_BUSY. Returns DeviceActionDevice-shaped dicts, in the
+        order requested.
+        """
+        numeric_ids = [id_ for id_ in (parse_device_id(device_id) for device_id, _ in requested) if id_ is not None]
+        owned = {
+            device.id: device
+            for device in db.execute(
+                select(device_models.Device)
+                .where(device_models.Device.id.in_(numeric_ids), device_models.Device.user_id == user_id)
+            ).scalars()
+        }
+        results, _ = self._execute(db, user_id, owned, requested, allowed)
+        return results
+
+    def resolve_group(
+        self, db: Session, user_id: int, room: Optional[str] = None, device_type: Optional[str] = None
+    ) -> List[device_models.Device]:
+        """
+        The user's devices in `room` and/or of `device_type`, with one query on the (user_id, room/type) indexes.
+
+        Raises ValueError when the group has more than GROUP_ACTION_MAX_DEVICES devices.
+        """
+        query = select(device_models.Device).where(device_models.Device.user_id == user_id)
+        if room is not None:
+            query = query.where(device_models.Device.room == room)
+        if device_type is not None:
+            query = query.where(device_models.Device.type == device_type)
+        # One more than allowed tells an oversized group apart without counting it
+        devices = db.execute(
+            query.order_by(device_models.Device.id).limit(settings.GROUP_ACTION_MAX_DEVICES + 1)
+        ).scalars().all()
+        if len(devices) > settings.GROUP_ACTION_MAX_DEVICES:
+            raise ValueError(
+                f"The group has more than {settings.GROUP_ACTION_MAX_DEVICES} devices, narrow it down by room and type"
+            )
+        return devices
+
+    def execute_group_action(
+        self,
+        db: Session,
+        user_id: int,
+        capabilities: Sequence[RequestedCapability],
+        room: Optional[str] = None,
+        device_type: Optional[str] = None,
+        allowed: Callable[[int], bool] = lambda device_id: True,
+    ) -> dict:
+        """
+        Apply the same capability states to every device of a room and/or type.
+
+        All commands are recorded in one transaction and published together.
+        Returns a DeviceGroupActionResponse-shaped dict; raises ValueError for
+        groups larger than GROUP_ACTION_MAX_DEVICES.
+        """
+        devices = self.resolve_group(db, user_id, room, device_type)
+        requested = [(str(device.id), capabilities) for device in devices]
+        results, changed = self._execute(db, user_id, {device.id: device for device in devices}, requested, allowed)
+
+        failed = sum(1 for result in results if action_failed(result))
+        logger.info(f"User {user_id} group action (room={room}, type={device_type}): {len(devices)} devices, {changed} commands.")
+        return {
+            "room": room,
+            "type": device_type,
+            "total": len(devices),
+            "succeeded": len(devices) - failed,
+            "failed": failed,
+            "commands": changed,
+            "devices": results,
+        }
+
+    def _execute(
+        self,
+        db: Session,
+        user_id: int,
+        owned: Dict[int, device_models.Device],
+        requested: Sequence[Tuple[str, Sequence[RequestedCapability]]],
+        allowed: Callable[[int], bool],
+    ) -> Tuple[List[dict], int]:
+        """Validate, diff and apply `requested` for the `owned` devices; return the results and the number of changes."""
+        stored = self.load_states(db, list(owned))
+        current = {key: row.desired for key, row in stored.items()}
+        for device in owned.values():
+            # Devices created before their first action only have Device.status
+            current.setdefault((device.id, ON_OFF, "on"), device.status == "on")
+
+        desired: Dict[StateKey, Any] = {}
+        results = []
+        for device_id, capabilities in requested:
+            device = owned.get(parse_device_id(device_id))
+            if device is None:
+                results.append({
+                    "id": device_id,
+                    "action_result": action_result("ERROR", "DEVICE_NOT_FOUND", "Device not found"),
+                })
+                continue
+            if not allowed(device.id):
+                results.append({
+                    "id": device_id,
+                    "action_result": action_result("ERROR", "DEVICE_BUSY", "Too many actions for this device, retry later"),
+                })
+                continue
+
+            capability_results = []
+            for capability_type, state in capabilities:
+                instance = state.get("instance")
+                capability = get_capability(capability_type)
+                if capability is None:
+                    result = action_result("ERROR", "INVALID_ACTION", f"Unsupported capability {capability_type}")
+                else:
+                    try:
+                        desired[(device.id, capability_type, instance)] = capability.validate(instance, state.get("value"))
+                        result = action_result()
+                    except InvalidCapabilityValue as e:
+                        result = action_result("ERROR", "INVALID_VALUE", str(e))
+                capability_results.append({
+                    "type": capability_type,
+                    "state": {"instance": instance, "action_result": result},
+                })
+            results.append({"id": device_id, "custom_data": {}, "capabilities": capability_results})
+
+        changes = diff_states(desired, current)
+        if changes:
+            self.apply_changes(db, user_id, owned, stored, changes)
+        logger.info(f"User {user_id} actions: {len(desired)} capability states requested, {len(changes)} changed.")
+        return results, len(changes)
+
+    def apply_changes(
+        self,
+        db: Session,
+        user_id: int,
+        devices: Dict[int, device_models.Device],
+        stored: Dict[StateKey, device_models.DeviceCapabilityState],
+        changes: Dict[StateKey, Any],
+    ) -> None:
+        """Update the desired state, bump the shadow versions and publish the changes."""
+        created = []
+        for (device_id, capability_type, instance), value in changes.items():
+            row = stored.get((device_id, capability_type, instance))
+            if row is None:
+                created.append({
+                    "device_id": device_id,
+                    "type": capability_type,
+                    "instance": instance,
+                    "desired": value,
+                    "reported": devices[device_id].status == "on" if capability_type == ON_OFF else null(),
+                })
+            else:
+                row.desired = value
+        # A concurrent action may have created the same row since load_states
+        self._insert_states(db, created, update_columns=("desired",))
+
+        deltas = group_by_device(changes.items())
+        shadows = self.lock_shadows(db, list(deltas))
+        for shadow in shadows.values():
+            shadow.version += 1
+        versions = {device_id: shadow.version for device_id, shadow in shadows.items()}
+        self._send(db, user_id, deltas, versions)
+
+        for device_id, device_changes in deltas.items():
+            device_event_hub.publish(user_id, {
+                "type": "shadow",
+                "device_id": device_id,
+                "version": versions[device_id],
+                "desired": capability_values(device_changes),
+            })
+
+    def online_devices(self, db: Session, device_ids: Sequence[int]) -> Set[int]:
+        """Devices among `device_ids` that are online and sent a heartbeat recently."""
+        if not device_ids:
+            return set()
+        seen_after = datetime.utcnow() - timedelta(seconds=settings.DEVICE_PRESENCE_TIMEOUT_SECONDS)
+        return set(db.execute(
+            select(device_models.DeviceStatus.device_id).where(
+                device_models.DeviceStatus.device_id.in_(device_ids),
+                device_models.DeviceStatus.is_online == True,  # noqa: E712
+                device_models.DeviceStatus.last_seen >= seen_after,
+            )
+        ).scalars())
+
+    def _send(
+        self, db: Session, user_id: int, deltas: Dict[int, List[CapabilityValue]], versions: Dict[int, int]
+    ) -> None:
+        """
+        Record one command per capability delta, commit and publish them.
+
+        Commands for offline devices are queued instead, replacing any value
+        still queued for the same capability, and published by drain_queue.
+        """
+        online = self.online_devices(db, list(deltas))
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=settings.DEVICE_COMMAND_QUEUE_TTL_SECONDS)
+        superseded = [
+            (device_id, capability_type, instance)
+            for device_id, device_deltas in deltas.items() if device_id not in online
+            for capability_type, instance, _ in device_deltas
+        ]
+        if superseded:
+            db.execute(
+                update(device_models.DeviceCommand)
+                .where(
+                    device_models.DeviceCommand.status == "queued",
+                    tuple_(
+                        device_models.DeviceCommand.device_id,
+                        device_models.DeviceCommand.capability,
+                        device_models.DeviceCommand.instance,
+                    ).in_(superseded),
+                )
+                .values(status="superseded", completed_at=now)
+                .execution_options(synchronize_session=False)
+            )
+
+        commands = []
+        for device_id, device_deltas in deltas.items():
+            queued = device_id not in online
+            for capability_type, instance, value in device_deltas:
+                capability = get_capability(capability_type)
+                commands.append(device_models.DeviceCommand(
+                    device_id=device_id,
+                    command_type=capability.command_type(instance, value),
+                    status="queued" if queued else "pending",
+                    expires_at=expires_at if queued else None,
+                    capability=capability_type,
+                    instance=instance,
+                    value=value,
+                    shadow_version=versions[device_id],
+                ))
+        db.add_all(commands)
+
+        # On PostgreSQL the flush inserts all commands with batched INSERT ... RETURNING
+        # statements; ids are read before the commit expires them
+        db.flush()
+        messages = [self._command_message(user_id, command) for command in commands if command.status == "pending"]
+        db.commit()
+        self._publish(messages)
+
+    @staticmethod
+    def _command_message(user_id: int, command: device_models.DeviceCommand) -> Tuple[str, dict]:
+        capability = get_capability(command.capability)
+        return (
+            f"{user_id}/{command.device_id}/command",
+            {
+                **capability.command(command.instance, command.value),
+                "command_id": command.id,
+                "version": command.shadow_version,
+            },
+        )
+
+    @staticmethod
+    def _publish(messages: List[Tuple[str, dict]]) -> None:
+        mqtt_client.publish_many([(topic, json.dumps(payload)) for topic, payload in messages])
+
+    def drain_queue(self, db: Session, user_id: int, device_id: int) -> Set[Tuple[str, str]]:
+        """
+        Publish the commands queued while the device was offline; called on every heartbeat.
+
+        Returns the (type, instance) of the capabilities sent.
+        """
+        queued = db.execute(
+            select(device_models.DeviceCommand)
+            .where(device_models.DeviceCommand.device_id == device_id, device_models.DeviceCommand.status == "queued")
+            .order_by(device_models.DeviceCommand.id)
+        ).scalars().all()
+        if not queued:
+            return set()
+
+        now = datetime.utcnow()
+        commands = []
+        for command in queued:
+            if command.expires_at is not None and command.expires_at < now:
+                command.status = "expired"
+                command.completed_at = now
+            else:
+                command.status = "pending"
+                command.expires_at = None
+                commands.append(command)
+        messages = [self._command_message(user_id, command) for command in commands]
+        sent = {(command.capability, command.instance) for command in commands}
+        db.commit()
+        self._publish(messages)
+        logger.info(f"Drained queue of device {device_id}: {len(messages)} sent, {len(queued) - len(messages)} expired.")
+        return sent
+
+    def get_queue(self, db: Session, device_id: int) -> List[device_models.DeviceCommand]:
+        """Commands waiting for the device to come online; their number is the queue depth."""
+        return db.execute(
+            select(device_models.DeviceCommand)
+            .where(
+                device_models.DeviceCommand.device_id == device_id,
+                device_models.DeviceCommand.status == "queued",
+                device_models.DeviceCommand.expires_at >= datetime.utcnow(),
+            )
+            .order_by(device_models.DeviceCommand.id)
+        ).scalars().all()
+
+    def record_reported(self, db: Session, user_id: int, device_id: int, reported: List[CapabilityValue]) -> None:
+        """Store capability values confirmed by the device."""
+        reported = [
+            (capability_type, instance, value) for capability_type, instance, value in reported
+            if get_capability(capability_type) is not None
+        ]
+        if not reported:
+            return
+        now = datetime.utcnow()
+        stored = self.load_states(db, [device_id])
+        created = []
+        for capability_type, instance, value in reported:
+            row = stored.get((device_id, capability_type, instance))
+            if row is None:
+                # Changed on the device itself: nothing was requested, so it's also what we want
+                created.append({
+                    "device_id": device_id,
+                    "type": capability_type,
+                    "instance": instance,
+                    "desired": value,
+                    "reported": value,
+                    "reported_at": now,
+                })
+            else:
+                row.reported = value
+                row.reported_at = now
+            if capability_type == ON_OFF:
+                db.execute(
+                    update(device_models.Device)
+                    .where(device_models.Device.id == device_id)
+                    .values(status="on" if value else "off")
+                )
+        # Keeps the desired value of a row created by a concurrent action
+        self._insert_states(db, created, update_columns=("reported", "reported_at"))
+        shadow = self.lock_shadows(db, [device_id])[device_id]
+        shadow.reported_at = now
+        db.commit()
+
+        device_state_cache.update_capabilities(device_id, reported)
+        device_event_hub.publish(user_id, {
+            "type": "shadow",
+            "device_id": device_id,
+            "reported": capability_values(reported),
+        })
+
+    def reconcile(self, db: Session, user_id: int, device_id: int, skip: Set[Tuple[str, str]] = frozenset()) -> int:
+        """
+        Publish again the capabilities whose reported value differs from the desired one.
+
+        Capabilities in `skip` (e.g. just sent by drain_queue) are left out.
+        """
+        deltas = [
+            (row.type, row.instance, row.desired)
+            for row in self.load_states(db, [device_id]).values()
+            if row.reported != row.desired and (row.type, row.instance) not in skip
+        ]
+        if not deltas:
+            return 0
+        shadow = self.lock_shadows(db, [device_id])[device_id]
+        self._send(db, user_id, {device_id: deltas}, {device_id: shadow.version})
+        logger.info(f"Reconciled device {device_id}: {len(deltas)} capabilities resent.")
+        return len(deltas)
+
+    def get_shadow(self, db: Session, device: device_models.Device) -> dict:
+        """DeviceShadowRead-shaped dict of a device."""
+        shadow = db.get(device_models.DeviceShadow, device.id)
+        states = [
+            {"type": row.type, "instance": row.instance, "desired": row.desired, "reported": row.reported}
+            for row in self.load_states(db, [device.id]).values()
+        ]
+        if not any(state["type"] == ON_OFF for state in states):
+            on = device.status == "on"
+            states.append({"type": ON_OFF, "instance": "on", "desired": on, "reported": on})
+        states.sort(key=lambda state: (state["type"], state["instance"]))
+        return {
+            "device_id": device.id,
+            "version": shadow.version if shadow else 0,
+            "reported_at": shadow.reported_at if shadow else None,
+            "capabilities": [{**state, "in_sync": state["desired"] == state["reported"]} for state in states],
+        }
+
+
+device_command_service = DeviceCommandService()
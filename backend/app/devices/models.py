@@ -1,7 +1,8 @@
 from datetime import datetime
 from sqlalchemy import (
-   Column, Integer, String, ForeignKey, Boolean, DateTime
+   Column, Integer, String, ForeignKey, Boolean, DateTime, Index, LargeBinary, JSON, UniqueConstraint
 )
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.hybrid import hybrid_property
 
@@ -19,6 +20,13 @@ class SerialNumber(Base, TimeStampMixin):
     is_free = Column(Boolean, nullable=False, default=True)
     user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=True)
     device_id = Column(Integer, ForeignKey('devices.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=True)
+    factory_line = Column(String(50), nullable=True, default=None)  # Set when reserved for bulk provisioning
+
+    # Free serial numbers are claimed in value order, see DeviceService.claim_free_serial_numbers.
+    # Reserved rows are left out of the index so claims don't rescan them.
+    __table_args__ = (
+        Index('ix_serial_numbers_is_free_value', is_free, value, postgresql_where=factory_line.is_(None)),
+    )
 
     # Relationships
     user = relationship("User", foreign_keys=[user_id])
@@ -37,12 +45,15 @@ class Device(Base, TimeStampMixin):
     __tablename__ = 'devices'
 
     id = Column(Integer, primary_key=True, index=True)
-    serial_number_id = Column(Integer, ForeignKey('serial_numbers.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    # None for devices synced from Yandex IoT, which are identified by external_id instead
+    serial_number_id = Column(Integer, ForeignKey('serial_numbers.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=True)
     status = Column(String(50), nullable=False, default='off')  # 'on' or 'off'
     name = Column(String(100), nullable=False)
-    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE', onupdate='CASCADE'), nullable=False, index=True)
     type = Column(String(50), nullable=False, default='openable')
     room = Column(String(100), nullable=True, default=None)
+    external_id = Column(String(100), nullable=True)  # Yandex IoT device id, see app/devices/yandex_sync.py
+    content_hash = Column(String(64), nullable=True)  # Hash of the synced fields, to detect changes
 
     # relationship fields
     owner = relationship(
@@ -57,6 +68,13 @@ class Device(Base, TimeStampMixin):
         uselist=False
     )
 
+    __table_args__ = (
+        # Group actions resolve a user's devices by room or by type
+        Index('ix_devices_user_id_room', user_id, room),
+        Index('ix_devices_user_id_type', user_id, type),
+        UniqueConstraint('user_id', 'external_id', name='uq_devices_user_id_external_id'),
+    )
+
     @hybrid_property
     def serial_number(self):
         """Get the serial number string from the related SerialNumber object."""
@@ -68,28 +86,116 @@ class DeviceStatus(Base):
     __tablename__ = "device_statuses"
     
     id = Column(Integer, primary_key=True)
-    device_id = Column(Integer, ForeignKey("devices.id"))
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), index=True)
     is_online = Column(Boolean, default=False)
     battery_level = Column(Integer, nullable=True)
     last_seen = Column(DateTime, default=datetime.utcnow)
     
+# Desired and reported value of each capability instance of a device (the device
+# shadow together with DeviceShadow), see app/devices/commands.py
+class DeviceCapabilityState(Base):
+    __tablename__ = "device_capability_states"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False)
+    type = Column(String(100), nullable=False)  # e.g. "devices.capabilities.range"
+    instance = Column(String(50), nullable=False)  # e.g. "brightness"
+    desired = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)  # Last value requested
+    reported = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # Last value the device confirmed
+    reported_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Also serves the per-device lookups (device_id is its leading column)
+    __table_args__ = (
+        UniqueConstraint('device_id', 'type', 'instance', name='uq_device_capability_states_device_type_instance'),
+    )
+
+# Shadow version of a device, bumped whenever its desired state changes
+class DeviceShadow(Base):
+    __tablename__ = "device_shadows"
+
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    reported_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Commands to run at a later time, see app/devices/scheduler.py
+class ScheduledCommand(Base):
+    __tablename__ = "scheduled_commands"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"), nullable=False, index=True)
+    # [{"type": ..., "state": {"instance": ..., "value": ...}}] as in Yandex actions
+    capabilities = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=False)
+    run_at = Column(DateTime, nullable=False)
+    # "scheduled", "running" (claimed by a worker), "done", "error", "expired" or "cancelled"
+    status = Column(String(20), nullable=False, default="scheduled")
+    claimed_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    result = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)  # DeviceActionDevice-shaped
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Due schedules are claimed by status and run time
+        Index('ix_scheduled_commands_status_run_at', status, run_at),
+    )
+
+# Command response statuses meaning the device applied the command; firmware in the
+# field answers "success"
+COMMAND_SUCCESS_STATUSES = frozenset({"success", "done"})
+
 # Command history
+# On PostgreSQL partitioned by month on created_at, see app/database/partitions.py
 class DeviceCommand(Base):
     __tablename__ = "device_commands"
     
     id = Column(Integer, primary_key=True)
-    device_id = Column(Integer, ForeignKey("devices.id"))
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"))
     command_type = Column(String)  # "open", "close"
-    status = Column(String)  # "pending", "success", "error"
-    created_at = Column(DateTime, default=datetime.utcnow)
+    # "queued" (device offline), "pending" (published), "success"/"done"/"error" (device response),
+    # "superseded" (replaced by a newer queued value) or "expired" (queued past expires_at)
+    status = Column(String)
+    expires_at = Column(DateTime, nullable=True)  # Only set while queued
+    # Capability change the command delivers; marked reported when the device confirms it
+    capability = Column(String(100), nullable=True)
+    instance = Column(String(50), nullable=True)
+    value = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
+    shadow_version = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
 
+    # Serves the per-device history page (ORDER BY created_at DESC) without a sort,
+    # and the offline queue lookups on every heartbeat
+    __table_args__ = (
+        Index('ix_device_commands_device_id_created_at', device_id, created_at.desc()),
+        Index(
+            'ix_device_commands_queued', device_id,
+            postgresql_where=status == 'queued', sqlite_where=status == 'queued',
+        ),
+    )
+
 # Device events
+# On PostgreSQL partitioned by month on created_at, see app/database/partitions.py
 class DeviceEvent(Base):
     __tablename__ = "device_events"
 
     id = Column(Integer, primary_key=True)
-    device_id = Column(Integer, ForeignKey("devices.id"))
+    device_id = Column(Integer, ForeignKey("devices.id", ondelete="CASCADE"))
     event_type = Column(String) # "warning", "error"
     message = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_device_events_device_id_created_at', device_id, created_at.desc()),
+    )
+
+# Pre-serialized Yandex discovery payload (GET /user/devices), rebuilt by
+# DeviceService whenever one of the user's devices is created, changed or deleted
+class DeviceDiscoverySnapshot(Base):
+    __tablename__ = "device_discovery_snapshots"
+
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    devices = Column(LargeBinary, nullable=False)  # JSON array of DevicePayloadDevice
+    device_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,165 @@
+"""
+Push device state changes to the Yandex Smart Home platform.
+
+Instead of waiting for the platform to poll POST /user/devices/query, state
+changes received over MQTT are sent to the skill callback
+
+    POST {YANDEX_DIALOGS_API_BASE_URL}/api/v1/skills/{skill_id}/callback/state
+
+Changes are collected per (skill, user) and coalesced over
+YANDEX_NOTIFICATION_WINDOW_SECONDS: only the latest value of each capability
+or property is sent, and all devices of a user go in a single request.
+Requests go through the shared HTTP client (app/http.py), which retries
+failed pushes with exponential backoff and full jitter.
+
+Point YANDEX_DIALOGS_API_BASE_URL at `python -m tools.yandex_callback_stub`
+to test against a local stand-in server.
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from ..config import settings
+from ..http import http_client
+from .capabilities import ON_OFF
+from .models import COMMAND_SUCCESS_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# (type, instance) -> capability or property state
+DeviceChanges = Dict[Tuple[str, str], dict]
+
+
+def state_changes_from_update(update: dict) -> Optional[Tuple[List[dict], List[dict]]]:
+    """
+    Map a live update (see app/devices/realtime.py) to Yandex (capabilities, properties).
+
+    Returns None for updates the platform doesn't need to hear about.
+    """
+    if update["type"] == "status" and update.get("battery_level") is not None:
+        return [], [{
+            "type": "devices.properties.float",
+            "state": {"instance": "battery_level", "value": update["battery_level"]},
+        }]
+    if update["type"] == "command" and update.get("status") in COMMAND_SUCCESS_STATUSES:
+        if update.get("capability"):
+            return [{
+                "type": update["capability"],
+                "state": {"instance": update["instance"], "value": update["value"]},
+            }], []
+        # Commands recorded before capabilities: only on_off, as "open"/"close"
+        if update.get("command_type") in ("open", "close"):
+            return [{
+                "type": ON_OFF,
+                "state": {"instance": "on", "value": update["command_type"] == "open"},
+            }], []
+    return None
+
+
+class StateNotifier:
+    def __init__(self):
+        # (skill_id, user_id) -> device_id -> {"capabilities": DeviceChanges, "properties": DeviceChanges}
+        self._pending: Dict[Tuple[str, int], Dict[int, Dict[str, DeviceChanges]]] = {}
+        # Changes arrive from the MQTT thread and are flushed on the event loop
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self.sent_batches = 0
+        self.failed_batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(settings.YANDEX_SKILL_ID and settings.YANDEX_SKILL_OAUTH_TOKEN)
+
+    def notify(self, user_id: int, device_id: int, capabilities: List[dict] = (), properties: List[dict] = ()) -> None:
+        """Queue state changes of a device; newer values replace older ones. Thread-safe."""
+        if not self.enabled:
+            return
+        key = (settings.YANDEX_SKILL_ID, user_id)
+        with self._lock:
+            device = self._pending.setdefault(key, {}).setdefault(device_id, {"capabilities": {}, "properties": {}})
+            for capability in capabilities:
+                device["capabilities"][(capability["type"], capability["state"]["instance"])] = capability
+            for prop in properties:
+                device["properties"][(prop["type"], prop["state"]["instance"])] = prop
+
+    def notify_update(self, user_id: int, update: dict) -> None:
+        changes = state_changes_from_update(update)
+        if changes is not None:
+            capabilities, properties = changes
+            self.notify(user_id, update["device_id"], capabilities, properties)
+
+    def start(self) -> None:
+        """Start flushing; called from app.main.lifespan."""
+        if not self.enabled:
+            logger.info("Yandex state notifications disabled: YANDEX_SKILL_ID or YANDEX_SKILL_OAUTH_TOKEN not set.")
+            return
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self) -> None:
+        """Send what is still pending; called before the shared HTTP client closes."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(settings.YANDEX_NOTIFICATION_WINDOW_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Flushing Yandex state notifications failed: {e}")
+
+    async def flush(self) -> None:
+        """Send one request per (skill, user) with everything collected since the last flush."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            await asyncio.gather(*(
+                self._push(skill_id, user_id, devices) for (skill_id, user_id), devices in pending.items()
+            ))
+
+    async def _push(self, skill_id: str, user_id: int, devices: Dict[int, Dict[str, DeviceChanges]]) -> bool:
+        body = {
+            "ts": time.time(),
+            "payload": {
+                "user_id": str(user_id),
+                "devices": [
+                    {
+                        "id": str(device_id),
+                        **{kind: list(states.values()) for kind, states in changes.items() if states},
+                    }
+                    for device_id, changes in devices.items()
+                ],
+            },
+        }
+        url = f"{settings.YANDEX_DIALOGS_API_BASE_URL}/api/v1/skills/{skill_id}/callback/state"
+
+        try:
+            response = await http_client.request(
+                "POST",
+                url,
+                json=body,
+                headers={"Authorization": f"OAuth {settings.YANDEX_SKILL_OAUTH_TOKEN}"},
+                # Resending the latest state is harmless
+                retry=True,
+                max_retries=settings.YANDEX_NOTIFICATION_MAX_RETRIES,
+                retry_base_seconds=settings.YANDEX_NOTIFICATION_RETRY_BASE_SECONDS,
+            )
+        except httpx.TransportError as e:
+            logger.error(f"Yandex state notification for user {user_id} failed: {e!r}")
+        else:
+            if response.status_code < 400:
+                self.sent_batches += 1
+                return True
+            logger.error(f"Yandex rejected state notification for user {user_id}: {response.status_code} {response.text}")
+
+        self.failed_batches += 1
+        return False
+
+
+state_notifier = StateNotifier()
@@ -0,0 +1,125 @@
+"""
+In-process pub/sub hub pushing live device updates to connected clients.
+
+The MQTT ingest path (running in the paho network thread) publishes updates
+per user; the hub fans them out on the event loop to every WebSocket and SSE
+subscriber of that user. Each message is serialized once, whatever the
+number of subscribers.
+
+Messages are JSON objects with a "type" of "status" (online state and
+battery), "shadow" (desired or reported capability state changed), "event"
+(warning/error), "command" (command result) or "rule" (automation rule
+notification).
+
+Every subscriber has a bounded queue. When a client can't keep up, the
+oldest queued messages are dropped; a subscriber that keeps falling behind
+is disconnected so that it reconnects and refetches the current state.
+"""
+import asyncio
+import logging
+from typing import Dict, Optional, Set
+
+import orjson
+
+from ..config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def event_message(event) -> dict:
+    """Hub message for a stored DeviceEvent."""
+    return {
+        "type": "event",
+        "device_id": event.device_id,
+        "event_id": event.id,
+        "event_type": event.event_type,
+        "message": event.message,
+        "created_at": event.created_at.isoformat(),
+    }
+
+
+class Subscriber:
+    """A single client connection's queue of pending serialized messages."""
+
+    def __init__(self, user_id: int, queue_size: int, max_dropped: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.max_dropped = max_dropped
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, data: str) -> None:
+        """Queue a message, dropping the oldest one when the client is behind."""
+        if self.closed:
+            return
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            if self.dropped > self.max_dropped:
+                logger.warning(f"Disconnecting slow subscriber of user {self.user_id} after {self.dropped} dropped messages.")
+                self.close()
+                return
+        self.queue.put_nowait(data)
+
+    def close(self) -> None:
+        self.closed = True
+        # Make room for the end-of-stream marker
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[str]:
+        """Next serialized message, or None once the subscriber was closed."""
+        return await self.queue.get()
+
+
+class DeviceEventHub:
+    def __init__(self):
+        self._subscribers: Dict[int, Set[Subscriber]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Set the event loop subscribers live on; called from app.main.lifespan."""
+        self._loop = loop
+
+    def subscribe(self, user_id: int) -> Subscriber:
+        """Register a connection; must be called on the event loop."""
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+        subscriber = Subscriber(user_id, settings.REALTIME_QUEUE_SIZE, settings.REALTIME_MAX_DROPPED_MESSAGES)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self._subscribers[subscriber.user_id]
+
+    def subscriber_count(self) -> int:
+        return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def publish(self, user_id: int, message: dict) -> None:
+        """Send a message to all subscribers of a user. Safe to call from any thread."""
+        if self._loop is None or user_id not in self._subscribers:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._fan_out(user_id, message)
+        else:
+            self._loop.call_soon_threadsafe(self._fan_out, user_id, message)
+
+    def _fan_out(self, user_id: int, message: dict) -> None:
+        subscribers = self._subscribers.get(user_id)
+        if not subscribers:
+            return
+        data = orjson.dumps(message).decode()
+        for subscriber in list(subscribers):
+            subscriber.offer(data)
+
+
+device_event_hub = DeviceEventHub()
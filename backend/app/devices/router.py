@@ -1,31 +1,44 @@
 # app/devices/router.py
-from fastapi import APIRouter, Depends, HTTPException, status, Query, Body
-from sqlalchemy.orm import Session, selectinload
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, UploadFile, File, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from sqlalchemy.orm import Session, joinedload
+import asyncio
+import codecs
+import orjson
 import uuid
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 from app.database.core import get_db
+from app.database.replicas import get_read_db
 from app.devices import models as device_models
 from app.devices import schemas as device_schemas
 from app.devices import service as device_service
 from app import schemas as common_schemas
 # auth_service
 from app.auth.service import auth_service
-from app.dependencies import get_current_active_user
+from app.dependencies import get_current_active_user, get_current_db_user, authenticate_token
+from app.config import settings
 from app.auth.models import User
 from app.devices.models import Device
+from app.devices.realtime import device_event_hub
+from app.devices.commands import device_command_service
+from app.devices.scheduler import command_scheduler
+from app.ratelimit.service import rate_limiter
 
 
 router = APIRouter(
     tags=["Devices"]
 )
 
+# Everything DeviceRead touches, loaded in the same query as the device
+DEVICE_READ_OPTIONS = [joinedload(Device.owner), joinedload(Device.serial_number_obj)]
+
 
 @router.get("/devices/{device_id}", response_model=device_schemas.DeviceRead)
 async def get_device(
     device_id: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get a specific device by its ID.
@@ -35,7 +48,7 @@ async def get_device(
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid device ID format")
     
-    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=[selectinload(Device.owner)])
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=DEVICE_READ_OPTIONS)
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
     return device
@@ -55,13 +68,14 @@ async def update_device(
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid device ID format")
     
-    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=[selectinload(Device.owner)])
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=DEVICE_READ_OPTIONS)
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
     if device.user_id != current_user.id and not current_user.is_superuser:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+    # update_device refreshes the device and its serial number itself
     updated_device = device_service.device_service.update_device(db=db, device=device, device_in=device_in)
-    db.refresh(updated_device, attribute_names=["owner", "serial_number_obj"])
+    db.refresh(updated_device, attribute_names=["owner"])
     return updated_device
 
 @router.delete("/devices/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -78,7 +92,7 @@ async def delete_device(
     except ValueError:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid device ID format")
     
-    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=[selectinload(Device.owner)])
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id_int, options=[joinedload(Device.serial_number_obj)])
     if not device:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
     if device.user_id != current_user.id and not current_user.is_superuser:
@@ -95,7 +109,7 @@ async def list_devices(
     user_id: int = Query(None),
     sort_field: str = Query("id"),
     sort_direction: str = Query("asc"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     List devices with filtering, sorting, and pagination.
@@ -113,10 +127,10 @@ async def list_devices(
         skip=skip,
         limit=limit,
         filters=filters,
-        sort=sort,
-        options=[selectinload(Device.owner)]
+        sort=sort
     )
-    return devices
+    # Already shaped like DeviceListResponse; skip re-validation by the response model
+    return ORJSONResponse(devices)
 
 @router.post("/devices/", response_model=device_schemas.DeviceRead, status_code=status.HTTP_201_CREATED)
 async def create_device(
@@ -132,7 +146,7 @@ async def create_device(
     """
     try:
         device = device_service.device_service.create_device(db=db, device_in=device_in, owner_id=current_user.id)
-        db.refresh(device, attribute_names=["owner"])
+        db.refresh(device, attribute_names=["owner", "serial_number_obj"])
         return device
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
@@ -143,7 +157,7 @@ async def get_device_commands(
     device_id: int,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -159,12 +173,126 @@ async def get_device_commands(
     return commands
 
 
+@router.get("/devices/{device_id}/queue", response_model=device_schemas.DeviceCommandQueueResponse)
+async def get_device_queue(
+    device_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get the commands waiting for an offline device to come back online.
+    """
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id)
+    if not device:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    if device.user_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    commands = device_command_service.get_queue(db=db, device_id=device_id)
+    return device_schemas.DeviceCommandQueueResponse(device_id=device_id, depth=len(commands), commands=commands)
+
+
+@router.get("/devices/{device_id}/shadow", response_model=device_schemas.DeviceShadowRead)
+async def get_device_shadow(
+    device_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get the desired and reported state of every capability of a device.
+    """
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id)
+    if not device:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    if device.user_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    return device_command_service.get_shadow(db=db, device=device)
+
+
+@router.post("/devices/{device_id}/schedules", response_model=device_schemas.ScheduledCommandRead, status_code=status.HTTP_201_CREATED)
+async def create_schedule(
+    device_id: int,
+    schedule_in: device_schemas.ScheduledCommandCreate,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Schedule capability changes for a device at `run_at` or in `delay_seconds`,
+    e.g. open the curtains at 07:00:
+
+    ```json
+    {
+        "run_at": "2026-10-20T07:00:00+03:00",
+        "capabilities": [
+            {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": true}}
+        ]
+    }
+    ```
+    """
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id)
+    if not device:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    if device.user_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    try:
+        return command_scheduler.create(
+            db=db,
+            user_id=device.user_id,
+            device_id=device_id,
+            capabilities=[(cap.type, cap.state) for cap in schedule_in.capabilities],
+            run_at=schedule_in.run_at,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/devices/{device_id}/schedules", response_model=device_schemas.ScheduledCommandListResponse)
+async def list_schedules(
+    device_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Get the scheduled commands of a device that haven't run yet.
+    """
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id)
+    if not device:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    if device.user_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    schedules = command_scheduler.list_scheduled(db=db, device_id=device_id)
+    return device_schemas.ScheduledCommandListResponse(schedules=schedules, total=len(schedules))
+
+
+@router.delete("/devices/{device_id}/schedules/{schedule_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def cancel_schedule(
+    device_id: int,
+    schedule_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Cancel a scheduled command that hasn't run yet.
+    """
+    device = device_service.device_service.get_device_by_id(db=db, device_id=device_id)
+    if not device:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Device not found")
+    if device.user_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    if not command_scheduler.cancel(db=db, device_id=device_id, schedule_id=schedule_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Scheduled command not found")
+
+
 @router.get("/devices/{device_id}/events", response_model=device_schemas.DeviceEventListResponse)
 async def get_device_events(
     device_id: int,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -184,7 +312,7 @@ async def get_device_events(
 async def get_serial_numbers(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -205,72 +333,57 @@ async def get_serial_numbers(
 async def get_user_devices(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
+    x_request_id: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get user's devices with pagination.
+    Get user's devices with pagination (Yandex Smart Home discovery).
+
+    Served from the user's pre-serialized snapshot: only the request id is
+    added per request.
     """
-    devices_result = device_service.device_service.get_user_devices(
+    devices = device_service.device_service.get_discovery_devices(
         db=db,
         user_id=current_user.id,
         skip=skip,
-        limit=limit,
-        options=[selectinload(Device.owner), selectinload(Device.serial_number_obj)]
+        limit=limit
     )
-    # Transform devices to required format
-    def device_to_payload(device):
-        return device_schemas.DevicePayloadDevice(
-            id=str(device.id),
-            name=device.name,
-            status_info=device_schemas.DeviceStatusInfo(reportable=True),
-            description=f"Device {device.name}",
-            room=device.room,
-            type=device.type,
-            custom_data={},
-            capabilities=[
-                {
-                    "type": "devices.capabilities.on_off"
-                }
-            ],
-            properties=[],    # changed from {} to []
-            device_info=device_schemas.DeviceInfo(
-                manufacturer="Elkarobotics",
-                model="Unknown",
-                serial_number=device.serial_number or "Unknown",
-                hw_version="1.0",
-                sw_version="1.0"
-            )
-        )
-    payload_devices = [device_to_payload(d) for d in devices_result.devices]
-    response = device_schemas.UserDevicesResponse(
-        request_id=str(uuid.uuid4()),
-        payload=device_schemas.UserDevicesPayload(
-            user_id=str(current_user.id),
-            devices=payload_devices
-        )
-    )
-    return response
+    request_id = orjson.dumps(x_request_id or str(uuid.uuid4()))
+    body = b'{"request_id":%s,"payload":{"user_id":"%d","devices":%s}}' % (request_id, current_user.id, devices)
+    return Response(content=body, media_type="application/json")
 
-# Get user's devices status with query parameters
+# Get user's devices state
 # POST https://example.com/v1.0/user/devices/query
-@router.post("/user/devices/query", response_model=device_schemas.DevicesListResponse)
+@router.post("/user/devices/query", response_model=device_schemas.DeviceStateQueryResponse)
 async def query_user_devices(
-    query: device_schemas.DeviceQuery,
+    query: device_schemas.DeviceStateQueryRequest,
+    x_request_id: Optional[str] = Header(None),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Query user's devices with filters.
+    Current state of the requested devices (Yandex Smart Home compliant).
+
+    Devices that are offline or haven't reported recently are returned with
+    error_code DEVICE_UNREACHABLE, unknown devices with DEVICE_NOT_FOUND.
+
+    Example request body:
+
+    ```json
+    {"devices": [{"id": "1", "custom_data": {}}]}
+    ```
     """
-    devices = device_service.device_service.query_user_devices(db=db, user_id=current_user.id, filters=query)
-    return devices
+    devices = device_service.device_service.query_device_states(
+        db=db, user_id=current_user.id, device_ids=[device.id for device in query.devices]
+    )
+    return ORJSONResponse({
+        "request_id": x_request_id or str(uuid.uuid4()),
+        "payload": {"devices": devices},
+    })
 
 # Change device status
 # POST https://example.com/v1.0/user/devices/action
-from ..mqtt import mqtt_client
-import json
-
 class DeviceActionRequestCapability(device_schemas.DeviceActionCapability):
     state: dict
 
@@ -292,6 +405,12 @@ async def change_device_status(
 ):
     """
     Change device status (Yandex Smart Home compliant).
+
+    Supports the on_off, range, mode and toggle capabilities. Capabilities
+    already in the requested state are answered with DONE without sending a
+    command to the device.
+
+    Rate limited per user (429 with Retry-After) and per device (DEVICE_BUSY).
     
     Example request body:
     
@@ -316,66 +435,143 @@ async def change_device_status(
     ```
 
     """
-    response_devices = []
-    for req_device in request.payload.devices:
-        device = device_service.device_service.get_device_by_id(db=db, device_id=int(req_device.id))
-        if not device or device.user_id != current_user.id:
-            continue  # skip devices not found or not owned
-        device_capabilities = []
-        for cap in req_device.capabilities:
-            # Only handle on_off for now
-            if cap.type == "devices.capabilities.on_off":
-                instance = cap.state.get("instance")
-                value = cap.state.get("value")
-                # Map value to status
-                new_status = "on" if value else "off"
-                device_service.device_service.update_device(
-                    db=db,
-                    device=device,
-                    device_in=device_schemas.DeviceUpdate(status=new_status)
-                )
-                db.refresh(device)
-
-                # Create a command record
-                command = device_models.DeviceCommand(
-                    device_id=device.id,
-                    command_type="open" if new_status == "on" else "close",
-                    status="pending"
-                )
-                db.add(command)
-                db.commit()
-                db.refresh(command)
-
-                # Publish MQTT message
-                topic = f"{current_user.id}/{device.id}/command"
-                payload = json.dumps({
-                    "command": "open" if new_status == "on" else "close",
-                    "command_id": command.id
-                })
-                mqtt_client.publish(topic, payload)
-
-                device_capabilities.append(device_schemas.DeviceActionCapability(
-                    type=cap.type,
-                    state={
-                        "instance": instance,
-                        "action_result": {"status": "DONE"}
-                    }
-                ))
-        response_devices.append(device_schemas.DeviceActionDevice(
-            id=str(device.id),
-            custom_data={},
-            capabilities=device_capabilities
-        ))
-    return device_schemas.UserDevicesActionResponse(
-        payload=device_schemas.UserDevicesActionPayload(devices=response_devices)
+    rate_limiter.check_user(current_user.id)
+    devices = device_command_service.execute_actions(
+        db=db,
+        user_id=current_user.id,
+        requested=[
+            (req_device.id, [(cap.type, cap.state) for cap in req_device.capabilities])
+            for req_device in request.payload.devices
+        ],
+        allowed=lambda device_id: rate_limiter.device_allowed(current_user.id, device_id),
     )
+    return ORJSONResponse({"payload": {"devices": devices}})
+
+@router.post("/devices/group-action", response_model=device_schemas.DeviceGroupActionResponse)
+async def group_action(
+    request: device_schemas.DeviceGroupActionRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Apply the same capability states to all of the user's devices in a room
+    and/or of a type, e.g. close all curtains in the bedroom:
+
+    ```json
+    {
+        "room": "bedroom",
+        "type": "curtain",
+        "capabilities": [
+            {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": false}}
+        ]
+    }
+    ```
+
+    Returns per-device results in the format of POST /user/devices/action.
+    Groups of more than GROUP_ACTION_MAX_DEVICES devices are rejected with 400.
+    """
+    rate_limiter.check_user(current_user.id)
+    try:
+        result = device_command_service.execute_group_action(
+            db=db,
+            user_id=current_user.id,
+            capabilities=[(cap.type, cap.state) for cap in request.capabilities],
+            room=request.room,
+            device_type=request.type,
+            allowed=lambda device_id: rate_limiter.device_allowed(current_user.id, device_id),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return ORJSONResponse(result)
  
+# Live device updates (status, battery, events, command results)
+# WS https://example.com/v1.0/user/devices/ws?access_token=...
+@router.websocket("/user/devices/ws")
+async def device_updates_websocket(
+    websocket: WebSocket,
+    access_token: Optional[str] = Query(None),
+):
+    """
+    Push the current user's device updates as JSON text messages.
+
+    Browsers can't set headers on a WebSocket, so the access token is passed
+    in the query string. A {"type": "ping"} message is sent when idle.
+    """
+    user = await authenticate_token(access_token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+
+    await websocket.accept()
+    subscriber = device_event_hub.subscribe(user.id)
+    try:
+        while True:
+            try:
+                data = await asyncio.wait_for(subscriber.get(), timeout=settings.REALTIME_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                data = '{"type":"ping"}'
+            if data is None:
+                # Too slow to keep up: the client reconnects and refetches its devices
+                await websocket.close(code=status.WS_1013_TRY_AGAIN_LATER)
+                break
+            await websocket.send_text(data)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        device_event_hub.unsubscribe(subscriber)
+
+# GET https://example.com/v1.0/user/devices/stream
+@router.get("/user/devices/stream")
+async def device_updates_stream(
+    request: Request,
+    access_token: Optional[str] = Query(None),
+):
+    """
+    Server-Sent Events version of the device updates WebSocket.
+
+    Authenticates with the Authorization header, or the access_token query
+    parameter for EventSource clients which can't set headers.
+    """
+    authorization = request.headers.get("Authorization", "")
+    if authorization.lower().startswith("bearer "):
+        access_token = authorization[7:]
+    user = await authenticate_token(access_token)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    subscriber = device_event_hub.subscribe(user.id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    data = await asyncio.wait_for(subscriber.get(), timeout=settings.REALTIME_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if data is None:
+                    break  # Too slow to keep up, EventSource reconnects by itself
+                yield f"data: {data}\n\n"
+        finally:
+            device_event_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Unlink account
 # POST https://example.com/v1.0/user/unlink
 @router.post("/user/unlink", response_model=common_schemas.Message, status_code=status.HTTP_200_OK)
 def unlink_account(
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_db_user)
 ):
     """
     Unlink the user's Yandex account.
@@ -422,3 +618,51 @@ async def add_serial_number(
         serial_number=device_schemas.SerialNumberRead.model_validate(serial_number_obj, from_attributes=True),
         message=message
     )
+
+@router.post("/serial-numbers/import", response_model=device_schemas.SerialNumberImportResponse)
+def import_serial_numbers(
+    file: UploadFile = File(..., description="Text/CSV file with one serial number per line"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Bulk import serial numbers from an uploaded file. (Admin only)
+
+    The file is streamed line by line, so batches of hundreds of thousands of serial
+    numbers are imported without loading the whole upload into memory. Invalid,
+    duplicated and already existing serial numbers are reported per row.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    # Take the first CSV column so exports with extra columns can be uploaded as is
+    lines = (line.split(",", 1)[0] for line in codecs.iterdecode(file.file, "utf-8-sig"))
+    try:
+        return device_service.device_service.import_serial_numbers(db=db, lines=lines)
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="File must be UTF-8 encoded")
+
+
+@router.post("/serial-numbers/claim", response_model=device_schemas.SerialNumberClaimResponse)
+def claim_serial_numbers(
+    claim_in: device_schemas.SerialNumberClaimRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Reserve N free serial numbers for a factory line. (Admin only)
+
+    Concurrent requests receive disjoint sets of serial numbers. Fewer than `count`
+    serial numbers are returned when the pool of free ones runs out.
+    """
+    if not current_user.is_superuser:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not enough permissions")
+
+    claimed = device_service.device_service.claim_free_serial_numbers(
+        db=db, count=claim_in.count, factory_line=claim_in.factory_line
+    )
+    return device_schemas.SerialNumberClaimResponse(
+        factory_line=claim_in.factory_line,
+        serial_numbers=[device_schemas.SerialNumberRead.model_validate(sn, from_attributes=True) for sn in claimed],
+        total=len(claimed)
+    )
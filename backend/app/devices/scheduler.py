@@ -0,0 +1,308 @@
+"""
+Scheduled and delayed device commands.
+
+Schedules are rows of scheduled_commands (status "scheduled"), so they
+survive restarts. CommandScheduler keeps the distinct run times of the next
+SCHEDULER_WINDOW_SECONDS in a min-heap and sleeps until the earliest one.
+The window is reloaded every SCHEDULER_POLL_SECONDS, which also picks up
+schedules created through other workers; schedules created through this
+worker are pushed onto the heap directly.
+
+When a run time comes due, due rows are claimed in batches of
+SCHEDULER_BATCH_SIZE with a single UPDATE ... RETURNING (FOR UPDATE SKIP
+LOCKED on PostgreSQL, so workers split the rows instead of waiting on each
+other) and executed through DeviceCommandService.execute_actions, one call
+per user in the batch. Batches run one after another, so a large number of
+schedules firing at the same minute becomes a steady stream of small
+transactions rather than a burst of queries.
+
+Rows claimed by a worker that stopped before finishing them are released
+after SCHEDULER_CLAIM_TIMEOUT_SECONDS. Running them again is safe since
+actions only publish capability values that differ from the desired state.
+Schedules more than SCHEDULER_MAX_LATENESS_SECONDS late (e.g. after a long
+outage) are marked "expired" instead of run.
+"""
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from ..database.core import SessionFactory
+from . import models as device_models
+from .capabilities import InvalidCapabilityValue, get_capability
+from .commands import RequestedCapability, action_failed, action_result, device_command_service
+
+logger = logging.getLogger(__name__)
+
+
+class CommandScheduler:
+    def __init__(self):
+        # Distinct run times of the loaded window; only touched from the event loop
+        self._heap: List[datetime] = []
+        self._times: Set[datetime] = set()
+        self._loaded_until: Optional[datetime] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.done = 0
+        self.failed = 0
+        self.expired = 0
+
+    # --- Schedules ---
+
+    def create(
+        self,
+        db: Session,
+        user_id: int,
+        device_id: int,
+        capabilities: Sequence[RequestedCapability],
+        run_at: datetime,
+    ) -> device_models.ScheduledCommand:
+        """Validate and store a schedule; raises ValueError for invalid capabilities or too many schedules."""
+        for capability_type, state in capabilities:
+            capability = get_capability(capability_type)
+            if capability is None:
+                raise ValueError(f"Unsupported capability {capability_type}")
+            try:
+                capability.validate(state.get("instance"), state.get("value"))
+            except InvalidCapabilityValue as e:
+                raise ValueError(str(e))
+
+        pending = db.scalar(
+            select(func.count(device_models.ScheduledCommand.id)).where(
+                device_models.ScheduledCommand.device_id == device_id,
+                device_models.ScheduledCommand.status == "scheduled",
+            )
+        )
+        if pending >= settings.SCHEDULER_MAX_PER_DEVICE:
+            raise ValueError(f"Device already has {pending} scheduled commands")
+
+        schedule = device_models.ScheduledCommand(
+            user_id=user_id,
+            device_id=device_id,
+            capabilities=[{"type": capability_type, "state": state} for capability_type, state in capabilities],
+            run_at=run_at,
+            status="scheduled",
+        )
+        db.add(schedule)
+        db.commit()
+        db.refresh(schedule)
+        self._push(run_at)
+        return schedule
+
+    def list_scheduled(self, db: Session, device_id: int) -> List[device_models.ScheduledCommand]:
+        return db.execute(
+            select(device_models.ScheduledCommand)
+            .where(
+                device_models.ScheduledCommand.device_id == device_id,
+                device_models.ScheduledCommand.status == "scheduled",
+            )
+            .order_by(device_models.ScheduledCommand.run_at)
+        ).scalars().all()
+
+    def cancel(self, db: Session, device_id: int, schedule_id: int) -> bool:
+        """Cancel a schedule that hasn't run yet; False when there is none."""
+        cancelled = db.execute(
+            update(device_models.ScheduledCommand)
+            .where(
+                device_models.ScheduledCommand.id == schedule_id,
+                device_models.ScheduledCommand.device_id == device_id,
+                device_models.ScheduledCommand.status == "scheduled",
+            )
+            .values(status="cancelled", completed_at=datetime.utcnow())
+        ).rowcount
+        db.commit()
+        return cancelled > 0
+
+    # --- Dispatch ---
+
+    def load_window(self, db: Session, now: datetime) -> Tuple[List[datetime], datetime]:
+        """
+        Release stale claims and load the run times due within the window.
+
+        Returns the times and the end of the loaded window.
+        """
+        released = db.execute(
+            update(device_models.ScheduledCommand)
+            .where(
+                device_models.ScheduledCommand.status == "running",
+                device_models.ScheduledCommand.claimed_at < now - timedelta(seconds=settings.SCHEDULER_CLAIM_TIMEOUT_SECONDS),
+            )
+            .values(status="scheduled", claimed_at=None)
+        ).rowcount
+        if released:
+            logger.warning(f"Released {released} scheduled commands claimed by a stopped worker.")
+
+        loaded_until = now + timedelta(seconds=settings.SCHEDULER_WINDOW_SECONDS)
+        times = db.execute(
+            select(device_models.ScheduledCommand.run_at)
+            .where(
+                device_models.ScheduledCommand.status == "scheduled",
+                device_models.ScheduledCommand.run_at <= loaded_until,
+            )
+            .group_by(device_models.ScheduledCommand.run_at)
+            .order_by(device_models.ScheduledCommand.run_at)
+            .limit(settings.SCHEDULER_MAX_LOADED)
+        ).scalars().all()
+        db.commit()
+        if len(times) == settings.SCHEDULER_MAX_LOADED:
+            # Later times of the window didn't fit; they are loaded on the next reload
+            loaded_until = times[-1]
+        return times, loaded_until
+
+    def claim(self, db: Session, now: datetime) -> List[Any]:
+        """Mark up to SCHEDULER_BATCH_SIZE due schedules as running and return them."""
+        due = (
+            select(device_models.ScheduledCommand.id)
+            .where(
+                device_models.ScheduledCommand.status == "scheduled",
+                device_models.ScheduledCommand.run_at <= now,
+            )
+            .order_by(device_models.ScheduledCommand.run_at)
+            .limit(settings.SCHEDULER_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        rows = db.execute(
+            update(device_models.ScheduledCommand)
+            .where(device_models.ScheduledCommand.id.in_(due.scalar_subquery()))
+            .values(status="running", claimed_at=now)
+            .returning(
+                device_models.ScheduledCommand.id,
+                device_models.ScheduledCommand.user_id,
+                device_models.ScheduledCommand.device_id,
+                device_models.ScheduledCommand.capabilities,
+                device_models.ScheduledCommand.run_at,
+            )
+            .execution_options(synchronize_session=False)
+        ).all()
+        db.commit()
+        return rows
+
+    def dispatch_batch(self, now: datetime) -> int:
+        """Claim and execute one batch of due schedules; returns the number claimed."""
+        with SessionFactory() as db:
+            rows = self.claim(db, now)
+            if not rows:
+                return 0
+
+            late_before = now - timedelta(seconds=settings.SCHEDULER_MAX_LATENESS_SECONDS)
+            outcomes: List[Dict[str, Any]] = []
+            by_user: Dict[int, List[Any]] = {}
+            for row in rows:
+                if row.run_at < late_before:
+                    outcomes.append({"id": row.id, "status": "expired", "completed_at": now})
+                else:
+                    by_user.setdefault(row.user_id, []).append(row)
+
+            for user_id, user_rows in by_user.items():
+                try:
+                    results = device_command_service.execute_actions(
+                        db=db,
+                        user_id=user_id,
+                        requested=[
+                            (str(row.device_id), [(capability["type"], capability["state"]) for capability in row.capabilities])
+                            for row in user_rows
+                        ],
+                    )
+                except Exception as e:
+                    db.rollback()
+                    logger.error(f"Failed to run scheduled commands of user {user_id}: {e}")
+                    results = [
+                        {"id": str(row.device_id), "action_result": action_result("ERROR", "INTERNAL_ERROR", str(e))}
+                        for row in user_rows
+                    ]
+                completed_at = datetime.utcnow()
+                for row, result in zip(user_rows, results):
+                    outcomes.append({
+                        "id": row.id,
+                        "status": "error" if action_failed(result) else "done",
+                        "completed_at": completed_at,
+                        "result": result,
+                    })
+
+            # Bulk UPDATE by primary key
+            db.execute(update(device_models.ScheduledCommand), outcomes)
+            db.commit()
+
+        for outcome in outcomes:
+            if outcome["status"] == "done":
+                self.done += 1
+            elif outcome["status"] == "error":
+                self.failed += 1
+            else:
+                self.expired += 1
+        logger.info(f"Ran {len(rows)} scheduled commands due at {now.isoformat()}.")
+        return len(rows)
+
+    # --- Timer ---
+
+    def start(self) -> None:
+        """Start the timer; called from app.main.lifespan."""
+        if not settings.SCHEDULER_ENABLED:
+            logger.info("Command scheduler disabled.")
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._loop = None
+
+    def _push(self, run_at: datetime) -> None:
+        """Add a new run time to the heap when it falls within the loaded window; thread-safe."""
+        if self._loop is None or self._loaded_until is None or run_at > self._loaded_until:
+            return
+        self._loop.call_soon_threadsafe(self._add_time, run_at)
+
+    def _add_time(self, run_at: datetime) -> None:
+        if run_at not in self._times:
+            self._times.add(run_at)
+            heapq.heappush(self._heap, run_at)
+            self._wakeup.set()
+
+    def _load(self) -> Tuple[List[datetime], datetime]:
+        with SessionFactory() as db:
+            return self.load_window(db, datetime.utcnow())
+
+    async def _run(self) -> None:
+        reload_at = datetime.min
+        while True:
+            try:
+                now = datetime.utcnow()
+                if now >= reload_at:
+                    times, self._loaded_until = await asyncio.to_thread(self._load)
+                    self._times.update(times)
+                    self._heap = list(self._times)
+                    heapq.heapify(self._heap)
+                    reload_at = now + timedelta(seconds=settings.SCHEDULER_POLL_SECONDS)
+
+                if self._heap and self._heap[0] <= now:
+                    while self._heap and self._heap[0] <= now:
+                        self._times.discard(heapq.heappop(self._heap))
+                    while await asyncio.to_thread(self.dispatch_batch, now) == settings.SCHEDULER_BATCH_SIZE:
+                        pass
+                    continue
+            except Exception as e:
+                logger.error(f"Command scheduler failed: {e}")
+                reload_at = datetime.utcnow() + timedelta(seconds=settings.SCHEDULER_POLL_SECONDS)
+
+            wait_until = min(self._heap[0], reload_at) if self._heap else reload_at
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    timeout=max((wait_until - datetime.utcnow()).total_seconds(), 0.01),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+
+command_scheduler = CommandScheduler()
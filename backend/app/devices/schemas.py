@@ -1,6 +1,6 @@
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, model_validator
 from typing import Any, Dict, List, Optional
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from app.auth.schemas import UserRead
 
 class DeviceBase(BaseModel):
@@ -19,6 +19,7 @@ class DeviceUpdate(BaseModel):
 
 class DeviceRead(DeviceBase):
     id: int
+    serial_number: Optional[str] = None  # None for devices synced from Yandex IoT
     user_id: int
     owner: Optional[UserRead] = None
     status: Optional[str] = "off"  # 'on' or 'off'
@@ -56,10 +57,6 @@ class DeviceListResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
-class DeviceQuery(BaseModel):
-    name: Optional[str] = None
-    user_id: Optional[int] = None
-
 class DevicesListResponse(BaseModel):
     devices: list[DeviceRead]
     total: int
@@ -102,8 +99,10 @@ class DeviceActionCapability(BaseModel):
 
 class DeviceActionDevice(BaseModel):
     id: str
-    custom_data: Dict[str, Any]
-    capabilities: List[DeviceActionCapability]
+    custom_data: Dict[str, Any] = {}
+    capabilities: List[DeviceActionCapability] = []
+    # Device-level error, e.g. {"status": "ERROR", "error_code": "DEVICE_NOT_FOUND"}
+    action_result: Optional[dict] = None
 
 class UserDevicesActionPayload(BaseModel):
     devices: List[DeviceActionDevice]
@@ -111,6 +110,55 @@ class UserDevicesActionPayload(BaseModel):
 class UserDevicesActionResponse(BaseModel):
     payload: UserDevicesActionPayload
 
+# --- Group actions (POST /devices/group-action) ---
+
+class DeviceCapabilityAction(BaseModel):
+    type: str
+    state: dict
+
+class DeviceGroupActionRequest(BaseModel):
+    room: Optional[str] = None
+    type: Optional[str] = None
+    capabilities: List[DeviceCapabilityAction] = Field(..., min_length=1)
+
+    @model_validator(mode="after")
+    def check_target(self):
+        if self.room is None and self.type is None:
+            raise ValueError("Either room or type is required")
+        return self
+
+class DeviceGroupActionResponse(BaseModel):
+    room: Optional[str] = None
+    type: Optional[str] = None
+    total: int
+    succeeded: int
+    failed: int
+    commands: int  # Capability changes recorded; states already applied don't count
+    devices: List[DeviceActionDevice]
+
+# --- State query (Yandex Smart Home POST /user/devices/query) ---
+
+class DeviceStateQueryDevice(BaseModel):
+    id: str
+    custom_data: Dict[str, Any] = {}
+
+class DeviceStateQueryRequest(BaseModel):
+    devices: List[DeviceStateQueryDevice]
+
+class DeviceStateDevice(BaseModel):
+    id: str
+    capabilities: Optional[List[DeviceActionCapability]] = None
+    # Set instead of capabilities when the state can't be reported
+    error_code: Optional[str] = None  # 'DEVICE_UNREACHABLE' or 'DEVICE_NOT_FOUND'
+    error_message: Optional[str] = None
+
+class DeviceStatePayload(BaseModel):
+    devices: List[DeviceStateDevice]
+
+class DeviceStateQueryResponse(BaseModel):
+    request_id: str
+    payload: DeviceStatePayload
+
 class SerialNumberBase(BaseModel):
     value: str = Field(..., description="Serial number in format SNXXXXXXXXXXXXX (SN followed by 13 digits)", example="SN1234567890123")
     device_id: Optional[int] = None
@@ -128,6 +176,7 @@ class SerialNumberRead(SerialNumberBase):
     is_free: bool
     user_id: Optional[int] = None
     device_id: Optional[int] = None
+    factory_line: Optional[str] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -141,6 +190,28 @@ class SerialNumberListResponse(BaseModel):
 
     model_config = ConfigDict(from_attributes=True)
 
+class SerialNumberClaimRequest(BaseModel):
+    count: int = Field(..., ge=1, le=10000, description="Number of free serial numbers to reserve")
+    factory_line: str = Field(..., min_length=1, max_length=50, description="Factory line the serial numbers are reserved for")
+
+class SerialNumberClaimResponse(BaseModel):
+    factory_line: str
+    serial_numbers: List[SerialNumberRead]
+    total: int
+
+class SerialNumberRejection(BaseModel):
+    line: int
+    value: str
+    reason: str  # 'invalid_format', 'duplicate_in_file', 'already_exists'
+
+class SerialNumberImportResponse(BaseModel):
+    received: int
+    inserted: int
+    rejected: int
+    rejections: List[SerialNumberRejection]
+    elapsed_seconds: float
+    rows_per_second: float
+
 
 class DeviceCommandRead(BaseModel):
     id: int
@@ -149,6 +220,11 @@ class DeviceCommandRead(BaseModel):
     status: str
     created_at: datetime
     completed_at: Optional[datetime] = None
+    expires_at: Optional[datetime] = None
+    capability: Optional[str] = None
+    instance: Optional[str] = None
+    value: Optional[Any] = None
+    shadow_version: Optional[int] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -158,6 +234,12 @@ class DeviceCommandListResponse(BaseModel):
     total: int
 
 
+class DeviceCommandQueueResponse(BaseModel):
+    device_id: int
+    depth: int
+    commands: List[DeviceCommandRead]
+
+
 class DeviceEventRead(BaseModel):
     id: int
     device_id: int
@@ -171,3 +253,61 @@ class DeviceEventRead(BaseModel):
 class DeviceEventListResponse(BaseModel):
     events: List[DeviceEventRead]
     total: int
+
+
+class DeviceShadowCapability(BaseModel):
+    type: str
+    instance: str
+    desired: Any
+    reported: Optional[Any] = None  # None until the device reports it
+    in_sync: bool
+
+
+class DeviceShadowRead(BaseModel):
+    device_id: int
+    version: int
+    reported_at: Optional[datetime] = None
+    capabilities: List[DeviceShadowCapability]
+
+
+class ScheduledCommandCreate(BaseModel):
+    # Either an absolute time or a delay from now
+    run_at: Optional[datetime] = None
+    delay_seconds: Optional[int] = Field(None, ge=0, le=366 * 24 * 3600)
+    capabilities: List[DeviceCapabilityAction] = Field(..., min_length=1)
+
+    @model_validator(mode="after")
+    def resolve_run_at(self):
+        if (self.run_at is None) == (self.delay_seconds is None):
+            raise ValueError("Exactly one of run_at and delay_seconds is required")
+        if self.run_at is None:
+            self.run_at = datetime.utcnow() + timedelta(seconds=self.delay_seconds)
+        elif self.run_at.tzinfo is not None:
+            # Stored as naive UTC like the other timestamps
+            self.run_at = self.run_at.astimezone(timezone.utc).replace(tzinfo=None)
+        return self
+
+
+class ScheduledCommandRead(BaseModel):
+    id: int
+    device_id: int
+    run_at: datetime
+    status: str
+    capabilities: List[DeviceCapabilityAction]
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    result: Optional[dict] = None
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class ScheduledCommandListResponse(BaseModel):
+    schedules: List[ScheduledCommandRead]
+    total: int
+
+
+class YandexDeviceSyncSummary(BaseModel):
+    created: List[int] = Field(default_factory=list, description="Ids of devices added from the Yandex account")
+    updated: List[int] = Field(default_factory=list, description="Ids of devices whose name, room or type changed")
+    deleted: List[int] = Field(default_factory=list, description="Ids of devices removed from the Yandex account")
+    unchanged: int = 0
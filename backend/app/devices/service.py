@@ -1,16 +1,59 @@
 # app/item/service.py
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import select, asc, desc, func
-from typing import Optional, List
+from sqlalchemy import select, update, asc, desc, func, insert, text
+from typing import Optional, List, Iterable
+from datetime import datetime, timezone
 import logging
 import re
+import time
 
+import orjson
+
+from app.auth.models import User
+from app.database.upsert import dialect_insert
 from app.devices import models as device_models
 from app.devices import schemas as device_schemas
+from app.devices.state_cache import device_state_cache
+from app.devices.capabilities import ON_OFF
 
 # Get logger
 logger = logging.getLogger(__name__)
 
+# Serial number format SNXXXXXXXXXXXXX (SN + 13 digits), compiled once for bulk imports
+SERIAL_NUMBER_PATTERN = re.compile(r'^SN\d{13}$')
+
+# Number of rows buffered per round-trip when importing serial numbers without COPY
+SERIAL_NUMBER_IMPORT_BATCH_SIZE = 5000
+
+# Device fields that appear in the discovery payload; changing one rebuilds the snapshot
+DISCOVERY_FIELDS = {"name", "room", "type", "serial_number"}
+
+
+# Columns selected by the device list fast path (see DeviceService._device_read_query)
+DEVICE_READ_COLUMNS = (
+    device_models.Device.id,
+    device_models.Device.name,
+    device_models.SerialNumber.value.label("serial_number"),
+    device_models.Device.room,
+    device_models.Device.user_id,
+    device_models.Device.status,
+    device_models.Device.type,
+)
+OWNER_READ_COLUMNS = tuple(
+    getattr(User, field).label(f"owner_{field}")
+    for field in (
+        "id", "email", "name", "is_superuser", "is_active", "avatar_url", "created_at",
+        "yandex_oauth_access_token", "yandex_oauth_refresh_token", "yandex_oauth_token_expires_at", "yandex_id",
+    )
+)
+
+def parse_device_id(device_id: str) -> Optional[int]:
+    """The numeric id of a device id sent by Yandex, or None when it can't be one of ours."""
+    # Only ASCII digits: isdigit() accepts "²", which int() rejects, and int("٣") is 3
+    if device_id.isascii() and device_id.isdecimal():
+        return int(device_id)
+    return None
+
 class DeviceService:
     def get_device_by_id(self, db: Session, device_id: int, options: List = None) -> Optional[device_models.Device]:
         """Retrieve a single device by its ID."""
@@ -35,6 +78,54 @@ class DeviceService:
         logger.info(f"Device with serial number {device_serial_number} {'found' if device else 'not found'}.")
         return device
 
+    def _device_read_query(self):
+        """
+        Column-projected SELECT with everything DeviceRead needs, owner included.
+
+        Used by the list endpoints instead of loading ORM objects: rows are turned into
+        response dicts directly by _device_rows_to_dicts.
+        """
+        return (
+            select(*DEVICE_READ_COLUMNS, *OWNER_READ_COLUMNS)
+            .select_from(device_models.Device)
+            .join(User, User.id == device_models.Device.user_id)
+            .outerjoin(device_models.SerialNumber, device_models.SerialNumber.id == device_models.Device.serial_number_id)
+        )
+
+    def _device_rows_to_dicts(self, rows) -> List[dict]:
+        """Build DeviceRead-shaped dicts from _device_read_query rows."""
+        owners = {}
+        devices = []
+        for row in rows:
+            owner = owners.get(row.user_id)
+            if owner is None:
+                owner = owners[row.user_id] = {
+                    "id": row.owner_id,
+                    "email": row.owner_email,
+                    "name": row.owner_name,
+                    "is_superuser": row.owner_is_superuser,
+                    "is_active": row.owner_is_active,
+                    "avatar_url": row.owner_avatar_url,
+                    "email_verified_at": None,
+                    "created_at": row.owner_created_at,
+                    "yandex_oauth_access_token": row.owner_yandex_oauth_access_token,
+                    "yandex_oauth_refresh_token": row.owner_yandex_oauth_refresh_token,
+                    "yandex_oauth_token_expires_at": row.owner_yandex_oauth_token_expires_at,
+                    "yandex_id": row.owner_yandex_id,
+                }
+            devices.append({
+                "id": row.id,
+                "name": row.name,
+                "serial_number": row.serial_number,
+                "room": row.room,
+                "user_id": row.user_id,
+                "owner": owner,
+                "status": row.status,
+                "type": row.type,
+                "custom_data": {},
+            })
+        return devices
+
     def list_devices(
         self,
         db: Session,
@@ -42,12 +133,13 @@ class DeviceService:
         limit: int = 100,
         filters: device_schemas.DeviceFilter = None,
         sort: device_schemas.DeviceSort = None,
-        options: List = None
-    ):
+    ) -> dict:
         """
         Retrieve a list of devices with optional filtering, sorting, and pagination.
+
+        Returns a DeviceListResponse-shaped dict, ready for ORJSONResponse.
         """
-        query = select(device_models.Device)
+        query = self._device_read_query()
 
         # Filtering
         if filters:
@@ -58,7 +150,10 @@ class DeviceService:
 
         # Sorting
         if sort:
-            sort_field = getattr(device_models.Device, sort.field, None)
+            if sort.field == "serial_number":
+                sort_field = device_models.SerialNumber.value
+            else:
+                sort_field = device_models.Device.__table__.columns.get(sort.field)
             if sort_field is not None:
                 if sort.direction == "desc":
                     query = query.order_by(desc(sort_field))
@@ -67,10 +162,6 @@ class DeviceService:
         else:
             query = query.order_by(asc(device_models.Device.id))
 
-        if options:
-            for option in options:
-                query = query.options(option)
-
         # Count total
         total_query = select(func.count(device_models.Device.id))
         if filters:
@@ -83,45 +174,170 @@ class DeviceService:
 
         # Pagination
         query = query.offset(skip).limit(limit)
-        result = db.execute(query)
-        devices = result.scalars().all()
-
-        devices_read = [device_schemas.DeviceRead.model_validate(device, from_attributes=True) for device in devices]
+        rows = db.execute(query).all()
 
-        return device_schemas.DeviceListResponse(
-            devices=devices_read,
-            total=total
-        )
+        return {"devices": self._device_rows_to_dicts(rows), "total": total}
 
     def validate_serial_number_format(self, serial_number: str) -> bool:
         """Validate serial number format SNXXXXXXXXXXXXX (SN + 13 digits)."""
-        pattern = r'^SN\d{13}$'
-        return bool(re.match(pattern, serial_number))
+        return SERIAL_NUMBER_PATTERN.match(serial_number) is not None
 
     def add_serial_numbers_to_db(self, db: Session, serial_numbers: List[str]) -> List[device_models.SerialNumber]:
         """Add multiple serial numbers to the database."""
         logger.info(f"Adding {len(serial_numbers)} serial numbers to database.")
-        created_serial_numbers = []
-        
+        valid = []
+        seen = set()
         for sn in serial_numbers:
             if not self.validate_serial_number_format(sn):
                 logger.warning(f"Invalid serial number format: {sn}. Expected format: SNXXXXXXXXXXXXX (SN followed by 13 digits)")
                 continue
-                
-            existing = db.execute(select(device_models.SerialNumber).filter(device_models.SerialNumber.value == sn)).scalars().first()
-            
-            if existing:
-                logger.warning(f"Serial number {sn} already exists in database.")
-                continue
-                
-            serial_number_obj = device_models.SerialNumber(value=sn)
-            db.add(serial_number_obj)
-            created_serial_numbers.append(serial_number_obj)
-        
+            if sn not in seen:
+                seen.add(sn)
+                valid.append(sn)
+
+        # One lookup for the whole batch instead of a SELECT per serial number
+        existing = set()
+        if valid:
+            existing = set(db.execute(
+                select(device_models.SerialNumber.value).filter(device_models.SerialNumber.value.in_(valid))
+            ).scalars().all())
+        for sn in existing:
+            logger.warning(f"Serial number {sn} already exists in database.")
+
+        created_serial_numbers = [device_models.SerialNumber(value=sn) for sn in valid if sn not in existing]
+        db.add_all(created_serial_numbers)
         db.commit()
         logger.info(f"Successfully added {len(created_serial_numbers)} serial numbers.")
         return created_serial_numbers
 
+    def import_serial_numbers(self, db: Session, lines: Iterable[str]) -> device_schemas.SerialNumberImportResponse:
+        """
+        Bulk import serial numbers from a stream of lines (one serial number per line).
+
+        Rows are validated with the precompiled pattern while streaming. On PostgreSQL the
+        valid rows are COPY'd into a temporary staging table and merged with a single
+        INSERT ... ON CONFLICT DO NOTHING; other dialects fall back to batched inserts.
+        Returns a per-row rejection report and the achieved rows per second.
+        """
+        started = time.perf_counter()
+        rejections: List[device_schemas.SerialNumberRejection] = []
+
+        def valid_rows():
+            for line_no, raw in enumerate(lines, start=1):
+                value = raw.strip()
+                if not value:
+                    continue
+                if SERIAL_NUMBER_PATTERN.match(value) is None:
+                    rejections.append(device_schemas.SerialNumberRejection(
+                        line=line_no, value=value[:64], reason="invalid_format"
+                    ))
+                    continue
+                yield line_no, value
+
+        try:
+            if db.get_bind().dialect.name == "postgresql":
+                received, inserted = self._import_serial_numbers_copy(db, valid_rows(), rejections)
+            else:
+                received, inserted = self._import_serial_numbers_batched(db, valid_rows(), rejections)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+
+        received += sum(1 for r in rejections if r.reason == "invalid_format")
+        elapsed = time.perf_counter() - started
+        rejections.sort(key=lambda r: r.line)
+        logger.info(f"Imported {inserted} of {received} serial numbers in {elapsed:.2f}s.")
+        return device_schemas.SerialNumberImportResponse(
+            received=received,
+            inserted=inserted,
+            rejected=len(rejections),
+            rejections=rejections,
+            elapsed_seconds=round(elapsed, 3),
+            rows_per_second=round(received / elapsed, 1) if elapsed > 0 else float(received),
+        )
+
+    def _import_serial_numbers_copy(self, db: Session, rows, rejections: list) -> tuple[int, int]:
+        """PostgreSQL path: COPY into a staging table, then merge set-wise."""
+        db.execute(text(
+            "CREATE TEMP TABLE serial_numbers_staging (line integer NOT NULL, value varchar(15) NOT NULL) ON COMMIT DROP"
+        ))
+        received = 0
+        raw_connection = db.connection().connection.driver_connection
+        with raw_connection.cursor() as cursor:
+            with cursor.copy("COPY serial_numbers_staging (line, value) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    received += 1
+
+        # Duplicates within the uploaded file: keep the first occurrence
+        duplicates = db.execute(text(
+            "SELECT line, value FROM ("
+            " SELECT line, value, row_number() OVER (PARTITION BY value ORDER BY line) AS rn"
+            " FROM serial_numbers_staging) ranked WHERE rn > 1"
+        )).all()
+        rejections.extend(
+            device_schemas.SerialNumberRejection(line=line, value=value, reason="duplicate_in_file")
+            for line, value in duplicates
+        )
+
+        existing = db.execute(text(
+            "SELECT DISTINCT ON (s.value) s.line, s.value FROM serial_numbers_staging s"
+            " JOIN serial_numbers n ON n.value = s.value ORDER BY s.value, s.line"
+        )).all()
+        rejections.extend(
+            device_schemas.SerialNumberRejection(line=line, value=value, reason="already_exists")
+            for line, value in existing
+        )
+
+        result = db.execute(text(
+            "INSERT INTO serial_numbers (value, is_free, created_at, updated_at)"
+            " SELECT DISTINCT value, true, timezone('utc', now()), timezone('utc', now())"
+            " FROM serial_numbers_staging"
+            " ON CONFLICT (value) DO NOTHING"
+        ))
+        return received, result.rowcount
+
+    def _import_serial_numbers_batched(self, db: Session, rows, rejections: list) -> tuple[int, int]:
+        """Portable path: de-duplicate and insert in fixed-size batches."""
+        received = 0
+        inserted = 0
+        seen = set()
+        batch = []
+
+        def flush(batch):
+            existing = set(db.execute(
+                select(device_models.SerialNumber.value)
+                .filter(device_models.SerialNumber.value.in_([value for _, value in batch]))
+            ).scalars().all())
+            new_values = []
+            for line_no, value in batch:
+                if value in existing:
+                    rejections.append(device_schemas.SerialNumberRejection(
+                        line=line_no, value=value, reason="already_exists"
+                    ))
+                else:
+                    new_values.append({"value": value, "is_free": True})
+            if new_values:
+                db.execute(insert(device_models.SerialNumber), new_values)
+            return len(new_values)
+
+        for line_no, value in rows:
+            received += 1
+            if value in seen:
+                rejections.append(device_schemas.SerialNumberRejection(
+                    line=line_no, value=value, reason="duplicate_in_file"
+                ))
+                continue
+            seen.add(value)
+            batch.append((line_no, value))
+            if len(batch) >= SERIAL_NUMBER_IMPORT_BATCH_SIZE:
+                inserted += flush(batch)
+                batch = []
+        if batch:
+            inserted += flush(batch)
+        return received, inserted
+
     def get_all_serial_numbers(self, db: Session, skip: int = 0, limit: int = 100) -> dict:
         """Get all serial numbers with their status."""
         logger.info("Retrieving all serial numbers from database.")
@@ -147,21 +363,71 @@ class DeviceService:
         
         return sn_obj.is_free, sn_obj
 
+    def claim_serial_number(self, db: Session, serial_number: str, user_id: int, device_id: Optional[int] = None) -> Optional[int]:
+        """
+        Atomically claim a free serial number for a user.
+
+        A single UPDATE ... WHERE is_free RETURNING statement, so concurrent claims of the
+        same serial number can't both succeed. Returns the serial number id, or None if it
+        doesn't exist or is already taken. The caller owns the transaction.
+        """
+        stmt = (
+            update(device_models.SerialNumber)
+            .where(
+                device_models.SerialNumber.value == serial_number,
+                device_models.SerialNumber.is_free == True,  # noqa: E712 (indexable, unlike IS true)
+            )
+            .values(is_free=False, user_id=user_id, device_id=device_id, updated_at=datetime.now(timezone.utc))
+            .returning(device_models.SerialNumber.id)
+        )
+        return db.execute(stmt).scalar_one_or_none()
+
+    def claim_free_serial_numbers(self, db: Session, count: int, factory_line: str) -> List[device_models.SerialNumber]:
+        """
+        Reserve up to `count` free serial numbers for a factory line.
+
+        Candidate rows are picked with SELECT ... FOR UPDATE SKIP LOCKED, so concurrent
+        provisioning requests take disjoint sets instead of waiting on each other. Reserved
+        serial numbers stay free for binding by the end user.
+        """
+        logger.info(f"Claiming {count} free serial numbers for factory line {factory_line}.")
+        picked = (
+            select(device_models.SerialNumber.id)
+            .where(
+                device_models.SerialNumber.is_free == True,  # noqa: E712 (indexable, unlike IS true)
+                device_models.SerialNumber.factory_line.is_(None),
+            )
+            .order_by(device_models.SerialNumber.value)
+            .limit(count)
+            .with_for_update(skip_locked=True)
+        )
+        stmt = (
+            update(device_models.SerialNumber)
+            .where(device_models.SerialNumber.id.in_(picked.scalar_subquery()))
+            .values(factory_line=factory_line, updated_at=datetime.now(timezone.utc))
+            .returning(device_models.SerialNumber)
+            .execution_options(synchronize_session=False)
+        )
+        try:
+            claimed = db.execute(stmt).scalars().all()
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        claimed = sorted(claimed, key=lambda sn: sn.value)
+        logger.info(f"Claimed {len(claimed)} serial numbers for factory line {factory_line}.")
+        return claimed
+
     def bind_serial_number(self, db: Session, serial_number: str, user_id: int, device_id: int) -> bool:
         """Bind serial number to user and device."""
         logger.info(f"Binding serial number {serial_number} to user {user_id} and device {device_id}.")
-        
-        sn_obj = db.execute(select(device_models.SerialNumber).filter(device_models.SerialNumber.value == serial_number)).scalars().first()
-        
-        if not sn_obj or not sn_obj.is_free:
+
+        if self.claim_serial_number(db, serial_number, user_id=user_id, device_id=device_id) is None:
+            db.rollback()
             logger.warning(f"Serial number {serial_number} not available for binding.")
             return False
-        
-        sn_obj.is_free = False
-        sn_obj.user_id = user_id
-        sn_obj.device_id = device_id
         db.commit()
-        
+
         logger.info(f"Successfully bound serial number {serial_number}.")
         return True
 
@@ -188,8 +454,10 @@ class DeviceService:
         if not self.validate_serial_number_format(device_in.serial_number):
             raise ValueError(f"Invalid serial number format: {device_in.serial_number}. Expected format: SNXXXXXXXXXXXXX (SN followed by 13 digits)")
         
-        is_available, sn_obj = self.check_serial_number_availability(db, device_in.serial_number)
-        if not is_available:
+        sn_id = self.claim_serial_number(db, device_in.serial_number, user_id=owner_id)
+        if sn_id is None:
+            db.rollback()
+            _, sn_obj = self.check_serial_number_availability(db, device_in.serial_number)
             if sn_obj is None:
                 raise ValueError(f"Serial number {device_in.serial_number} not found in database")
             else:
@@ -198,15 +466,18 @@ class DeviceService:
         try:
             device_data = device_in.model_dump(exclude={'serial_number'})
             device_data['user_id'] = owner_id
-            device_data['serial_number_id'] = sn_obj.id
+            device_data['serial_number_id'] = sn_id
 
             device = device_models.Device(**device_data)
             db.add(device)
             db.flush()
             
-            sn_obj.is_free = False
-            sn_obj.user_id = owner_id
-            sn_obj.device_id = device.id
+            db.execute(
+                update(device_models.SerialNumber)
+                .where(device_models.SerialNumber.id == sn_id)
+                .values(device_id=device.id)
+            )
+            self.build_discovery_snapshot(db, owner_id)
             
             db.commit()
             db.refresh(device)
@@ -220,8 +491,14 @@ class DeviceService:
             raise ValueError(f"Failed to create device: {str(e)}")
 
     def update_device(self, db: Session, device: device_models.Device, device_in: device_schemas.DeviceUpdate) -> device_models.Device:
-        """Update an existing device."""
+        """
+        Update an existing device.
+
+        A status change is requested through the device shadow: Device.status
+        only changes once the device reports the new state.
+        """
         update_data = device_in.model_dump(exclude_unset=True)
+        requested_status = update_data.pop('status', None)
         
         try:
             if 'serial_number' in update_data and update_data['serial_number'] != device.serial_number:
@@ -230,8 +507,9 @@ class DeviceService:
                 if not self.validate_serial_number_format(new_sn_value):
                     raise ValueError(f"Invalid serial number format: {new_sn_value}.")
 
-                is_available, new_sn_obj = self.check_serial_number_availability(db, new_sn_value)
-                if not is_available:
+                # Bind new serial number
+                new_sn_id = self.claim_serial_number(db, new_sn_value, user_id=device.user_id, device_id=device.id)
+                if new_sn_id is None:
                     raise ValueError(f"Serial number {new_sn_value} is not available.")
 
                 # Unbind old serial number
@@ -240,25 +518,34 @@ class DeviceService:
                     device.serial_number_obj.user_id = None
                     device.serial_number_obj.device_id = None
 
-                # Bind new serial number
-                new_sn_obj.is_free = False
-                new_sn_obj.user_id = device.user_id
-                new_sn_obj.device_id = device.id
-                device.serial_number_id = new_sn_obj.id
-                device.serial_number_obj = new_sn_obj
+                device.serial_number_id = new_sn_id
+                device.serial_number_obj = db.get(device_models.SerialNumber, new_sn_id)
 
             for field, value in update_data.items():
                 if field != 'serial_number':
                     setattr(device, field, value)
+
+            if DISCOVERY_FIELDS.intersection(update_data):
+                db.flush()
+                self.build_discovery_snapshot(db, device.user_id)
             
             db.commit()
             db.refresh(device)
-            db.refresh(device.serial_number_obj)
+            if device.serial_number_obj is not None:  # Devices synced from Yandex have none
+                db.refresh(device.serial_number_obj)
 
         except Exception as e:
             db.rollback()
             logger.error(f"Failed to update device {device.id}: {str(e)}")
             raise
+
+        if requested_status is not None:
+            # Imported here: app.database.core imports this module before app.mqtt can load
+            from app.devices.commands import device_command_service
+
+            device_command_service.execute_actions(
+                db, device.user_id, [(str(device.id), [(ON_OFF, {"instance": "on", "value": requested_status == "on"})])]
+            )
             
         return device
 
@@ -269,8 +556,12 @@ class DeviceService:
         if serial_number:
             self.unbind_serial_number(db, serial_number)
         
+        device_id, user_id = device.id, device.user_id
         db.delete(device)
+        db.flush()
+        self.build_discovery_snapshot(db, user_id)
         db.commit()
+        device_state_cache.invalidate(device_id)
 
     def get_user_devices(
         self,
@@ -281,45 +572,145 @@ class DeviceService:
         options: List = None,
         return_orm: bool = False
     ):
-        """Get devices for a specific user."""
-        query = select(device_models.Device).where(device_models.Device.user_id == user_id)
-        if options:
-            for option in options:
-                query = query.options(option)
-        
+        """
+        Get devices for a specific user.
+
+        Returns a DevicesListResponse-shaped dict built from projected columns, or
+        ORM devices (loaded with `options`) when return_orm is set.
+        """
         total_query = select(func.count(device_models.Device.id)).where(device_models.Device.user_id == user_id)
         total = db.scalar(total_query)
-        
-        query = query.offset(skip).limit(limit)
-        result = db.execute(query)
-        devices = result.scalars().all()
-        
+
         if return_orm:
+            query = select(device_models.Device).where(device_models.Device.user_id == user_id)
+            if options:
+                for option in options:
+                    query = query.options(option)
+            query = query.order_by(asc(device_models.Device.id)).offset(skip).limit(limit)
+            devices = db.execute(query).scalars().all()
             return type('DevicesResult', (), {'devices': devices, 'total': total})()
-        
-        devices_read = [device_schemas.DeviceRead.model_validate(device, from_attributes=True) for device in devices]
-        
-        return device_schemas.DevicesListResponse(
-            devices=devices_read,
-            total=total
+
+        query = (
+            self._device_read_query()
+            .where(device_models.Device.user_id == user_id)
+            .order_by(asc(device_models.Device.id))
+            .offset(skip)
+            .limit(limit)
         )
+        return {"devices": self._device_rows_to_dicts(db.execute(query).all()), "total": total}
 
-    def query_user_devices(self, db: Session, user_id: int, filters: device_schemas.DeviceQuery):
-        """Query user devices with filters."""
-        query = select(device_models.Device).where(device_models.Device.user_id == user_id)
-        
-        if filters.name:
-            query = query.where(device_models.Device.name.ilike(f"%{filters.name}%"))
-        
-        result = db.execute(query)
-        devices = result.scalars().all()
-        
-        devices_read = [device_schemas.DeviceRead.model_validate(device, from_attributes=True) for device in devices]
-        
-        return device_schemas.DevicesListResponse(
-            devices=devices_read,
-            total=len(devices_read)
+    @staticmethod
+    def _discovery_device(row) -> dict:
+        """DevicePayloadDevice-shaped dict of a device."""
+        return {
+            "id": str(row.id),
+            "name": row.name,
+            "status_info": {"reportable": True},
+            "description": f"Device {row.name}",
+            "room": row.room,
+            "type": row.type,
+            "custom_data": {},
+            "capabilities": [{"type": "devices.capabilities.on_off"}],
+            "properties": [],
+            "device_info": {
+                "manufacturer": "Elkarobotics",
+                "model": "Unknown",
+                "serial_number": row.serial_number or "Unknown",
+                "hw_version": "1.0",
+                "sw_version": "1.0",
+            },
+        }
+
+    def build_discovery_snapshot(self, db: Session, user_id: int) -> device_models.DeviceDiscoverySnapshot:
+        """
+        Serialize the user's discovery payload into their snapshot row.
+
+        Runs in the caller's transaction, so the snapshot commits together with
+        the device change. The row is locked first so concurrent changes of
+        the same user's devices can't overwrite each other's snapshot; a
+        missing row is inserted with ON CONFLICT DO NOTHING beforehand, so
+        concurrent first builds both end up locking the same row.
+        """
+        db.execute(
+            dialect_insert(db, device_models.DeviceDiscoverySnapshot)
+            .values(user_id=user_id, devices=b"[]", device_count=0, updated_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["user_id"])
         )
+        snapshot = db.get(
+            device_models.DeviceDiscoverySnapshot, user_id, with_for_update=True, populate_existing=True
+        )
+
+        rows = db.execute(
+            select(
+                device_models.Device.id,
+                device_models.Device.name,
+                device_models.Device.room,
+                device_models.Device.type,
+                device_models.SerialNumber.value.label("serial_number"),
+            )
+            .outerjoin(device_models.SerialNumber, device_models.SerialNumber.id == device_models.Device.serial_number_id)
+            .where(device_models.Device.user_id == user_id)
+            .order_by(asc(device_models.Device.id))
+        ).all()
+        snapshot.devices = orjson.dumps([self._discovery_device(row) for row in rows])
+        snapshot.device_count = len(rows)
+        snapshot.updated_at = datetime.utcnow()
+        return snapshot
+
+    def get_discovery_devices(self, db: Session, user_id: int, skip: int = 0, limit: int = 100) -> bytes:
+        """
+        The user's discovery devices as a serialized JSON array.
+
+        The stored snapshot is returned as is when the page covers all devices;
+        it is built on first use for users who have none yet.
+        """
+        snapshot = db.get(device_models.DeviceDiscoverySnapshot, user_id)
+        if snapshot is None:
+            snapshot = self.build_discovery_snapshot(db, user_id)
+            db.commit()
+
+        if skip == 0 and snapshot.device_count <= limit:
+            return snapshot.devices
+        return orjson.dumps(orjson.loads(snapshot.devices)[skip:skip + limit])
+
+    def query_device_states(self, db: Session, user_id: int, device_ids: List[str]) -> List[dict]:
+        """
+        Current capability states of the user's devices, in the order requested.
+
+        Served from device_state_cache; only devices missing from it are loaded.
+        Returns DeviceStateDevice-shaped dicts.
+        """
+        numeric_ids = {device_id: parse_device_id(device_id) for device_id in device_ids}
+        states = device_state_cache.get_or_load(db, [id_ for id_ in numeric_ids.values() if id_ is not None])
+
+        now = datetime.utcnow()
+        devices = []
+        for device_id in device_ids:
+            state = states.get(numeric_ids[device_id])
+            if state is None or state.user_id != user_id:
+                devices.append({
+                    "id": device_id,
+                    "error_code": "DEVICE_NOT_FOUND",
+                    "error_message": "Device not found",
+                })
+            elif not state.is_reachable(now):
+                devices.append({
+                    "id": device_id,
+                    "error_code": "DEVICE_UNREACHABLE",
+                    "error_message": "Device is offline",
+                })
+            else:
+                devices.append({
+                    "id": device_id,
+                    "capabilities": [
+                        {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": state.status == "on"}},
+                        *(
+                            {"type": capability_type, "state": {"instance": instance, "value": value}}
+                            for (capability_type, instance), value in state.capabilities.items()
+                        ),
+                    ],
+                })
+        return devices
 
     def add_single_serial_number_to_db(self, db: Session, serial_number: str) -> tuple[bool, str, device_models.SerialNumber]:
         """
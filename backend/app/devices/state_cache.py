@@ -0,0 +1,167 @@
+"""
+Write-through in-memory map of device state for the Yandex state query.
+
+Entries hold what POST /user/devices/query needs (owner, capability states
+and presence) and are kept current by the MQTT `info` handler and by
+DeviceCommandService as devices report state, so repeated queries for the
+same devices don't touch the database. Devices missing from the map
+are loaded in one batch.
+
+Every worker process has its own map; entries expire after
+DEVICE_STATE_CACHE_TTL_SECONDS so changes made through another worker show
+up within that delay.
+"""
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import Session
+
+from ..config import settings
+from . import models as device_models
+from .capabilities import ON_OFF
+
+
+@dataclass
+class DeviceState:
+    user_id: int
+    status: Optional[str]  # Reported on/off state, 'on' or 'off'
+    is_online: bool
+    battery_level: Optional[int]
+    last_seen: Optional[datetime]
+    cached_at: float
+    # (type, instance) -> reported value of capabilities other than on_off, which is `status`
+    capabilities: Dict[Tuple[str, str], Any] = field(default_factory=dict)
+
+    def is_reachable(self, now: datetime) -> bool:
+        """Online according to the last `info` message, and that message isn't too old."""
+        if not self.is_online or self.last_seen is None:
+            return False
+        return now - self.last_seen <= timedelta(seconds=settings.DEVICE_PRESENCE_TIMEOUT_SECONDS)
+
+
+class DeviceStateCache:
+    def __init__(self):
+        self._states: Dict[int, DeviceState] = {}
+        # Written from the MQTT thread and read from request handlers
+        self._lock = threading.Lock()
+
+    def get_many(self, device_ids: Iterable[int]) -> Tuple[Dict[int, DeviceState], List[int]]:
+        """Return the cached states of `device_ids` and the ids that have to be loaded."""
+        expires_before = time.monotonic() - settings.DEVICE_STATE_CACHE_TTL_SECONDS
+        found, missing = {}, []
+        with self._lock:
+            for device_id in device_ids:
+                state = self._states.get(device_id)
+                if state is not None and state.cached_at >= expires_before:
+                    found[device_id] = state
+                else:
+                    missing.append(device_id)
+        return found, missing
+
+    def load(self, db: Session, device_ids: List[int]) -> Dict[int, DeviceState]:
+        """Load and cache the states of `device_ids`: one query for devices, one for capabilities."""
+        if not device_ids:
+            return {}
+        # device_statuses may hold several rows per device: only the latest one counts
+        latest_status = (
+            select(
+                device_models.DeviceStatus.device_id,
+                device_models.DeviceStatus.is_online,
+                device_models.DeviceStatus.battery_level,
+                device_models.DeviceStatus.last_seen,
+                func.row_number().over(
+                    partition_by=device_models.DeviceStatus.device_id,
+                    order_by=device_models.DeviceStatus.id.desc(),
+                ).label("position"),
+            )
+            .where(device_models.DeviceStatus.device_id.in_(device_ids))
+            .subquery()
+        )
+        rows = db.execute(
+            select(
+                device_models.Device.id,
+                device_models.Device.user_id,
+                device_models.Device.status,
+                latest_status.c.is_online,
+                latest_status.c.battery_level,
+                latest_status.c.last_seen,
+            )
+            .outerjoin(
+                latest_status,
+                and_(latest_status.c.device_id == device_models.Device.id, latest_status.c.position == 1),
+            )
+            .where(device_models.Device.id.in_(device_ids))
+        ).all()
+
+        now = time.monotonic()
+        loaded = {
+            row.id: DeviceState(
+                user_id=row.user_id,
+                status=row.status,
+                is_online=bool(row.is_online),
+                battery_level=row.battery_level,
+                last_seen=row.last_seen,
+                cached_at=now,
+            )
+            for row in rows
+        }
+        if not loaded:
+            return loaded
+        for row in db.execute(
+            select(
+                device_models.DeviceCapabilityState.device_id,
+                device_models.DeviceCapabilityState.type,
+                device_models.DeviceCapabilityState.instance,
+                device_models.DeviceCapabilityState.reported,
+            ).where(
+                device_models.DeviceCapabilityState.device_id.in_(list(loaded)),
+                device_models.DeviceCapabilityState.type != ON_OFF,
+                device_models.DeviceCapabilityState.reported.isnot(None),
+            )
+        ):
+            loaded[row.device_id].capabilities[(row.type, row.instance)] = row.reported
+
+        with self._lock:
+            self._states.update(loaded)
+        return loaded
+
+    def get_or_load(self, db: Session, device_ids: Iterable[int]) -> Dict[int, DeviceState]:
+        found, missing = self.get_many(device_ids)
+        if missing:
+            found.update(self.load(db, missing))
+        return found
+
+    def update_capabilities(self, device_id: int, changes: List[Tuple[str, str, Any]]) -> None:
+        """Write through capability values reported by the device."""
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is not None:
+                for capability_type, instance, value in changes:
+                    if capability_type == ON_OFF:
+                        state.status = "on" if value else "off"
+                    else:
+                        state.capabilities[(capability_type, instance)] = value
+
+    def update_presence(self, device_id: int, is_online: bool, battery_level: Optional[int], last_seen: datetime) -> None:
+        """Write through an `info` message received over MQTT."""
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is not None:
+                state.is_online = is_online
+                state.battery_level = battery_level
+                state.last_seen = last_seen
+
+    def invalidate(self, device_id: int) -> None:
+        with self._lock:
+            self._states.pop(device_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._states.clear()
+
+
+device_state_cache = DeviceStateCache()
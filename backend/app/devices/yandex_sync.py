@@ -0,0 +1,168 @@
+"""
+Incremental sync of devices from users' Yandex IoT accounts.
+
+Synced devices are identified by external_id (the Yandex device id) and
+have no serial number. Each keeps content_hash, a hash of the fields taken
+from Yandex (name, room, type), so a sync compares the fetched devices with
+what is stored and only writes the difference: new devices are inserted,
+changed ones updated and devices gone from the account deleted, together
+with their statuses, commands and events (ON DELETE CASCADE), each as one
+bulk statement, all in a single transaction together with the discovery
+snapshot. Nothing is written when nothing changed.
+
+YandexDeviceSync also runs in the background, syncing every linked user
+every YANDEX_SYNC_INTERVAL_SECONDS, at most YANDEX_SYNC_CONCURRENCY users
+at a time.
+"""
+import asyncio
+import hashlib
+import logging
+from typing import Any, Dict, List, Optional
+
+import orjson
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from ..auth.models import User
+from ..auth.service import auth_service
+from ..config import settings
+from ..database.core import SessionFactory
+from .models import Device
+from .service import device_service
+from .state_cache import device_state_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_NAME = "Unnamed Yandex Device"
+DEFAULT_TYPE = "devices.types.other"
+
+
+def device_fields(device: Dict[str, Any], rooms: Dict[str, str]) -> Dict[str, Any]:
+    """Device columns for a device of the Yandex IoT user info, truncated to fit."""
+    room = rooms.get(device.get("room")) or device.get("room")
+    return {
+        "name": (device.get("name") or DEFAULT_NAME)[:100],
+        "room": room[:100] if room else None,
+        "type": (device.get("type") or DEFAULT_TYPE)[:50],
+    }
+
+
+def content_hash(fields: Dict[str, Any]) -> str:
+    return hashlib.sha256(orjson.dumps(fields, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class YandexDeviceSync:
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    async def sync_user(self, db: Session, user: User) -> dict:
+        """Fetch the user's Yandex IoT devices and apply the changes; returns the diff summary."""
+        iot_user_info = await auth_service._fetch_yandex_iot_user_info(db, user)
+        return await asyncio.to_thread(self.apply, db, user.id, iot_user_info)
+
+    def apply(self, db: Session, user_id: int, iot_user_info: Dict[str, Any]) -> dict:
+        """Bring the user's synced devices in line with `iot_user_info` in one transaction."""
+        rooms = {room["id"]: room.get("name") for room in iot_user_info.get("rooms", []) if room.get("id")}
+        remote: Dict[str, Dict[str, Any]] = {}
+        for device in iot_user_info.get("devices", []):
+            if device.get("id"):
+                fields = device_fields(device, rooms)
+                remote[str(device["id"])[:100]] = {**fields, "content_hash": content_hash(fields)}
+
+        local = {
+            row.external_id: row
+            for row in db.execute(
+                select(Device.id, Device.external_id, Device.content_hash)
+                .where(Device.user_id == user_id, Device.external_id.is_not(None))
+            )
+        }
+
+        inserts = [
+            {"user_id": user_id, "external_id": external_id, "status": "off", **values}
+            for external_id, values in remote.items() if external_id not in local
+        ]
+        updates = [
+            {"id": local[external_id].id, **values}
+            for external_id, values in remote.items()
+            if external_id in local and local[external_id].content_hash != values["content_hash"]
+        ]
+        deleted = [row.id for external_id, row in local.items() if external_id not in remote]
+
+        created: List[int] = []
+        if inserts:
+            created = list(db.execute(insert(Device).returning(Device.id), inserts).scalars())
+        if updates:
+            db.execute(update(Device), updates)
+        if deleted:
+            db.execute(delete(Device).where(Device.id.in_(deleted)))
+        if inserts or updates or deleted:
+            device_service.build_discovery_snapshot(db, user_id)
+            db.commit()
+            for device_id in [values["id"] for values in updates] + deleted:
+                device_state_cache.invalidate(device_id)
+            logger.info(
+                f"Synced Yandex devices of user {user_id}: {len(created)} created, "
+                f"{len(updates)} updated, {len(deleted)} deleted."
+            )
+
+        return {
+            "created": created,
+            "updated": [values["id"] for values in updates],
+            "deleted": deleted,
+            "unchanged": len(local) - len(updates) - len(deleted),
+        }
+
+    # --- Background sync ---
+
+    def start(self) -> None:
+        """Start syncing linked users periodically; called from app.main.lifespan."""
+        if not settings.YANDEX_SYNC_ENABLED:
+            logger.info("Periodic Yandex device sync disabled.")
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.YANDEX_SYNC_INTERVAL_SECONDS)
+            try:
+                await self.sync_all()
+            except Exception as e:
+                logger.error(f"Periodic Yandex device sync failed: {e}")
+
+    async def sync_all(self) -> int:
+        """Sync every user with a linked Yandex account; returns how many synced successfully."""
+        with SessionFactory() as db:
+            user_ids = db.execute(
+                select(User.id).where(User.yandex_oauth_refresh_token.is_not(None)).order_by(User.id)
+            ).scalars().all()
+
+        semaphore = asyncio.Semaphore(settings.YANDEX_SYNC_CONCURRENCY)
+
+        async def sync_one(user_id: int) -> bool:
+            async with semaphore:
+                with SessionFactory() as db:
+                    user = db.get(User, user_id)
+                    if user is None or not user.yandex_oauth_access_token:
+                        return False
+                    try:
+                        await self.sync_user(db, user)
+                        return True
+                    except HTTPException as e:
+                        db.rollback()
+                        logger.warning(f"Yandex device sync failed for user {user_id}: {e.detail}")
+                    except Exception as e:
+                        db.rollback()
+                        logger.error(f"Yandex device sync failed for user {user_id}: {e}")
+                    return False
+
+        results = await asyncio.gather(*(sync_one(user_id) for user_id in user_ids))
+        return sum(results)
+
+
+yandex_device_sync = YandexDeviceSync()
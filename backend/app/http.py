@@ -0,0 +1,125 @@
+"""
+Shared async HTTP client for outgoing calls (Yandex OAuth, IoT and Dialogs APIs).
+
+A single httpx.AsyncClient lives for the lifetime of the app (opened and
+closed in app.main.lifespan), so connections and TLS sessions are pooled
+and kept alive between calls instead of being set up for every request.
+HTTP/2 is used when the h2 package is installed (httpx[http2]).
+
+HttpClient.request retries transient failures with exponential backoff and
+full jitter, honouring Retry-After:
+
+- connection failures, where the request never reached the server, always;
+- 429/5xx responses and other transport errors only for idempotent methods,
+  or when the caller passes retry=True.
+
+Tests replace the network with set_transport(httpx.MockTransport(handler)),
+or a transport pointed at a local stand-in server, before the client opens.
+"""
+import asyncio
+import logging
+import random
+from typing import Optional
+
+import httpx
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+# Raised before anything was sent, so any request can be retried
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+MAX_RETRY_AFTER_SECONDS = 30.0
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class HttpClient:
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncBaseTransport] = None
+
+    def set_transport(self, transport: Optional[httpx.AsyncBaseTransport]) -> None:
+        """Send requests through `transport` instead of the network; takes effect when the client is (re)opened."""
+        self._transport = transport
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Opened on first use outside the app's lifespan too (scripts, tests)
+        if self._client is None or self._client.is_closed:
+            http2 = settings.HTTP_CLIENT_HTTP2 and http2_available()
+            if settings.HTTP_CLIENT_HTTP2 and not http2:
+                logger.warning("HTTP/2 disabled: the h2 package is not installed.")
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                timeout=httpx.Timeout(settings.HTTP_CLIENT_TIMEOUT_SECONDS, connect=settings.HTTP_CLIENT_CONNECT_TIMEOUT_SECONDS),
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_CLIENT_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.HTTP_CLIENT_MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=settings.HTTP_CLIENT_KEEPALIVE_EXPIRY_SECONDS,
+                ),
+                transport=self._transport,
+            )
+        return self._client
+
+    async def start(self) -> None:
+        """Open the connection pool; called from app.main.lifespan."""
+        self.client
+
+    async def stop(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def request(
+        self,
+        method: str,
+        url: str,
+        *,
+        retry: Optional[bool] = None,
+        max_retries: Optional[int] = None,
+        retry_base_seconds: Optional[float] = None,
+        **kwargs,
+    ) -> httpx.Response:
+        """
+        Send a request, retrying transient failures.
+
+        Returns the last response, whatever its status; raises the last
+        httpx.TransportError when no response was received.
+        """
+        method = method.upper()
+        retry = method in IDEMPOTENT_METHODS if retry is None else retry
+        max_retries = settings.HTTP_CLIENT_MAX_RETRIES if max_retries is None else max_retries
+        retry_base_seconds = settings.HTTP_CLIENT_RETRY_BASE_SECONDS if retry_base_seconds is None else retry_base_seconds
+
+        for attempt in range(max_retries + 1):
+            # Full jitter, so retries of many callers don't hit the server at the same moment
+            delay = random.uniform(0, retry_base_seconds * 2 ** attempt)
+            try:
+                response = await self.client.request(method, url, **kwargs)
+                if not retry or response.status_code not in RETRYABLE_STATUS_CODES or attempt == max_retries:
+                    return response
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isascii() and retry_after.isdigit():  # Seconds; HTTP dates fall back to backoff
+                    delay = min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+                logger.warning(f"{method} {url} failed with {response.status_code} (attempt {attempt + 1}), retrying.")
+            except NOT_SENT_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                logger.warning(f"{method} {url} failed: {e!r} (attempt {attempt + 1}), retrying.")
+            except httpx.TransportError as e:
+                if not retry or attempt == max_retries:
+                    raise
+                logger.warning(f"{method} {url} failed: {e!r} (attempt {attempt + 1}), retrying.")
+            await asyncio.sleep(delay)
+
+
+http_client = HttpClient()
@@ -1,14 +1,29 @@
 # app/main.py
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
 from app.config import settings
 from app.auth.router import router as auth_router
 from app.devices.router import router as devices_router
+from app.automation.router import router as automation_router
 from app.mqtt import mqtt_client
+from app.database.core import engine
+from app.database.instrumentation import QueryStatsMiddleware
+from app.database.replicas import ReadYourWritesMiddleware, replica_router
+from app.ratelimit.middleware import LoadSheddingMiddleware
+from app.database.partitions import history_maintenance_loop
+from app.devices.realtime import device_event_hub
+from app.devices.notifications import state_notifier
+from app.devices.scheduler import command_scheduler
+from app.devices.yandex_sync import yandex_device_sync
+from app.auth.hashing import PasswordHasherBusy, password_hasher
+from app.auth.yandex_tokens import yandex_token_refresher
+from app.http import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -21,11 +36,27 @@ else:
 async def lifespan(app: FastAPI):
     # Startup
     logger.info("Starting up application...")
+    device_event_hub.bind_loop(asyncio.get_running_loop())
+    await http_client.start()
     mqtt_client.connect()
+    history_maintenance_task = asyncio.create_task(history_maintenance_loop(engine))
+    state_notifier.start()
+    yandex_token_refresher.start()
+    yandex_device_sync.start()
+    command_scheduler.start()
+    replica_router.start()
     yield
     # Shutdown
     logger.info("Shutting down application...")
+    history_maintenance_task.cancel()
+    await command_scheduler.stop()
+    await yandex_token_refresher.stop()
+    await yandex_device_sync.stop()
+    await state_notifier.stop()
+    await http_client.stop()
+    await replica_router.stop()
     mqtt_client.disconnect()
+    password_hasher.shutdown()
 
 # Create FastAPI app instance
 app = FastAPI(
@@ -39,6 +70,10 @@ app = FastAPI(
 )
 
 # --- Middleware ---
+# Rejects low priority requests first when too many are in flight. Added before
+# (so runs inside) CORS: browsers can only read the 429 with CORS headers on it
+app.add_middleware(LoadSheddingMiddleware)
+
 # Set up CORS (Cross-Origin Resource Sharing)
 origins = [
     "*"
@@ -51,13 +86,32 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"], # Allows all methods
     allow_headers=["*"], # Allows all headers
+    expose_headers=["Retry-After"], # Sent with 429 and 503 responses
 )
 
+# Reads go to the primary for a while after a client's writes, see app/database/replicas.py
+if settings.DATABASE_READ_REPLICA_URLS:
+    app.add_middleware(ReadYourWritesMiddleware)
+
+# Per-request SQL statement count and time headers in debug mode
+if settings.ENVIRONMENT == "local" or settings.SQL_DEBUG_HEADERS:
+    app.add_middleware(QueryStatsMiddleware)
+
+# --- Exception handlers ---
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many password checks in progress, retry later"},
+        headers={"Retry-After": str(settings.PASSWORD_HASH_RETRY_AFTER_SECONDS)},
+    )
+
 # --- Routers ---
 # Include modular routers
 api_router_v1 = APIRouter() # Create a router for versioning
 api_router_v1.include_router(auth_router)
 api_router_v1.include_router(devices_router)
+api_router_v1.include_router(automation_router)
 
 app.include_router(api_router_v1, prefix=settings.API_V1_STR)
 
@@ -4,7 +4,11 @@ import logging
 import time
 import json
 from .database.core import SessionFactory
-from .devices.models import DeviceStatus, DeviceCommand, DeviceEvent
+from .devices.models import COMMAND_SUCCESS_STATUSES, DeviceStatus, DeviceCommand, DeviceEvent
+from .devices.realtime import device_event_hub, event_message
+from .devices.state_cache import device_state_cache
+from .devices.notifications import state_notifier
+from .automation.service import rule_engine
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -16,6 +20,8 @@ class MQTTClient:
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         self.client.username_pw_set(settings.MQTT_USERNAME, settings.MQTT_PASSWORD)
+        # QoS 1 messages past this many unacknowledged ones wait in the client queue
+        self.client.max_inflight_messages_set(settings.MQTT_MAX_INFLIGHT_MESSAGES)
         self.connected = False
 
     def connect(self):
@@ -54,34 +60,84 @@ class MQTTClient:
                 logger.warning(f"Invalid topic format: {msg.topic}")
                 return
 
-            user_id, device_id, sub_topic = topic_parts[0], topic_parts[1], topic_parts[2]
+            user_id, device_id, sub_topic = int(topic_parts[0]), int(topic_parts[1]), topic_parts[2]
             payload = json.loads(msg.payload.decode())
 
+            update = None
             with SessionFactory() as db_session:
+                if not self.owns_device(db_session, user_id, device_id):
+                    logger.warning(f"Dropped message on topic {msg.topic}: device {device_id} doesn't belong to user {user_id}")
+                    return
+
                 if sub_topic == "info":
-                    self.handle_info(db_session, int(device_id), payload)
+                    update = self.handle_info(db_session, device_id, payload, user_id)
                 elif sub_topic == "warning":
-                    self.handle_warning(db_session, int(device_id), payload)
+                    update = self.handle_warning(db_session, device_id, payload)
                 elif sub_topic == "error":
-                    self.handle_error(db_session, int(device_id), payload)
+                    update = self.handle_error(db_session, device_id, payload)
                 elif sub_topic == "command" and len(topic_parts) > 3 and topic_parts[3] == "response":
-                    self.handle_command_response(db_session, int(device_id), payload)
+                    update = self.handle_command_response(db_session, device_id, payload, user_id)
+
+                if update is not None:
+                    # Push the committed change to the user's live connections
+                    device_event_hub.publish(user_id, update)
+                    state_notifier.notify_update(user_id, update)
+                    # Then run the user's automation rules on it
+                    rule_engine.process(db_session, user_id, device_id, sub_topic, payload)
 
         except json.JSONDecodeError:
             logger.error(f"Failed to decode JSON payload: {msg.payload.decode()}")
         except Exception as e:
             logger.error(f"Error processing message on topic {msg.topic}: {e}")
 
-    def handle_info(self, db, device_id: int, payload: dict):
-        status = db.query(DeviceStatus).filter(DeviceStatus.device_id == device_id).first()
+    @staticmethod
+    def owns_device(db, user_id: int, device_id: int) -> bool:
+        """
+        Whether the device of a topic belongs to the topic's user.
+
+        Topics are chosen by the publishing device, so a device could otherwise
+        write into another user's devices, live updates and automations. The
+        owner comes from the device state cache, loaded once per device.
+        """
+        state = device_state_cache.get_or_load(db, [device_id]).get(device_id)
+        return state is not None and state.user_id == user_id
+
+    def handle_info(self, db, device_id: int, payload: dict, user_id: int):
+        # Imported here: the command service publishes through mqtt_client
+        from .devices.commands import device_command_service
+
+        # The latest row if the device has several, as read by device_state_cache
+        status = db.query(DeviceStatus).filter(DeviceStatus.device_id == device_id).order_by(DeviceStatus.id.desc()).first()
         if not status:
             status = DeviceStatus(device_id=device_id)
             db.add(status)
         
+        was_online = bool(status.is_online)
         status.is_online = payload.get("status") == "online"
         status.battery_level = payload.get("battery_level")
         status.last_seen = datetime.utcnow()
         db.commit()
+        device_state_cache.update_presence(device_id, status.is_online, status.battery_level, status.last_seen)
+
+        # Optional state report: {"capabilities": [{"type": ..., "state": {"instance": ..., "value": ...}}]}
+        reported = [
+            (capability.get("type"), capability.get("state", {}).get("instance"), capability.get("state", {}).get("value"))
+            for capability in payload.get("capabilities", [])
+        ]
+        if reported:
+            device_command_service.record_reported(db, user_id, device_id, reported)
+        if status.is_online:
+            sent = device_command_service.drain_queue(db, user_id, device_id)
+            if not was_online:
+                device_command_service.reconcile(db, user_id, device_id, skip=sent)
+
+        return {
+            "type": "status",
+            "device_id": device_id,
+            "is_online": status.is_online,
+            "battery_level": status.battery_level,
+            "last_seen": status.last_seen.isoformat(),
+        }
 
     def handle_warning(self, db, device_id, payload):
         event = DeviceEvent(
@@ -91,6 +147,7 @@ class MQTTClient:
         )
         db.add(event)
         db.commit()
+        return event_message(event)
 
     def handle_error(self, db, device_id, payload):
         event = DeviceEvent(
@@ -100,14 +157,34 @@ class MQTTClient:
         )
         db.add(event)
         db.commit()
+        return event_message(event)
+
+    def handle_command_response(self, db, device_id, payload, user_id: int):
+        from .devices.commands import device_command_service
 
-    def handle_command_response(self, db, device_id, payload):
         command_id = payload.get("command_id")
-        command = db.query(DeviceCommand).filter(DeviceCommand.id == command_id).first()
+        # Only the device a command was sent to can complete it
+        command = db.query(DeviceCommand).filter(
+            DeviceCommand.id == command_id, DeviceCommand.device_id == device_id
+        ).first()
         if command:
             command.status = payload.get("status")
             command.completed_at = datetime.utcnow()
             db.commit()
+            if command.status in COMMAND_SUCCESS_STATUSES and command.capability:
+                device_command_service.record_reported(db, user_id, device_id, [(command.capability, command.instance, command.value)])
+            return {
+                "type": "command",
+                "device_id": device_id,
+                "command_id": command.id,
+                "command_type": command.command_type,
+                "capability": command.capability,
+                "instance": command.instance,
+                "value": command.value,
+                "status": command.status,
+                "completed_at": command.completed_at.isoformat(),
+            }
+        return None
 
     def publish(self, topic, payload, qos=1):
         try:
@@ -116,6 +193,23 @@ class MQTTClient:
         except Exception as e:
             logger.error(f"Failed to publish message to topic {topic}: {e}")
 
+    def publish_many(self, messages, qos=1):
+        """
+        Publish a batch of (topic, payload) messages.
+
+        paho only queues each message for the network thread, which sends
+        them without waiting for the acknowledgements of earlier ones.
+        """
+        failed = 0
+        for topic, payload in messages:
+            try:
+                self.client.publish(topic, payload, qos)
+            except Exception as e:
+                failed += 1
+                logger.error(f"Failed to publish message to topic {topic}: {e}")
+        if messages:
+            logger.info(f"Published {len(messages) - failed} of {len(messages)} messages.")
+
     def disconnect(self):
         self.client.loop_stop()
         self.client.disconnect()
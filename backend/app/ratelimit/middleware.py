@@ -0,0 +1,91 @@
+"""
+Priority-aware concurrency limit (load shedding).
+
+Requests are sorted into three priorities. Each priority may only start
+while the number of requests in flight is below its share of
+LOAD_SHEDDING_MAX_CONCURRENCY, so under overload admin listings are
+rejected first, then regular API traffic, and the Yandex Smart Home
+platform endpoints keep the remaining capacity. Rejected requests get 429
+with Retry-After.
+"""
+from typing import Dict
+
+from ..config import settings
+
+CRITICAL, NORMAL, LOW = "critical", "normal", "low"
+
+# Paths relative to API_V1_STR
+# Called by the Yandex Smart Home platform (and account linking)
+CRITICAL_PREFIXES = ("/user/", "/auth/authorize", "/auth/token")
+# Admin listings and bulk tools, fine to retry later
+LOW_PRIORITY_ROUTES = (
+    ("GET", "/devices/"),
+    ("GET", "/serial-numbers/"),
+    ("GET", "/auth/users"),
+    ("POST", "/serial-numbers/import"),
+)
+# Long-lived streams would hold a slot for their whole lifetime
+EXCLUDED_PATHS = ("/user/devices/stream",)
+
+
+def request_priority(method: str, path: str) -> str:
+    if path.startswith(CRITICAL_PREFIXES):
+        return CRITICAL
+    if (method, path) in LOW_PRIORITY_ROUTES:
+        return LOW
+    return NORMAL
+
+
+class LoadSheddingMiddleware:
+    """ASGI middleware rejecting requests by priority when too many are in flight."""
+
+    def __init__(self, app):
+        self.app = app
+        self.in_flight = 0
+        self.shed: Dict[str, int] = {CRITICAL: 0, NORMAL: 0, LOW: 0}
+
+    def limit(self, priority: str) -> int:
+        share = {
+            CRITICAL: 1.0,
+            NORMAL: settings.LOAD_SHEDDING_NORMAL_SHARE,
+            LOW: settings.LOAD_SHEDDING_LOW_SHARE,
+        }[priority]
+        return int(settings.LOAD_SHEDDING_MAX_CONCURRENCY * share)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        if path.startswith(settings.API_V1_STR):
+            path = path[len(settings.API_V1_STR):]
+        if path in EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        priority = request_priority(scope["method"], path)
+        if self.in_flight >= self.limit(priority):
+            self.shed[priority] += 1
+            await self._reject(send)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    async def _reject(send) -> None:
+        body = b'{"detail":"Server is overloaded, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.LOAD_SHEDDING_RETRY_AFTER_SECONDS).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
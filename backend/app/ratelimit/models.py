@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Float, String
+
+from ..models import Base
+
+
+# Token buckets shared by all workers when RATE_LIMIT_BACKEND is "database",
+# see app/ratelimit/service.py. UNLOGGED on PostgreSQL: losing them on a crash is harmless.
+class RateLimitBucket(Base):
+    __tablename__ = "rate_limit_buckets"
+
+    key = Column(String(100), primary_key=True)  # e.g. "user:42", "device:7"
+    tokens = Column(Float, nullable=False)
+    updated_at = Column(Float, nullable=False)  # Unix time of the last refill
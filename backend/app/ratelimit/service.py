@@ -0,0 +1,120 @@
+"""
+Token-bucket rate limiting.
+
+A bucket holds up to `capacity` tokens and refills at `rate` tokens per
+second; every request takes one token and is rejected with 429 and a
+Retry-After header when the bucket is empty.
+
+Buckets live in process memory by default. With RATE_LIMIT_BACKEND set to
+"database" they are kept in the rate_limit_buckets table instead, so every
+worker enforces the same limits; each check is a single atomic upsert.
+"""
+import math
+import threading
+import time
+from typing import Dict, Optional, Protocol, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from ..config import settings
+
+
+class TokenBucketBackend(Protocol):
+    def consume(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        """Take `cost` tokens from bucket `key`; return 0 on success, else seconds until enough tokens."""
+        ...
+
+
+class InMemoryTokenBucketBackend:
+    """Per-process buckets; limits are multiplied by the number of workers."""
+
+    # Refilled buckets are dropped past this many keys so the map doesn't grow without bound
+    MAX_BUCKETS = 100_000
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}  # key -> (tokens, updated_at, full_at)
+        self._lock = threading.Lock()
+
+    def consume(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+            if len(self._buckets) > self.MAX_BUCKETS:
+                # A bucket that has refilled behaves exactly like a missing one
+                self._buckets = {k: bucket for k, bucket in self._buckets.items() if bucket[2] > now}
+        return 0.0 if allowed else (cost - tokens) / rate
+
+
+class DatabaseTokenBucketBackend:
+    """Buckets in the rate_limit_buckets table, shared by all workers."""
+
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        least = "LEAST" if engine.dialect.name == "postgresql" else "MIN"
+        refilled = f"{least}(:capacity, rate_limit_buckets.tokens + (:now - rate_limit_buckets.updated_at) * :rate)"
+        # Only updates (and returns a row) when the refilled bucket holds enough tokens
+        self._consume = text(
+            "INSERT INTO rate_limit_buckets (key, tokens, updated_at) VALUES (:key, :capacity - :cost, :now) "
+            f"ON CONFLICT (key) DO UPDATE SET tokens = {refilled} - :cost, updated_at = :now "
+            f"WHERE {refilled} >= :cost "
+            "RETURNING tokens"
+        )
+        self._read = text("SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = :key")
+
+    def consume(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> float:
+        params = {"key": key, "rate": rate, "capacity": capacity, "cost": cost, "now": time.time()}
+        with self.engine.begin() as connection:
+            if connection.execute(self._consume, params).first() is not None:
+                return 0.0
+            row = connection.execute(self._read, {"key": key}).first()
+        tokens = min(capacity, row.tokens + (params["now"] - row.updated_at) * rate)
+        # Never 0: another worker may have taken the tokens since the upsert
+        return max(cost - tokens, 0.01) / rate
+
+
+class RateLimiter:
+    def __init__(self, backend: Optional[TokenBucketBackend] = None):
+        self._backend = backend
+
+    @property
+    def backend(self) -> TokenBucketBackend:
+        if self._backend is None:
+            if settings.RATE_LIMIT_BACKEND == "database":
+                from ..database.core import engine
+                self._backend = DatabaseTokenBucketBackend(engine)
+            else:
+                self._backend = InMemoryTokenBucketBackend()
+        return self._backend
+
+    def retry_after(self, key: str, rate: float, capacity: float) -> float:
+        """Take a token from bucket `key`; return 0 when allowed, else the seconds to wait."""
+        if not settings.RATE_LIMIT_ENABLED:
+            return 0.0
+        return self.backend.consume(key, rate, capacity)
+
+    def check(self, key: str, rate: float, capacity: float) -> None:
+        """Take a token from bucket `key` or raise 429 with Retry-After."""
+        wait = self.retry_after(key, rate, capacity)
+        if wait > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    def check_user(self, user_id: int) -> None:
+        self.check(f"user:{user_id}", settings.RATE_LIMIT_USER_RATE, settings.RATE_LIMIT_USER_BURST)
+
+    def device_allowed(self, user_id: int, device_id: int) -> bool:
+        # Keyed by the caller too, so requests for someone else's device ids can't drain its bucket
+        return self.retry_after(f"device:{user_id}:{device_id}", settings.RATE_LIMIT_DEVICE_RATE, settings.RATE_LIMIT_DEVICE_BURST) == 0
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: CPU per listed device for the device list endpoints.
+
+Compares the previous path (ORM objects -> DeviceRead.model_validate ->
+response model -> JSON) with the column-projected fast path (row tuples ->
+dicts -> orjson) used by DeviceService.list_devices. Runs against an
+in-memory SQLite database, so timings include query execution.
+
+    cd backend && python -m benchmarks.device_list_serialization
+"""
+import time
+
+import orjson
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import selectinload, sessionmaker
+
+from app.auth.models import User
+from app.devices import models as device_models
+from app.devices import schemas as device_schemas
+from app.devices.service import device_service
+from app.models import Base
+
+DEVICES = 500
+ROUNDS = 50
+
+
+def populate(session):
+    user = User(email="bench@example.com", name="bench", password_hash="x")
+    session.add(user)
+    session.flush()
+    for i in range(DEVICES):
+        sn = device_models.SerialNumber(value=f"SN{i:013d}", is_free=False, user_id=user.id)
+        session.add(sn)
+        session.flush()
+        session.add(device_models.Device(name=f"Curtain {i}", serial_number_id=sn.id, user_id=user.id, room="main"))
+    session.commit()
+    return user.id
+
+
+def orm_path(session, user_id):
+    devices = session.execute(
+        select(device_models.Device)
+        .where(device_models.Device.user_id == user_id)
+        .options(selectinload(device_models.Device.owner), selectinload(device_models.Device.serial_number_obj))
+    ).scalars().all()
+    response = device_schemas.DeviceListResponse(
+        devices=[device_schemas.DeviceRead.model_validate(d, from_attributes=True) for d in devices],
+        total=len(devices),
+    )
+    # FastAPI validates the returned model against response_model once more
+    return device_schemas.DeviceListResponse.model_validate(response.model_dump()).model_dump_json()
+
+
+def fast_path(session, user_id):
+    return orjson.dumps(device_service.list_devices(
+        session, limit=DEVICES, filters=device_schemas.DeviceFilter(user_id=user_id)
+    ))
+
+
+def measure(fn, session, user_id):
+    fn(session, user_id)  # warm up
+    started = time.process_time()
+    for _ in range(ROUNDS):
+        session.expunge_all()
+        fn(session, user_id)
+    return (time.process_time() - started) / (ROUNDS * DEVICES) * 1e6
+
+
+def main():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    user_id = populate(session)
+
+    assert orjson.loads(orm_path(session, user_id)) == orjson.loads(fast_path(session, user_id))
+
+    orm_us = measure(orm_path, session, user_id)
+    fast_us = measure(fast_path, session, user_id)
+    print(f"ORM + model_validate: {orm_us:7.1f} us CPU per device")
+    print(f"projected + orjson:   {fast_us:7.1f} us CPU per device")
+    print(f"speed-up:             {orm_us / fast_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
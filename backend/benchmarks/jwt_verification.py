@@ -0,0 +1,70 @@
+"""
+Micro-benchmark: CPU per call of the get_current_user auth dependency.
+
+Compares the previous token check (jwt.decode with the key built from the
+secret on every call, then parsing exp again) with TokenVerifier, which
+verifies a token once and then serves its claims from the cache. The user
+is served from the principal cache in both cases, against an in-memory
+SQLite database, so the difference is the token check.
+
+    cd backend && python -m benchmarks.jwt_verification
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from jose import jwt
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import dependencies
+from app.auth.models import User
+from app.auth.security import ALGORITHM, create_access_token
+from app.auth.tokens import DEFAULT_SECRET_KEY, token_verifier
+from app.devices import models as device_models  # noqa: F401  (User.devices)
+from app.models import Base
+
+ROUNDS = 20000
+
+
+def previous_decode_token(token):
+    payload = jwt.decode(token, DEFAULT_SECRET_KEY, algorithms=[ALGORITHM])
+    if datetime.fromtimestamp(payload["exp"], tz=timezone.utc) < datetime.now(timezone.utc):
+        return None
+    return payload
+
+
+def measure(session, token):
+    async def run():
+        await dependencies.get_current_user(token=token, db=session)  # warm up
+        started = time.process_time()
+        for _ in range(ROUNDS):
+            await dependencies.get_current_user(token=token, db=session)
+        return (time.process_time() - started) / ROUNDS * 1e6
+    return asyncio.run(run())
+
+
+def main():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    user = User(email="bench@example.com", name="bench", password_hash="x")
+    session.add(user)
+    session.commit()
+    token = create_access_token(user.id)
+
+    cached_decode = dependencies.decode_token
+    dependencies.decode_token = previous_decode_token
+    try:
+        previous_us = measure(session, token)
+    finally:
+        dependencies.decode_token = cached_decode
+    cached_us = measure(session, token)
+
+    print(f"jwt.decode per request: {previous_us:7.1f} us CPU per call")
+    print(f"verified-token cache:   {cached_us:7.1f} us CPU per call ({token_verifier.hits} hits, {token_verifier.misses} misses)")
+    print(f"speed-up:               {previous_us / cached_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
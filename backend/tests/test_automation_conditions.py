@@ -0,0 +1,50 @@
+import pytest
+
+from app.automation.conditions import compile_condition, evaluate_condition
+from app.automation.service import CompiledRule, rule_engine
+
+
+def matches(expression: str, **fields) -> bool:
+    return evaluate_condition(compile_condition(expression), fields)
+
+
+def test_conditions():
+    assert matches("battery_level < 15", battery_level=10)
+    assert matches("battery_level * 2 > 15", battery_level=10)
+    assert matches("message in ['motor_stuck', 'jammed']", message="jammed")
+    assert matches("status == 'offline' or (battery_level is not None and battery_level < 5)", status="offline")
+    assert not matches("battery_level < 15")  # Missing fields are None
+    assert not matches("battery_level / 0 > 1", battery_level=10)
+
+
+@pytest.mark.parametrize("expression", [
+    "[0] * 100000 * 100000 == x",
+    "'a' * 100000000 == message",
+    "(1, 2) + x",
+    "len(message) > 3",
+    "message.upper() == 'X'",
+    "_arithmetic",
+])
+def test_disallowed_conditions(expression):
+    with pytest.raises(ValueError):
+        compile_condition(expression)
+
+
+def test_arithmetic_on_message_strings_is_false():
+    assert not matches("message * 100000000 == message", message="stuck")
+    assert not matches("message + message == 'ab'", message="a")
+
+
+def test_condition_errors_are_counted(monkeypatch, db):
+    def fail(code, fields):
+        raise MemoryError()
+
+    monkeypatch.setattr("app.automation.service.evaluate_condition", fail)
+    rule = CompiledRule(
+        id=1, name="r", device_id=None, condition=compile_condition("x"), actions=[], cooldown_seconds=0
+    )
+    monkeypatch.setattr(rule_engine, "rules_for", lambda *args: [rule])
+    errors = rule_engine.errors
+
+    assert rule_engine.process(db, 1, 1, "info", {"x": 1}) == 0
+    assert rule_engine.errors == errors + 1
@@ -0,0 +1,90 @@
+from sqlalchemy import select
+
+from app.config import settings
+from app.devices import router as device_router
+from app.devices.capabilities import ON_OFF, RANGE
+from app.devices.commands import device_command_service
+from app.devices.models import Device, DeviceCapabilityState, DeviceShadow
+from app.ratelimit.service import RateLimiter
+
+ACTION = "/api/v1.0/user/devices/action"
+
+
+def states(db) -> dict:
+    db.expire_all()
+    return {
+        (row.type, row.instance): (row.desired, row.reported)
+        for row in db.execute(select(DeviceCapabilityState)).scalars()
+    }
+
+
+def test_first_action_creates_capability_states(client, db, make_user):
+    _, headers = make_user(devices=1)
+    body = {"payload": {"devices": [{"id": "1", "capabilities": [
+        {"type": ON_OFF, "state": {"instance": "on", "value": True}},
+        {"type": RANGE, "state": {"instance": "brightness", "value": 40}},
+    ]}]}}
+
+    response = client.post(ACTION, json=body, headers=headers)
+
+    assert response.status_code == 200
+    assert states(db) == {(ON_OFF, "on"): (True, False), (RANGE, "brightness"): (40, None)}
+    assert db.scalar(select(DeviceCapabilityState.id).where(DeviceCapabilityState.reported.is_(None))) is not None
+
+
+def test_capability_state_created_concurrently_is_updated(db, make_user):
+    user, _ = make_user(devices=1)
+    # Created by another action after this one loaded the (still empty) states
+    db.add(DeviceCapabilityState(device_id=1, type=RANGE, instance="brightness", desired=10))
+    db.commit()
+
+    device_command_service.apply_changes(
+        db, user.id, {1: db.get(Device, 1)}, stored={}, changes={(1, RANGE, "brightness"): 70}
+    )
+
+    assert states(db) == {(RANGE, "brightness"): (70, None)}
+
+
+def test_reported_state_created_concurrently_keeps_desired(db, make_user):
+    user, _ = make_user(devices=1)
+    db.add(DeviceCapabilityState(device_id=1, type=RANGE, instance="brightness", desired=10))
+    db.commit()
+
+    device_command_service.record_reported(db, user.id, 1, [(RANGE, "brightness", 30)])
+
+    assert states(db) == {(RANGE, "brightness"): (10, 30)}
+
+
+def test_shadow_created_concurrently_is_locked(db, make_user, monkeypatch):
+    make_user(devices=2)
+    # Created by another action after this one found no shadow for device 1
+    db.add(DeviceShadow(device_id=1, version=3))
+    db.commit()
+    select_shadows = device_command_service._select_shadows
+    calls = []
+    monkeypatch.setattr(
+        device_command_service, "_select_shadows",
+        lambda db, device_ids: calls.append(device_ids) or ({} if len(calls) == 1 else select_shadows(db, device_ids)),
+    )
+
+    shadows = device_command_service.lock_shadows(db, [1, 2])
+
+    assert {device_id: shadow.version for device_id, shadow in shadows.items()} == {1: 3, 2: 0}
+    db.commit()
+
+
+def test_device_rate_limit_is_keyed_by_the_resolved_id(client, make_user, monkeypatch):
+    _, headers = make_user(devices=1)
+    monkeypatch.setattr(device_router, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(settings, "RATE_LIMIT_DEVICE_BURST", 1.0)
+    monkeypatch.setattr(settings, "RATE_LIMIT_DEVICE_RATE", 0.001)
+
+    results = []
+    for device_id in ("1", "01", "001"):
+        body = {"payload": {"devices": [{"id": device_id, "capabilities": [
+            {"type": ON_OFF, "state": {"instance": "on", "value": True}},
+        ]}]}}
+        results.append(client.post(ACTION, json=body, headers=headers).json()["payload"]["devices"][0])
+
+    assert "action_result" not in results[0]
+    assert [result["action_result"]["error_code"] for result in results[1:]] == ["DEVICE_BUSY", "DEVICE_BUSY"]
@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import pytest
+
+from app.devices.models import DeviceStatus
+
+QUERY = "/api/v1.0/user/devices/query"
+
+
+def test_latest_status_row_counts(client, db, make_user):
+    _, headers = make_user(devices=1)
+    db.add_all([
+        DeviceStatus(device_id=1, is_online=False, last_seen=datetime.utcnow()),
+        DeviceStatus(device_id=1, is_online=True, battery_level=50, last_seen=datetime.utcnow()),
+    ])
+    db.commit()
+
+    response = client.post(QUERY, json={"devices": [{"id": "1"}]}, headers=headers)
+
+    devices = response.json()["payload"]["devices"]
+    assert len(devices) == 1
+    assert "error_code" not in devices[0]
+
+
+@pytest.mark.parametrize("device_id", ["²", "١", "-1", "1.0", "abc", ""])
+def test_non_numeric_ids_are_not_found(client, make_user, device_id):
+    _, headers = make_user(devices=1)
+
+    response = client.post(QUERY, json={"devices": [{"id": device_id}]}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["payload"]["devices"][0]["error_code"] == "DEVICE_NOT_FOUND"
+
+    body = {"payload": {"devices": [{"id": device_id, "capabilities": [
+        {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": True}},
+    ]}]}}
+    response = client.post("/api/v1.0/user/devices/action", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["payload"]["devices"][0]["action_result"]["error_code"] == "DEVICE_NOT_FOUND"
@@ -0,0 +1,23 @@
+from app.config import settings
+
+GROUP_ACTION = "/api/v1.0/devices/group-action"
+OFF = {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": False}}
+
+
+def test_group_action_covers_the_room(client, make_user):
+    _, headers = make_user(devices=3)
+
+    response = client.post(GROUP_ACTION, json={"room": "main", "capabilities": [OFF]}, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json()["total"] == 3
+    assert len(response.json()["devices"]) == 3
+
+
+def test_oversized_group_is_rejected(client, make_user, monkeypatch):
+    _, headers = make_user(devices=3)
+    monkeypatch.setattr(settings, "GROUP_ACTION_MAX_DEVICES", 2)
+
+    response = client.post(GROUP_ACTION, json={"room": "main", "capabilities": [OFF]}, headers=headers)
+
+    assert response.status_code == 400
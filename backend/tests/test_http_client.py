@@ -0,0 +1,112 @@
+import asyncio
+from typing import List, Tuple
+
+import httpx
+import pytest
+
+from app import http
+from app.http import HttpClient
+
+URL = "https://api.example.com/resource"
+
+
+@pytest.fixture
+def sleeps(monkeypatch) -> List[float]:
+    """Backoff delays requested by the client, which doesn't actually wait."""
+    delays = []
+
+    async def sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(http.asyncio, "sleep", sleep)
+    return delays
+
+
+def client_answering(*responses) -> Tuple[HttpClient, List[httpx.Request]]:
+    """A client whose transport answers with `responses` in turn; exceptions are raised."""
+    requests = []
+    answers = iter(responses)
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        answer = next(answers)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    client = HttpClient()
+    client.set_transport(httpx.MockTransport(handler))
+    return client, requests
+
+
+def send(client: HttpClient, method: str, **kwargs) -> httpx.Response:
+    async def run():
+        try:
+            return await client.request(method, URL, max_retries=2, **kwargs)
+        finally:
+            await client.stop()
+    return asyncio.run(run())
+
+
+def test_idempotent_request_is_retried(sleeps):
+    client, requests = client_answering(httpx.Response(503), httpx.Response(502), httpx.Response(200))
+
+    response = send(client, "GET")
+
+    assert response.status_code == 200
+    assert len(requests) == 3
+    assert len(sleeps) == 2
+
+
+def test_last_response_is_returned_when_retries_run_out(sleeps):
+    client, requests = client_answering(*[httpx.Response(503)] * 3)
+
+    assert send(client, "GET").status_code == 503
+    assert len(requests) == 3
+
+
+def test_retry_after_is_honoured(sleeps):
+    client, _ = client_answering(httpx.Response(429, headers={"Retry-After": "3"}), httpx.Response(200))
+
+    assert send(client, "GET").status_code == 200
+    assert sleeps == [3.0]
+
+
+@pytest.mark.parametrize("retry_after", ["²", "Wed, 21 Oct 2015 07:28:00 GMT", "-1"])
+def test_unusable_retry_after_falls_back_to_backoff(sleeps, retry_after):
+    # Header bytes are decoded as latin-1, so "²" arrives as is
+    headers = [(b"Retry-After", retry_after.encode("latin-1"))]
+    client, _ = client_answering(httpx.Response(503, headers=headers), httpx.Response(200))
+
+    assert send(client, "GET", retry_base_seconds=0.5).status_code == 200
+    assert 0 <= sleeps[0] <= 0.5
+
+
+def test_post_is_not_retried_after_a_response(sleeps):
+    client, requests = client_answering(httpx.Response(503), httpx.Response(200))
+
+    assert send(client, "POST").status_code == 503
+    assert len(requests) == 1
+    assert sleeps == []
+
+
+def test_post_is_not_retried_after_a_read_error(sleeps):
+    client, requests = client_answering(httpx.ReadError("connection reset"), httpx.Response(200))
+
+    with pytest.raises(httpx.ReadError):
+        send(client, "POST")
+    assert len(requests) == 1
+
+
+def test_post_is_retried_when_it_was_never_sent(sleeps):
+    client, requests = client_answering(httpx.ConnectError("refused"), httpx.Response(200))
+
+    assert send(client, "POST").status_code == 200
+    assert len(requests) == 2
+
+
+def test_post_is_retried_when_asked(sleeps):
+    client, requests = client_answering(httpx.Response(503), httpx.Response(200))
+
+    assert send(client, "POST", retry=True).status_code == 200
+    assert len(requests) == 2
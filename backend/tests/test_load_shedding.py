@@ -0,0 +1,12 @@
+from app.config import settings
+
+
+def test_shed_requests_carry_cors_headers(client, monkeypatch):
+    monkeypatch.setattr(settings, "LOAD_SHEDDING_MAX_CONCURRENCY", 0)
+
+    response = client.get("/api/v1.0/devices/", headers={"Origin": "https://app.example.com"})
+
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"] == "*"
+    assert "retry-after" in response.headers["access-control-expose-headers"].lower()
+    assert response.headers["retry-after"] == str(settings.LOAD_SHEDDING_RETRY_AFTER_SECONDS)
@@ -0,0 +1,66 @@
+import json
+from types import SimpleNamespace
+
+from sqlalchemy import select
+
+from app.devices.models import Device, DeviceCommand, DeviceStatus
+from app.devices.realtime import device_event_hub
+from app.mqtt import mqtt_client
+
+
+def receive(topic: str, payload: dict) -> None:
+    mqtt_client.on_message(None, None, SimpleNamespace(topic=topic, payload=json.dumps(payload).encode()))
+
+
+def test_info_updates_device_status(db, make_user):
+    user, _ = make_user(devices=1)
+
+    receive(f"{user.id}/1/info", {"status": "online", "battery_level": 80})
+
+    status = db.execute(select(DeviceStatus).where(DeviceStatus.device_id == 1)).scalar_one()
+    assert status.is_online and status.battery_level == 80
+
+
+def test_messages_for_another_users_device_are_dropped(db, make_user, monkeypatch):
+    make_user("owner@example.com", devices=1)
+    other, _ = make_user("other@example.com")
+    published = []
+    monkeypatch.setattr(device_event_hub, "publish", lambda user_id, update: published.append(user_id))
+
+    receive(f"{other.id}/1/info", {"status": "online", "battery_level": 80})
+    receive(f"{other.id}/1/warning", {"message": "injected"})
+
+    assert db.execute(select(DeviceStatus)).first() is None
+    assert published == []
+
+
+def pending_command(db, device_id: int) -> DeviceCommand:
+    return db.execute(select(DeviceCommand).where(DeviceCommand.device_id == device_id)).scalar_one()
+
+
+def test_success_response_confirms_status_change(client, db, make_user):
+    user, headers = make_user(devices=1)
+    receive(f"{user.id}/1/info", {"status": "online"})
+    client.put("/api/v1.0/devices/1", json={"status": "on"}, headers=headers)
+    command = pending_command(db, 1)
+
+    # Firmware in the field answers "success"
+    receive(f"{user.id}/1/command/response", {"command_id": command.id, "status": "success"})
+
+    db.expire_all()
+    assert command.status == "success"
+    assert db.get(Device, 1).status == "on"
+
+
+def test_response_from_another_device_is_ignored(client, db, make_user):
+    user, headers = make_user(devices=2)
+    receive(f"{user.id}/1/info", {"status": "online"})
+    client.put("/api/v1.0/devices/1", json={"status": "on"}, headers=headers)
+    command = pending_command(db, 1)
+
+    receive(f"{user.id}/2/command/response", {"command_id": command.id, "status": "success"})
+
+    db.expire_all()
+    assert command.status == "pending"
+    assert db.get(Device, 1).status == "off"
+    assert db.get(Device, 2).status == "off"
@@ -0,0 +1,39 @@
+import pytest
+
+from app.devices.notifications import state_changes_from_update
+
+
+def command_update(status: str = "success", **fields) -> dict:
+    return {"type": "command", "device_id": 1, "command_id": 1, "status": status, **fields}
+
+
+@pytest.mark.parametrize("status", ["success", "done"])
+def test_confirmed_on_off_command_is_pushed(status):
+    update = command_update(
+        status, command_type="open", capability="devices.capabilities.on_off", instance="on", value=True
+    )
+
+    capabilities, properties = state_changes_from_update(update)
+
+    assert capabilities == [{"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": True}}]
+    assert properties == []
+
+
+def test_confirmed_range_command_is_pushed_as_range():
+    update = command_update(
+        command_type="range.brightness", capability="devices.capabilities.range", instance="brightness", value=40
+    )
+
+    capabilities, _ = state_changes_from_update(update)
+
+    assert capabilities == [{"type": "devices.capabilities.range", "state": {"instance": "brightness", "value": 40}}]
+
+
+def test_command_without_capability_is_pushed_as_on_off():
+    capabilities, _ = state_changes_from_update(command_update(command_type="close", capability=None))
+
+    assert capabilities == [{"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": False}}]
+
+
+def test_failed_command_is_not_pushed():
+    assert state_changes_from_update(command_update("error", command_type="open")) is None
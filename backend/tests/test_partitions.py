@@ -0,0 +1,39 @@
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from app.database.partitions import create_month_partition, purge_expired_rows
+
+MONTH = date(2999, 1, 1)  # Far beyond the created partitions, so its rows land in the DEFAULT partition
+
+
+def count(connection, table):
+    return connection.execute(text(f"SELECT count(*) FROM {table} WHERE created_at >= '2999-01-01'")).scalar()
+
+
+def test_new_month_takes_its_rows_from_the_default_partition(postgres_engine):
+    with postgres_engine.connect() as connection:
+        transaction = connection.begin()
+        try:
+            connection.execute(text(
+                "INSERT INTO device_events (event_type, message, created_at) VALUES ('warning', 'early', '2999-01-15')"
+            ))
+            assert count(connection, "device_events_default") == 1
+
+            create_month_partition(connection, "device_events", MONTH)
+
+            assert count(connection, "device_events_default") == 0
+            assert count(connection, "device_events_p2999_01") == 1
+        finally:
+            transaction.rollback()
+
+
+def test_expired_rows_are_purged_from_the_default_partition(postgres_engine):
+    with postgres_engine.connect() as connection:
+        connection.execute(text(
+            "INSERT INTO device_events (event_type, message, created_at) VALUES ('warning', 'ancient', '2000-01-15')"
+        ))
+        connection.commit()
+
+        assert purge_expired_rows(connection, "device_events_default", datetime(2000, 2, 1), batch_size=100) >= 1
+        assert connection.execute(text("SELECT count(*) FROM device_events WHERE created_at < '2000-02-01'")).scalar() == 0
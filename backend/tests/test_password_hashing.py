@@ -0,0 +1,44 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.auth import hashing
+from app.auth.hashing import PasswordHasher, PasswordHasherBusy
+from app.config import settings
+
+
+@pytest.fixture
+def hasher(monkeypatch):
+    monkeypatch.setattr(settings, "PASSWORD_HASH_WORKERS", 1)
+    monkeypatch.setattr(settings, "PASSWORD_HASH_MAX_QUEUE", 0)
+    hasher = PasswordHasher()
+    yield hasher
+    hasher.shutdown()
+
+
+def test_hash_async_keeps_the_event_loop_running(hasher, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(hashing.pwd_context, "hash", lambda password: release.wait(5) and f"hashed:{password}")
+
+    async def run():
+        hashed = asyncio.ensure_future(hasher.hash_async("secret"))
+        await asyncio.sleep(0.01)
+        assert not hashed.done()
+        # The pool is busy: past the queue calls are rejected, blocking or not
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.hash_async("other")
+        release.set()  # Only reached because the loop wasn't blocked
+        return await hashed
+
+    assert asyncio.run(run()) == "hashed:secret"
+    assert {key: hasher.stats()[key] for key in ("pending", "completed", "rejected")} == {
+        "pending": 0, "completed": 1, "rejected": 1,
+    }
+
+
+def test_hash_and_verify(hasher):
+    hashed = asyncio.run(hasher.hash_async("secret"))
+
+    assert hasher.verify("secret", hashed)
+    assert not asyncio.run(hasher.verify_async("wrong", hashed))
@@ -0,0 +1,5 @@
+from app.database.explain import check_hot_query_plans
+
+
+def test_hot_queries_use_their_indexes(postgres_engine):
+    assert check_hot_query_plans(postgres_engine) == []
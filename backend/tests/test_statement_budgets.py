@@ -0,0 +1,60 @@
+"""
+Statement budgets of the hot endpoints: the number of SQL statements must not
+grow with the number of devices (see app/database/instrumentation.py).
+"""
+import pytest
+
+from app.database.instrumentation import assert_statement_budget
+
+ON = {"type": "devices.capabilities.on_off", "state": {"instance": "on", "value": True}}
+
+
+@pytest.mark.parametrize("devices", [1, 25])
+def test_device_list(client, make_user, devices):
+    make_user(devices=devices)
+
+    response = client.get("/api/v1.0/devices/")
+
+    assert response.status_code == 200
+    assert response.json()["total"] == devices
+    assert_statement_budget(response, 2)
+
+
+@pytest.mark.parametrize("devices", [1, 25])
+def test_user_devices(client, make_user, devices):
+    _, headers = make_user(devices=devices)
+
+    # User and snapshot lookup; the first call after create_device serves the stored snapshot
+    response = client.get("/api/v1.0/user/devices", headers=headers)
+    assert response.status_code == 200
+    assert len(response.json()["payload"]["devices"]) == devices
+    assert_statement_budget(response, 2)
+
+    # The user comes from the principal cache
+    assert_statement_budget(client.get("/api/v1.0/user/devices", headers=headers), 1)
+
+
+@pytest.mark.parametrize("devices", [1, 25])
+def test_device_action(client, make_user, devices):
+    _, headers = make_user(devices=devices)
+    body = {"payload": {"devices": [{"id": "1", "capabilities": [ON]}]}}
+
+    response = client.post("/api/v1.0/user/devices/action", json=body, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["payload"]["devices"][0]["capabilities"][0]["state"]["action_result"] == {"status": "DONE"}
+    # The device's first change also creates its shadow (insert, then select it for update)
+    assert_statement_budget(response, 11)
+
+    # Already on: answered from the stored desired state, nothing written
+    assert_statement_budget(client.post("/api/v1.0/user/devices/action", json=body, headers=headers), 2)
+
+
+def test_device_action_batch_is_loaded_at_once(client, make_user):
+    _, headers = make_user(devices=10)
+    body = {"payload": {"devices": [{"id": str(device_id), "capabilities": [ON]} for device_id in range(1, 11)]}}
+    client.post("/api/v1.0/user/devices/action", json=body, headers=headers)
+
+    # Ten devices already in the requested state: still one query for devices and one for their states
+    response = client.post("/api/v1.0/user/devices/action", json=body, headers=headers)
+    assert len(response.json()["payload"]["devices"]) == 10
+    assert_statement_budget(response, 2)
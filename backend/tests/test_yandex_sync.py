@@ -0,0 +1,82 @@
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from app.auth.models import User
+from app.devices.models import DeviceCommand, DeviceEvent, DeviceStatus
+from app.devices.yandex_sync import yandex_device_sync
+
+IOT_USER_INFO = {
+    "rooms": [{"id": "room-1", "name": "Kitchen"}],
+    "devices": [
+        {"id": "lamp-1", "name": "Lamp", "room": "room-1", "type": "devices.types.light"},
+        {"id": "plug-1", "name": "Plug", "type": "devices.types.socket"},
+    ],
+}
+
+
+@pytest.fixture
+def synced(db, make_user):
+    user, headers = make_user()
+    summary = yandex_device_sync.apply(db, user.id, IOT_USER_INFO)
+    return summary["created"], headers
+
+
+def test_sync_only_writes_changes(db, make_user):
+    user, _ = make_user()
+
+    assert len(yandex_device_sync.apply(db, user.id, IOT_USER_INFO)["created"]) == 2
+    assert yandex_device_sync.apply(db, user.id, IOT_USER_INFO) == {"created": [], "updated": [], "deleted": [], "unchanged": 2}
+
+    renamed = {**IOT_USER_INFO, "devices": [{**IOT_USER_INFO["devices"][0], "name": "Desk lamp"}]}
+    summary = yandex_device_sync.apply(db, user.id, renamed)
+    assert (len(summary["updated"]), len(summary["deleted"])) == (1, 1)
+
+
+def test_synced_devices_without_serial_number(client, synced):
+    (device_id, _), headers = synced
+    path = f"/api/v1.0/devices/{device_id}"
+
+    response = client.put(path, json={"name": "Desk lamp"}, headers=headers)
+    assert response.status_code == 200
+    assert response.json()["serial_number"] is None
+
+    assert client.put(path, json={"status": "on"}, headers=headers).status_code == 200
+    assert client.get(path, headers=headers).json()["name"] == "Desk lamp"
+    devices = client.get("/api/v1.0/user/devices", headers=headers).json()["payload"]["devices"]
+    assert devices[0]["device_info"]["serial_number"] == "Unknown"
+    assert client.delete(path, headers=headers).status_code == 204
+
+
+def delete_synced_device_with_history(db, user_id):
+    device_id = yandex_device_sync.apply(db, user_id, IOT_USER_INFO)["created"][0]
+    db.add_all([
+        DeviceCommand(device_id=device_id, command_type="on", status="done"),
+        DeviceEvent(device_id=device_id, event_type="warning", message="Low battery"),
+        DeviceStatus(device_id=device_id, is_online=True),
+    ])
+    db.commit()
+
+    assert yandex_device_sync.apply(db, user_id, {"devices": IOT_USER_INFO["devices"][1:]})["deleted"] == [device_id]
+    for model in (DeviceCommand, DeviceEvent, DeviceStatus):
+        assert db.scalar(select(func.count()).select_from(model).where(model.device_id == device_id)) == 0
+
+
+def test_sync_deletes_the_history_of_removed_devices(db, make_user):
+    user, _ = make_user()
+    db.connection().exec_driver_sql("PRAGMA foreign_keys = ON")
+
+    delete_synced_device_with_history(db, user.id)
+
+
+def test_sync_deletes_the_history_of_removed_devices_on_postgres(postgres_engine):
+    with Session(postgres_engine) as db:
+        user = User(email="sync-history@example.com", name="sync-history", password_hash="not-a-hash")
+        db.add(user)
+        db.commit()
+        try:
+            delete_synced_device_with_history(db, user.id)
+        finally:
+            db.rollback()
+            db.delete(user)
+            db.commit()
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+from app.auth.yandex_tokens import yandex_token_refresher
+from app.http import http_client
+
+
+@pytest.fixture
+def token_endpoint():
+    """Point the shared HTTP client at a stand-in token endpoint answering with the given response."""
+    def answer(response: httpx.Response) -> None:
+        http_client.set_transport(httpx.MockTransport(lambda request: response))
+
+    yield answer
+    http_client.set_transport(None)
+    asyncio.run(http_client.stop())
+
+
+@pytest.fixture
+def linked_user(db, make_user):
+    user, _ = make_user()
+    user.yandex_oauth_access_token = "old-access"
+    user.yandex_oauth_refresh_token = "refresh"
+    user.yandex_oauth_token_expires_at = datetime.utcnow() - timedelta(minutes=1)
+    db.commit()
+    return user
+
+
+def refresh(db, user) -> str:
+    async def run():
+        try:
+            return await yandex_token_refresher.refresh(db, user)
+        finally:
+            await http_client.stop()
+    return asyncio.run(run())
+
+
+def test_refresh_stores_new_tokens(db, linked_user, token_endpoint):
+    token_endpoint(httpx.Response(200, json={"access_token": "new-access", "refresh_token": "new-refresh", "expires_in": 3600}))
+
+    assert refresh(db, linked_user) == "new-access"
+    assert linked_user.yandex_oauth_refresh_token == "new-refresh"
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(400, json={"error": "invalid_grant"}),
+    httpx.Response(401, json={"error": "invalid_client"}),
+])
+def test_rejected_refresh_token_unlinks(db, linked_user, token_endpoint, response):
+    token_endpoint(response)
+
+    with pytest.raises(HTTPException) as raised:
+        refresh(db, linked_user)
+
+    assert raised.value.status_code == 401
+    db.refresh(linked_user)
+    assert linked_user.yandex_oauth_refresh_token is None
+
+
+@pytest.mark.parametrize("response", [
+    httpx.Response(429),
+    httpx.Response(500, text="Internal error"),
+    httpx.Response(503),
+    httpx.Response(400, json={"error": "invalid_request"}),
+])
+def test_transient_failure_keeps_tokens(db, linked_user, token_endpoint, response):
+    token_endpoint(response)
+
+    with pytest.raises(HTTPException) as raised:
+        refresh(db, linked_user)
+
+    assert raised.value.status_code == 503
+    db.refresh(linked_user)
+    assert linked_user.yandex_oauth_refresh_token == "refresh"
+    assert linked_user.yandex_oauth_access_token == "old-access"
@@ -0,0 +1,67 @@
+"""
+Local stand-in for the Yandex Dialogs skill callback API.
+
+Accepts POST /api/v1/skills/{skill_id}/callback/state and logs each batch, so
+state notifications can be tested without the real platform:
+
+    python -m tools.yandex_callback_stub --port 9000 --fail-rate 0.2
+    YANDEX_DIALOGS_API_BASE_URL=http://localhost:9000 YANDEX_SKILL_ID=test YANDEX_SKILL_OAUTH_TOKEN=test ...
+
+--fail-rate answers that share of requests with 503 to exercise retries.
+"""
+import argparse
+import json
+import logging
+import random
+import re
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("yandex_callback_stub")
+
+CALLBACK_PATH = re.compile(r"^/api/v1/skills/([^/]+)/callback/state$")
+
+
+class CallbackHandler(BaseHTTPRequestHandler):
+    fail_rate = 0.0
+
+    def do_POST(self):
+        match = CALLBACK_PATH.match(self.path)
+        if not match:
+            self._reply(404, {"status": "error", "error_message": "not found"})
+            return
+        if not self.headers.get("Authorization", "").startswith("OAuth "):
+            self._reply(401, {"status": "error", "error_message": "missing OAuth token"})
+            return
+        if random.random() < self.fail_rate:
+            self._reply(503, {"status": "error", "error_message": "simulated failure"})
+            return
+
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        devices = body["payload"]["devices"]
+        logger.info(f"skill {match.group(1)} user {body['payload']['user_id']}: {len(devices)} device(s) {json.dumps(devices)}")
+        self._reply(202, {"request_id": self.headers.get("X-Request-Id", ""), "status": "ok"})
+
+    def _reply(self, code: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass  # Requests are logged in do_POST
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    CallbackHandler.fail_rate = args.fail_rate
+    server = ThreadingHTTPServer((args.host, args.port), CallbackHandler)
+    logger.info(f"Listening on http://{args.host}:{args.port}")
+    server.serve_forever()